@@ -0,0 +1,92 @@
+#!/usr/bin/python3 -B
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'tests')))
+
+from support import StubBot, trace_peak_memory
+
+from cassie.modules import cyclic_pattern
+
+SIZES = (64, 1024, 4096, cyclic_pattern.MAX_PATTERN_SIZE)
+
+def clear_caches():
+	cyclic_pattern.metasploit_pattern.cache_clear()
+	cyclic_pattern.metasploit_pattern_index.cache_clear()
+	cyclic_pattern.de_bruijn_pattern.cache_clear()
+
+def measure(name, callback, iterations, setup=None, operations=1):
+	"""
+	Run *callback* the specified number of times and measure its throughput
+	and the peak memory it allocates.
+	"""
+	elapsed = 0.0
+	for _ in range(iterations):
+		if setup is not None:
+			setup()
+		start_time = time.perf_counter()
+		callback()
+		elapsed += time.perf_counter() - start_time
+	if setup is not None:
+		setup()
+	peak_memory = trace_peak_memory(callback)
+	return {
+		'name': name,
+		'iterations': iterations,
+		'ops_per_sec': (iterations * operations) / elapsed if elapsed else float('inf'),
+		'mean_ms': (elapsed / iterations) * 1000,
+		'peak_memory_kb': peak_memory / 1024.0
+	}
+
+def run_benchmarks(iterations):
+	results = []
+	bot = StubBot()
+	module = cyclic_pattern.Module(bot)
+
+	results.append(measure('metasploit_pattern (cold)', cyclic_pattern.metasploit_pattern, iterations, setup=clear_caches))
+	for size in SIZES:
+		results.append(measure("create_cyclic_pattern size={0}".format(size), lambda: cyclic_pattern.create_cyclic_pattern(size), iterations))
+
+	results.append(measure('metasploit_pattern_index (cold)', cyclic_pattern.metasploit_pattern_index, iterations, setup=clear_caches))
+	pattern = cyclic_pattern.metasploit_pattern()
+	for length in (4, 8):
+		values = [pattern[offset:offset + length] for offset in range(len(pattern) - length + 1)]
+		def find_all():
+			for offset, value in enumerate(values):
+				if cyclic_pattern.find_cyclic_pattern_offset(value) != offset:
+					raise RuntimeError('incorrect offset for: ' + value)
+		results.append(measure("find_cyclic_pattern_offset length={0} (all positions)".format(length), find_all, iterations, operations=len(values)))
+
+	registers = ['0x' + pattern[offset:offset + 4][::-1].encode('latin-1').hex() for offset in range(0, len(pattern) - 3, 97)]
+	def search_registers():
+		for register in registers:
+			module.cmd_cyclic_pattern(['-p', register], None, False)
+	results.append(measure('cmd_cyclic_pattern --pattern (registers)', search_registers, iterations, operations=len(registers)))
+
+	for size in SIZES:
+		results.append(measure("cmd_cyclic_pattern --code size={0}".format(size), lambda: module.cmd_cyclic_pattern(['-s', str(size), '--code'], None, False), iterations))
+
+	results.append(measure('de_bruijn_pattern (cold)', cyclic_pattern.de_bruijn_pattern, iterations, setup=clear_caches))
+	bot.close()
+	return results
+
+def main():
+	parser = argparse.ArgumentParser(description='Cassie: Cyclic Pattern Benchmarks', conflict_handler='resolve')
+	parser.add_argument('-i', '--iterations', dest='iterations', type=int, default=5, help='the number of times to run each benchmark')
+	parser.add_argument('--json', dest='json', action='store_true', default=False, help='write the results as json')
+	arguments = parser.parse_args()
+
+	results = run_benchmarks(arguments.iterations)
+	if arguments.json:
+		print(json.dumps(results, indent=2))
+		return os.EX_OK
+	print("{0:<56} {1:>14} {2:>12} {3:>14}".format('benchmark', 'ops/sec', 'mean (ms)', 'peak mem (KB)'))
+	for result in results:
+		print("{name:<56} {ops_per_sec:>14,.1f} {mean_ms:>12.3f} {peak_memory_kb:>14,.1f}".format(**result))
+	return os.EX_OK
+
+if __name__ == '__main__':
+	sys.exit(main())
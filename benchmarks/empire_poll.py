@@ -0,0 +1,117 @@
+#!/usr/bin/python3 -B
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'tests')))
+
+from support import StubBot, trace_peak_memory
+
+from cassie.bot import users
+from cassie.modules import empire
+from empire_mock_server import MockEmpireServer
+
+SCENARIOS = (
+	# users, servers, agents per server
+	(1, 1, 10),
+	(10, 1, 10),
+	(10, 10, 100),
+	(50, 5, 1000),
+	(100, 10, 2000)
+)
+
+def setup_module(servers, user_count, shared, latency, failure_rate):
+	bot = StubBot()
+	module = empire.Module(bot)
+	module.update_options({'room': 'benchmark@conference.localhost'})
+	for idx in range(user_count):
+		name = "user{0}@localhost".format(idx)
+		bot.authorized_users[name] = users.User(name, users.LVL_USER)
+		server = servers[idx % len(servers)]
+		server.latency = latency
+		server.failure_rate = failure_rate
+		storage = module.get_storage(name)
+		storage['url'] = server.url
+		# without sharing, each user has their own account so every user is polled
+		storage['user'] = server.username if shared else server.username + '-' + name
+		storage['pass'] = server.password
+	return bot, module
+
+def accept_any_account(server):
+	# every user is given a unique account, so accept any username with the password
+	original_dispatch = server.dispatch
+	def dispatch(method, path, token, body):
+		if method == 'POST' and path == ['admin', 'login'] and body.get('password') == server.password:
+			body = dict(body, username=server.username)
+		return original_dispatch(method, path, token, body)
+	server.dispatch = dispatch
+
+def measure_poll(module, servers, cycles):
+	"""
+	Run the specified number of poll cycles, each after the agents have
+	checked in. The first cycle logs in and reports every agent as new so it
+	is measured separately.
+	"""
+	start_time = time.perf_counter()
+	module._empire_poll()
+	first_cycle = time.perf_counter() - start_time
+	elapsed = 0.0
+	for _ in range(cycles):
+		for server in servers:
+			server.check_in(0.9)
+		start_time = time.perf_counter()
+		module._empire_poll()
+		elapsed += time.perf_counter() - start_time
+	peak_memory = trace_peak_memory(module._empire_poll)
+	return first_cycle, (elapsed / cycles if cycles else 0.0), peak_memory
+
+def run_benchmarks(cycles, shared, latency, failure_rate):
+	results = []
+	for user_count, server_count, agent_count in SCENARIOS:
+		servers = [MockEmpireServer(port=0, agents=agent_count) for _ in range(server_count)]
+		for server in servers:
+			accept_any_account(server)
+		bot, module = setup_module(servers, user_count, shared, latency, failure_rate)
+		requests_before = sum(server.requests for server in servers)
+		first_cycle, mean_cycle, peak_memory = measure_poll(module, servers, cycles)
+		results.append({
+			'users': user_count,
+			'servers': server_count,
+			'agents': agent_count * server_count,
+			'first_cycle_ms': first_cycle * 1000,
+			'mean_cycle_ms': mean_cycle * 1000,
+			'requests_per_cycle': (sum(server.requests for server in servers) - requests_before) / (cycles + 2.0),
+			'peak_memory_kb': peak_memory / 1024.0,
+			'reports': len(bot.sent)
+		})
+		module.unload()
+		bot.close()
+		for server in servers:
+			server.stop()
+	return results
+
+def main():
+	parser = argparse.ArgumentParser(description='Cassie: Empire Poll Benchmarks', conflict_handler='resolve')
+	parser.add_argument('-c', '--cycles', dest='cycles', type=int, default=5, help='the number of poll cycles to measure for each scenario')
+	parser.add_argument('-l', '--latency', dest='latency', type=float, default=0.0, help='the number of seconds the mock servers delay each response')
+	parser.add_argument('-f', '--failure-rate', dest='failure_rate', type=float, default=0.0, help='the fraction of requests the mock servers fail')
+	parser.add_argument('--shared', dest='shared', action='store_true', default=False, help='users on the same server share one account')
+	parser.add_argument('--json', dest='json', action='store_true', default=False, help='write the results as json')
+	arguments = parser.parse_args()
+
+	logging.getLogger('cassie').setLevel(logging.CRITICAL)
+	logging.captureWarnings(True)
+	results = run_benchmarks(arguments.cycles, arguments.shared, arguments.latency, arguments.failure_rate)
+	if arguments.json:
+		print(json.dumps(results, indent=2))
+		return os.EX_OK
+	print("{0:>6} {1:>8} {2:>8} {3:>16} {4:>15} {5:>14} {6:>14}".format('users', 'servers', 'agents', 'first cycle (ms)', 'mean cycle (ms)', 'requests/cycle', 'peak mem (KB)'))
+	for result in results:
+		print("{users:>6,} {servers:>8,} {agents:>8,} {first_cycle_ms:>16.1f} {mean_cycle_ms:>15.1f} {requests_per_cycle:>14.1f} {peak_memory_kb:>14,.1f}".format(**result))
+	return os.EX_OK
+
+if __name__ == '__main__':
+	sys.exit(main())
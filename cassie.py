@@ -85,7 +85,8 @@ def main():
 		config.get('xmpp.jid'),
 		config.get('xmpp.password'),
 		config.get('xmpp.admin'),
-		config.get('core.users_file')
+		config.get('core.users_file'),
+		options=config.get('core')
 	)
 	if config.has_option('xmpp.chat_room'):
 		cassie_bot.chat_room_join(config.get('xmpp.chat_room'))
@@ -1,4 +1,3 @@
-import copy
 import textwrap
 
 from cassie.errors import CassieCommandError
@@ -18,18 +17,26 @@ class ArgumentParserLite(object):
 		self.__arguments__ = {}
 		self.__positionals__ = []
 		self.ignore_urls = True
+		self._help = None
+		self._usage = None
 
-	def format_usage(self):
-		self_arguments = copy.deepcopy(self.__arguments__)
-		usage = 'usage: ' + self.prog
-		args = self_arguments.keys()
-		args = list(filter(lambda arg: arg.startswith('-'), args))
+	def _argument_names(self):
+		args = list(filter(lambda arg: arg.startswith('-'), self.__arguments__.keys()))
 		args.sort()
 		args.extend(self.__positionals__)
+		seen = set()
 		for arg in args:
-			if not arg in self_arguments:
+			arg_desc = self.__arguments__[arg]
+			if id(arg_desc) in seen:
 				continue
-			arg_desc = self_arguments[arg]
+			seen.add(id(arg_desc))
+			yield arg, arg_desc
+
+	def format_usage(self):
+		if self._usage is not None:
+			return self._usage
+		usage = 'usage: ' + self.prog
+		for arg, arg_desc in self._argument_names():
 			if len(usage.split('\n')[-1]) > MAX_WIDTH:
 				usage += '\n' + (' ' * len('usage: ' + self.prog))
 			if arg_desc['action'] != 'store':
@@ -38,24 +45,17 @@ class ArgumentParserLite(object):
 				usage += ' [' + arg.upper() + ']'
 			else:
 				usage += ' [' + arg + ' ' + arg_desc['dest'].upper() + ']'
-			for arg in arg_desc['__aliases__']:
-				del self_arguments[arg]
+		self._usage = usage
 		return usage
 
 	def format_help(self):
-		self_arguments = copy.deepcopy(self.__arguments__)
+		if self._help is not None:
+			return self._help
 		help_text = self.format_usage() + '\n\n'
 		if self.description:
 			help_text += self.description + '\n\n'
 		help_text += 'arguments:\n'
-		args = self_arguments.keys()
-		args = list(filter(lambda arg: arg.startswith('-'), args))
-		args.sort()
-		args.extend(self.__positionals__)
-		for arg in args:
-			if not arg in self_arguments:
-				continue
-			arg_desc = self_arguments[arg]
+		for arg, arg_desc in self._argument_names():
 			arg_string = ' ' + ', '.join(arg_desc['__aliases__'])
 			if arg_desc['action'] == 'store':
 				if not arg_desc['choices']:
@@ -79,29 +79,28 @@ class ArgumentParserLite(object):
 					arg_string += '\n'
 			arg_string += word + ' ' + '\n'
 			help_text += arg_string
-			for arg in arg_desc['__aliases__']:
-				del self_arguments[arg]
 		if self.epilog:
 			help_text += '\n' + self.epilog
+		self._help = help_text
 		return help_text
 
 	def parse_args(self, args, raise_exception=True):
-		already_done = []
+		# the argument specification is shared between calls so all parse state is local
 		last_argument = None
-		self_arguments = copy.deepcopy(self.__arguments__)
+		positionals = iter(self.__positionals__)
 		results = ArgumentContainer()
 		for arg in args:
-			if last_argument == None and not arg in self_arguments:
+			if last_argument == None and not arg in self.__arguments__:
 				if arg in ['-h', '--help']:
 					raise CassieCommandError(self.format_help())
 				arg = str(arg)
 				if self.ignore_urls and arg.startswith('<http') and arg.endswith('>'):
 					continue
-				if len(self.__positionals__) == 0:
+				last_argument = next(positionals, None)
+				if last_argument is None:
 					raise CassieCommandError('error: unrecognized argument: ' + arg)
-				last_argument = self.__positionals__.pop(0)
 			if last_argument:
-				arg_desc = self_arguments[last_argument]
+				arg_desc = self.__arguments__[last_argument]
 				try:
 					typed_arg = arg_desc['type'](arg)
 				except:
@@ -112,20 +111,17 @@ class ArgumentParserLite(object):
 				last_argument = None
 				continue
 			else:
-				arg_desc = self_arguments[arg]
+				arg_desc = self.__arguments__[arg]
 			if arg_desc['action'] == 'store_true':
 				results[arg_desc['dest']] = True
 			elif arg_desc['action'] == 'store_false':
 				results[arg_desc['dest']] = False
 			else:
 				last_argument = arg
-			already_done.append(arg)
 		if last_argument:
 			raise CassieCommandError('error: argument ' + last_argument + ': expected one argument')
 
-		for arg in already_done:
-			del self_arguments[arg]
-		for arg, arg_desc in self_arguments.items():
+		for arg, arg_desc in self.__arguments__.items():
 			if arg_desc['dest'] in results:
 				continue
 			if arg_desc['required']:
@@ -173,3 +169,5 @@ class ArgumentParserLite(object):
 			raise ValueError('invalid type: ' + str(kwargs['type']))
 		for name in args:
 			self.__arguments__[name] = kwargs
+		self._help = None
+		self._usage = None
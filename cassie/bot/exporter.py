@@ -0,0 +1,111 @@
+import http.server
+import logging
+import os
+import time
+
+from cassie.imcontent import render_cache
+from cassie.utils import start_http_server
+
+try:
+	import psutil
+except ImportError:
+	psutil = None
+
+def escape_label(value):
+	return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class MetricsExporter(object):
+	"""
+	Export the bot's runtime statistics in the Prometheus text exposition
+	format from an HTTP listener which runs on its own thread.
+	"""
+	def __init__(self, bot, host='127.0.0.1', port=9100):
+		self.bot = bot
+		self.logger = logging.getLogger('cassie.bot.exporter')
+		self.process = psutil.Process(os.getpid()) if psutil else None
+		exporter = self
+
+		class RequestHandler(http.server.BaseHTTPRequestHandler):
+			def do_GET(self):
+				if self.path.split('?', 1)[0] != '/metrics':
+					self.send_error(404)
+					return
+				try:
+					body = exporter.render().encode('utf-8')
+				except Exception:
+					exporter.logger.error('failed to render the metrics', exc_info=True)
+					self.send_error(500)
+					return
+				self.send_response(200)
+				self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, format, *args):
+				exporter.logger.debug('metrics request from ' + self.address_string() + ': ' + (format % args))
+
+		self.server = start_http_server((host, port), RequestHandler, name='metrics-exporter')
+		self.logger.info("serving metrics on {0}:{1}".format(host, self.server.server_address[1]))
+
+	def stop(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+	def render(self):
+		bot = self.bot
+		lines = []
+
+		def add(name, metric_type, help_text, samples):
+			lines.append('# HELP ' + name + ' ' + help_text)
+			lines.append('# TYPE ' + name + ' ' + metric_type)
+			for labels, value in samples:
+				if labels:
+					label_string = ','.join("{0}=\"{1}\"".format(key, escape_label(str(label))) for key, label in labels)
+					lines.append("{0}{{{1}}} {2}".format(name, label_string, value))
+				else:
+					lines.append("{0} {1}".format(name, value))
+
+		records = dict(bot.records)
+		add('cassie_messages_total', 'counter', 'The number of messages processed.', [((), records['message count'])])
+		add('cassie_failed_messages_total', 'counter', 'The number of messages which failed to be processed.', [((), records['failed message count'])])
+		add('cassie_throttled_messages_total', 'counter', 'The number of messages dropped by the rate limiter.', [((), bot.rate_limiter.throttled_count)])
+		add('cassie_start_time_seconds', 'gauge', 'The time the bot was initialized.', [((), records['init time'])])
+		add('cassie_last_connect_time_seconds', 'gauge', 'The time the last XMPP session was established.', [((), records['last connect time'])])
+
+		histograms, counters = bot.metrics.snapshot()
+		samples = []
+		for summary in histograms:
+			for quantile, value in (('0.5', summary.p50), ('0.95', summary.p95), ('0.99', summary.p99)):
+				samples.append(((('name', summary.name), ('quantile', quantile)), value))
+		add('cassie_latency_seconds', 'summary', 'The latency of commands, handlers and rendering.', samples)
+		for summary in histograms:
+			lines.append("cassie_latency_seconds_sum{{name=\"{0}\"}} {1}".format(escape_label(summary.name), summary.total))
+			lines.append("cassie_latency_seconds_count{{name=\"{0}\"}} {1}".format(escape_label(summary.name), summary.count))
+		add('cassie_events_total', 'counter', 'The number of occurrences of named events such as handler errors.', [((('name', name),), value) for name, value in counters])
+
+		add('cassie_render_cache_requests_total', 'counter', 'The number of rendered content cache lookups.', [
+			((('result', 'hit'),), render_cache.hits),
+			((('result', 'miss'),), render_cache.misses)
+		])
+		add('cassie_render_cache_entries', 'gauge', 'The number of entries in the rendered content cache.', [((), len(render_cache))])
+
+		job_manager = bot.job_manager
+		add('cassie_jobs', 'gauge', 'The number of scheduled jobs.', [
+			((('state', 'enabled'),), job_manager.job_count_enabled()),
+			((('state', 'total'),), job_manager.job_count())
+		])
+		add('cassie_command_queue_depth', 'gauge', 'The number of commands waiting to be executed.', [((), len(bot.command_workers))])
+		add('cassie_custom_message_handlers', 'gauge', 'The number of registered custom message handlers.', [((), len(bot.custom_message_handlers))])
+		add('cassie_authorized_users', 'gauge', 'The number of authorized users.', [((), bot.authorized_users.count_users())])
+		add('cassie_joined_rooms', 'gauge', 'The number of joined chat rooms.', [((), len(bot.plugin['xep_0045'].getJoinedRooms()))])
+		add('cassie_loaded_modules', 'gauge', 'The number of loaded modules.', [((), len(bot.bot_modules))])
+
+		if self.process is not None:
+			with self.process.oneshot():
+				memory_info = self.process.memory_info()
+				cpu_times = self.process.cpu_times()
+			add('process_resident_memory_bytes', 'gauge', 'Resident memory size in bytes.', [((), memory_info.rss)])
+			add('process_cpu_seconds_total', 'counter', 'Total user and system CPU time spent in seconds.', [((), cpu_times.user + cpu_times.system)])
+		add('process_uptime_seconds', 'gauge', 'The number of seconds since the bot was initialized.', [((), time.time() - records['init time'])])
+		return '\n'.join(lines) + '\n'
@@ -0,0 +1,197 @@
+import heapq
+import itertools
+import threading
+import time
+import uuid
+
+class CustomMessageHandler(object):
+	__slots__ = ('callback', 'expiration', 'handler_id', 'lifespan', 'predicate', 'priority', 'session_id')
+	def __init__(self, session_id, callback, expiration, lifespan=None, priority=0, predicate=None):
+		self.session_id = session_id
+		self.callback = callback
+		self.expiration = expiration
+		self.handler_id = uuid.uuid4()
+		self.lifespan = lifespan
+		"""When set, the number of seconds the expiration is extended by each time the handler is used."""
+		self.priority = priority
+		"""Handlers with a higher priority are offered messages first."""
+		self.predicate = predicate
+		"""When set, a function called with the message and JID which determines if the handler accepts it."""
+
+	def matches(self, message, jid):
+		return self.predicate is None or self.predicate(message, jid)
+
+class CustomMessageHandlerRegistry(object):
+	"""
+	A thread safe collection of custom message handlers which are indexed by
+	both their session and their unique ID. Each session has a chain of
+	handlers ordered by priority and a message is passed to the first one
+	which accepts it, so multiple modules can handle a session's messages at
+	the same time. Expirations are tracked in a min-heap so expired handlers
+	can be removed without checking every handler. Heap entries are not
+	removed when a handler is deleted or its expiration is extended, instead
+	they are checked when they are popped.
+	"""
+	def __init__(self):
+		self._lock = threading.RLock()
+		self._counter = itertools.count()
+		self._expirations = []
+		self._handlers = {}
+		self._sessions = {}
+
+	def __contains__(self, session_id):
+		return session_id in self._sessions
+
+	def __len__(self):
+		return len(self._handlers)
+
+	def _push_expiration(self, handler):
+		heapq.heappush(self._expirations, (handler.expiration, next(self._counter), handler.handler_id))
+		# drop the stale entries once they outnumber the live ones
+		if len(self._expirations) > 64 and len(self._expirations) > len(self._handlers) * 2:
+			self._expirations = [entry for entry in self._expirations if entry[2] in self._handlers]
+			heapq.heapify(self._expirations)
+
+	def _remove(self, handler):
+		del self._handlers[handler.handler_id]
+		chain = self._sessions[handler.session_id]
+		if len(chain) == 1:
+			del self._sessions[handler.session_id]
+		else:
+			# chains are replaced rather than modified so they can be iterated without the lock
+			self._sessions[handler.session_id] = tuple(item for item in chain if item is not handler)
+
+	def add(self, session_id, callback, lifespan, reset_expiration=True, priority=0, predicate=None):
+		"""
+		Add a handler to a session's chain, replacing any existing handler in
+		the chain which uses the same callback. Handlers with the same
+		priority are offered messages in the order they were added.
+
+		:param str session_id: The session to handle messages for.
+		:param function callback: The function to call with messages.
+		:param float lifespan: The number of seconds until the handler expires.
+		:param bool reset_expiration: Whether to extend the expiration each time the handler is used.
+		:param int priority: The priority of the handler within the session's chain.
+		:param function predicate: An optional function to determine which messages the handler accepts.
+		:return: The new handler.
+		:rtype: :py:class:`.CustomMessageHandler`
+		"""
+		handler = CustomMessageHandler(session_id, callback, time.monotonic() + lifespan, (lifespan if reset_expiration else None), priority, predicate)
+		with self._lock:
+			for existing in self._sessions.get(session_id, ()):
+				if existing.callback == callback:
+					self._remove(existing)
+			chain = self._sessions.get(session_id, ()) + (handler,)
+			self._sessions[session_id] = tuple(sorted(chain, key=lambda item: -item.priority))
+			self._handlers[handler.handler_id] = handler
+			self._push_expiration(handler)
+		return handler
+
+	def get(self, handler_id):
+		"""
+		Get a handler by its ID. Expired handlers are not returned.
+
+		:param handler_id: The ID of the handler to get.
+		:type handler_id: str, :py:class:`uuid.UUID`
+		:return: The handler if it exists.
+		:rtype: :py:class:`.CustomMessageHandler`
+		"""
+		if not isinstance(handler_id, uuid.UUID):
+			handler_id = uuid.UUID(handler_id)
+		handler = self._handlers.get(handler_id)
+		if handler is None or handler.expiration <= time.monotonic():
+			return None
+		return handler
+
+	def get_chain(self, session_id):
+		"""
+		Get the handlers for a session which have not expired in the order they
+		are offered messages.
+
+		:param str session_id: The session of the handlers to get.
+		:rtype: tuple
+		"""
+		now = time.monotonic()
+		return tuple(handler for handler in self._sessions.get(session_id, ()) if handler.expiration > now)
+
+	def dispatch(self, session_id, message, jid):
+		"""
+		Find the handler in a session's chain which accepts a message. The
+		expiration of the handler is extended if it has a lifespan.
+
+		:param str session_id: The session the message belongs to.
+		:param str message: The message to find a handler for.
+		:param jid: The JID the message is from.
+		:return: The handler if one accepted the message.
+		:rtype: :py:class:`.CustomMessageHandler`
+		"""
+		chain = self._sessions.get(session_id)
+		if chain is None:
+			return None
+		now = time.monotonic()
+		for handler in chain:
+			if handler.expiration <= now:
+				continue
+			if not handler.matches(message, jid):
+				continue
+			if handler.lifespan is not None:
+				# the heap entry is updated when it is popped
+				handler.expiration = now + handler.lifespan
+			return handler
+		return None
+
+	def remove(self, handler_id):
+		"""
+		Remove a handler by its ID.
+
+		:param handler_id: The ID of the handler to remove.
+		:type handler_id: str, :py:class:`uuid.UUID`
+		:return: The handler which was removed if it existed.
+		:rtype: :py:class:`.CustomMessageHandler`
+		"""
+		if not isinstance(handler_id, uuid.UUID):
+			handler_id = uuid.UUID(handler_id)
+		with self._lock:
+			handler = self._handlers.get(handler_id)
+			if handler is not None:
+				self._remove(handler)
+			return handler
+
+	def remove_callback(self, session_id, callback):
+		"""
+		Remove the handler in a session's chain which uses a callback. Handlers
+		which other modules added to the session are not removed.
+
+		:param str session_id: The session of the handler to remove.
+		:param function callback: The callback of the handler to remove.
+		:return: The handler which was removed if it existed.
+		:rtype: :py:class:`.CustomMessageHandler`
+		"""
+		with self._lock:
+			for handler in self._sessions.get(session_id, ()):
+				if handler.callback == callback:
+					self._remove(handler)
+					return handler
+			return None
+
+	def reap(self):
+		"""
+		Remove all of the handlers which have expired.
+
+		:return: The handlers which were removed.
+		:rtype: list
+		"""
+		now = time.monotonic()
+		expired = []
+		with self._lock:
+			while self._expirations and self._expirations[0][0] <= now:
+				_, _, handler_id = heapq.heappop(self._expirations)
+				handler = self._handlers.get(handler_id)
+				if handler is None:
+					continue
+				if handler.expiration > now:
+					self._push_expiration(handler)
+					continue
+				self._remove(handler)
+				expired.append(handler)
+		return expired
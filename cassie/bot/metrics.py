@@ -0,0 +1,111 @@
+import collections
+import contextlib
+import threading
+import time
+
+HistogramSummary = collections.namedtuple('HistogramSummary', ('name', 'count', 'total', 'maximum', 'p50', 'p95', 'p99'))
+
+class LatencyHistogram(object):
+	"""
+	Track the latency of an operation. The total number of samples is
+	maintained along with a bounded window of the most recent samples which
+	percentiles are calculated from.
+	"""
+	__slots__ = ('count', 'maximum', 'samples', 'total')
+	def __init__(self, window=1024):
+		self.count = 0
+		self.maximum = 0.0
+		self.total = 0.0
+		self.samples = collections.deque(maxlen=window)
+
+	def record(self, elapsed):
+		self.count += 1
+		self.total += elapsed
+		if elapsed > self.maximum:
+			self.maximum = elapsed
+		self.samples.append(elapsed)
+
+	@property
+	def average(self):
+		if not self.count:
+			return 0.0
+		return self.total / self.count
+
+	def percentiles(self, *percents):
+		samples = sorted(self.samples)
+		if not samples:
+			return tuple(0.0 for _ in percents)
+		return tuple(samples[min(len(samples) - 1, int(len(samples) * percent / 100.0))] for percent in percents)
+
+class Metrics(object):
+	"""
+	A thread safe collection of latency histograms and counters which are
+	keyed by name.
+	"""
+	def __init__(self, window=1024):
+		self.window = window
+		self.counters = collections.Counter()
+		self.histograms = {}
+		self._lock = threading.Lock()
+
+	def increment(self, name, value=1):
+		with self._lock:
+			self.counters[name] += value
+
+	def record(self, name, elapsed):
+		with self._lock:
+			histogram = self.histograms.get(name)
+			if histogram is None:
+				histogram = LatencyHistogram(self.window)
+				self.histograms[name] = histogram
+			histogram.record(elapsed)
+
+	@contextlib.contextmanager
+	def timer(self, name):
+		start_time = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.record(name, time.perf_counter() - start_time)
+
+	def snapshot(self):
+		"""
+		Take a consistent copy of the collected metrics.
+
+		:return: A list of histogram summaries and a list of counters, both sorted by name.
+		:rtype: tuple
+		"""
+		with self._lock:
+			histograms = [HistogramSummary(name, histogram.count, histogram.total, histogram.maximum, *histogram.percentiles(50, 95, 99)) for name, histogram in self.histograms.items()]
+			counters = list(self.counters.items())
+		histograms.sort(key=lambda summary: summary.name)
+		counters.sort()
+		return histograms, counters
+
+	def report(self, prefix=None):
+		"""
+		Generate a summary of the collected metrics as lines of text. Latency
+		values are represented in milliseconds.
+
+		:param str prefix: An optional prefix which names must start with to be included.
+		:return: The summary lines.
+		:rtype: list
+		"""
+		histograms, counters = self.snapshot()
+		lines = []
+		for summary in histograms:
+			if prefix and not summary.name.startswith(prefix):
+				continue
+			lines.append("{0}: count: {1:,} p50: {2:.1f}ms p95: {3:.1f}ms p99: {4:.1f}ms max: {5:.1f}ms".format(
+				summary.name,
+				summary.count,
+				summary.p50 * 1000,
+				summary.p95 * 1000,
+				summary.p99 * 1000,
+				summary.maximum * 1000
+			))
+		for name, value in counters:
+			if prefix and not name.startswith(prefix):
+				continue
+			lines.append("{0}: {1:,}".format(name, value))
+		return lines
@@ -0,0 +1,92 @@
+import collections
+import threading
+import time
+
+class TokenBucket(object):
+	__slots__ = ('burst', 'notified', 'rate', 'timestamp', 'tokens')
+	def __init__(self, rate, burst, timestamp=None):
+		self.rate = float(rate)
+		"""The number of tokens which are added to the bucket every second."""
+		self.burst = float(burst)
+		"""The maximum number of tokens which the bucket can hold."""
+		self.tokens = self.burst
+		self.timestamp = time.monotonic() if timestamp is None else timestamp
+		self.notified = False
+		"""Whether the owner has been notified that they are being throttled."""
+
+	def consume(self, now, tokens=1):
+		self.tokens = min(self.burst, self.tokens + ((now - self.timestamp) * self.rate))
+		self.timestamp = now
+		if self.tokens < tokens:
+			return False
+		self.tokens -= tokens
+		self.notified = False
+		return True
+
+	def is_full(self, now):
+		return self.tokens + ((now - self.timestamp) * self.rate) >= self.burst
+
+class RateLimiter(object):
+	"""
+	Limit the rate at which messages are processed using token buckets which
+	are keyed by an identifier such as a bare JID. The rate and burst size of
+	each bucket is determined by the name of the level it is checked with.
+	"""
+	def __init__(self, limits, max_buckets=4096, max_throttled=100):
+		"""
+		:param dict limits: A dictionary of level names to dictionaries with *rate* and *burst* keys.
+		:param int max_buckets: The number of buckets to hold before pruning idle ones.
+		:param int max_throttled: The number of keys with the most throttled messages to keep counts for when pruning.
+		"""
+		self.limits = {}
+		for level_name, limit in (limits or {}).items():
+			if not limit:
+				continue
+			self.limits[level_name] = (float(limit['rate']), float(limit.get('burst', limit['rate'])))
+		self.max_buckets = max_buckets
+		self.max_throttled = max_throttled
+		self.throttled = collections.Counter()
+		"""A counter of the number of messages which have been throttled by key, only the top keys are kept when pruning."""
+		self.throttled_count = 0
+		"""The total number of messages which have been throttled."""
+		self._buckets = {}
+		self._lock = threading.Lock()
+
+	def __len__(self):
+		return len(self._buckets)
+
+	def check(self, key, level_name):
+		"""
+		Check if a message from *key* is permitted and if so consume a token
+		from its bucket. If the level has no limit configured, the message is
+		always permitted.
+
+		:param str key: The identifier to rate limit.
+		:param str level_name: The name of the level to use the limit of.
+		:return: The bucket if the message was throttled, otherwise None.
+		:rtype: :py:class:`.TokenBucket`
+		"""
+		limit = self.limits.get(level_name)
+		if limit is None:
+			return None
+		now = time.monotonic()
+		with self._lock:
+			bucket = self._buckets.get(key)
+			if bucket is None or bucket.rate != limit[0] or bucket.burst != limit[1]:
+				if len(self._buckets) >= self.max_buckets:
+					self._prune(now)
+				bucket = TokenBucket(limit[0], limit[1], timestamp=now)
+				self._buckets[key] = bucket
+			if bucket.consume(now):
+				return None
+			self.throttled[key] += 1
+			self.throttled_count += 1
+		return bucket
+
+	def _prune(self, now):
+		# buckets which have refilled are identical to new ones and can be dropped
+		for key in [key for key, bucket in self._buckets.items() if bucket.is_full(now)]:
+			del self._buckets[key]
+		# the counts are pruned with the buckets so they do not grow with every key which has been throttled
+		if len(self.throttled) > self.max_throttled:
+			self.throttled = collections.Counter(dict(self.throttled.most_common(self.max_throttled)))
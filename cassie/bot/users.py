@@ -1,22 +1,138 @@
+import copy
 import logging
 import os
 import pickle
+import sqlite3
+import threading
 
 LVL_ADMIN = 0
 LVL_USER = 100
 LVL_ROOM = LVL_USER
 LVL_GUEST = 1000
 
+def track(value, callback):
+	if isinstance(value, dict) and not isinstance(value, TrackedDict):
+		return TrackedDict(value, callback)
+	if isinstance(value, list) and not isinstance(value, TrackedList):
+		return TrackedList(value, callback)
+	return value
+
+def _tracked_method(method):
+	def wrapper(self, *args, **kwargs):
+		result = method(self, *args, **kwargs)
+		self._callback()
+		return result
+	wrapper.__name__ = method.__name__
+	return wrapper
+
+class TrackedDict(dict):
+	"""
+	A dictionary which calls *callback* when it or any of the dictionaries and
+	lists it contains are modified. It is pickled as a standard dictionary.
+	"""
+	__slots__ = ('_callback',)
+	def __init__(self, data=None, callback=None):
+		super(TrackedDict, self).__init__()
+		self._callback = callback or (lambda: None)
+		for key, value in dict(data or {}).items():
+			dict.__setitem__(self, key, track(value, self._callback))
+
+	def __reduce__(self):
+		return (dict, (), None, None, iter(self.items()))
+
+	def __setitem__(self, key, value):
+		dict.__setitem__(self, key, track(value, self._callback))
+		self._callback()
+
+	def setdefault(self, key, default=None):
+		if key not in self:
+			self[key] = default
+		return self[key]
+
+	def update(self, *args, **kwargs):
+		for key, value in dict(*args, **kwargs).items():
+			dict.__setitem__(self, key, track(value, self._callback))
+		self._callback()
+
+	__delitem__ = _tracked_method(dict.__delitem__)
+	clear = _tracked_method(dict.clear)
+	pop = _tracked_method(dict.pop)
+	popitem = _tracked_method(dict.popitem)
+
+class TrackedList(list):
+	"""
+	A list which calls *callback* when it or any of the dictionaries and lists
+	it contains are modified. It is pickled as a standard list.
+	"""
+	__slots__ = ('_callback',)
+	def __init__(self, data=None, callback=None):
+		self._callback = callback or (lambda: None)
+		super(TrackedList, self).__init__(track(value, self._callback) for value in (data or ()))
+
+	def __reduce__(self):
+		return (list, (list(self),))
+
+	def __setitem__(self, index, value):
+		if isinstance(index, slice):
+			value = [track(item, self._callback) for item in value]
+		else:
+			value = track(value, self._callback)
+		list.__setitem__(self, index, value)
+		self._callback()
+
+	def __iadd__(self, values):
+		self.extend(values)
+		return self
+
+	def append(self, value):
+		list.append(self, track(value, self._callback))
+		self._callback()
+
+	def extend(self, values):
+		list.extend(self, [track(value, self._callback) for value in values])
+		self._callback()
+
+	def insert(self, index, value):
+		list.insert(self, index, track(value, self._callback))
+		self._callback()
+
+	__delitem__ = _tracked_method(list.__delitem__)
+	__imul__ = _tracked_method(list.__imul__)
+	clear = _tracked_method(list.clear)
+	pop = _tracked_method(list.pop)
+	remove = _tracked_method(list.remove)
+	reverse = _tracked_method(list.reverse)
+	sort = _tracked_method(list.sort)
+
 class User(object):
-	__slots__ = ('level', 'name', 'storage')
+	__slots__ = ('_on_change', '_storage', 'level', 'name')
 	type = 'user'
 	def __init__(self, name, level=LVL_GUEST):
+		self._on_change = None
 		self.name = name
 		"""The unique name of this user."""
 		self.level = level
 		"""The users permission level."""
 		self.storage = {}
-		"""A dictionary which can be used by modules to store arbitrary details about a user."""
+
+	@property
+	def storage(self):
+		"""
+		A dictionary which can be used by modules to store arbitrary details
+		about a user. Changes to it, including to nested dictionaries and lists,
+		mark the user as needing to be saved.
+		"""
+		return self._storage
+
+	@storage.setter
+	def storage(self, value):
+		self._storage = TrackedDict(value, self._storage_changed)
+		self._storage_changed()
+
+	def _storage_changed(self):
+		on_change = getattr(self, '_on_change', None)
+		if on_change is not None:
+			on_change(self)
 
 	def is_admin(self):
 		return self.level == LVL_ADMIN
@@ -37,45 +153,216 @@ class Room(User):
 		super(Room, self).__init__(name, level)
 
 class UserManager(object):
-	__slots__ = ('_users', 'filename', 'logger')
+	"""
+	A dictionary-like collection of authorized users which are persisted to a
+	SQLite database. Users are loaded from the database the first time they
+	are accessed and only users which have changed are written when the
+	database is saved. The top level keys of each user's storage are indexed
+	so the users which have data for a module can be found without loading
+	the others.
+	"""
+	__slots__ = ('_connection', '_deleted', '_dirty', '_lock', '_unloaded', '_users', 'filename', 'logger')
 	def __init__(self, filename):
 		self.logger = logging.getLogger('cassie.bot.user_manager')
 		self.filename = os.path.abspath(filename)
+		self._deleted = set()
+		self._dirty = set()
+		self._lock = threading.RLock()
+		self._unloaded = set()
 		self._users = {}
-		if not os.path.isfile(self.filename):
+		legacy_users = None
+		if os.path.isfile(self.filename) and not is_sqlite_file(self.filename):
+			legacy_users = self._load_legacy()
+		elif not os.path.isfile(self.filename):
 			self.logger.warning('starting with empty authorized users because no file found')
-			return
+		self._connection = sqlite3.connect(self.filename, check_same_thread=False)
+		self._connection.execute('PRAGMA journal_mode=WAL')
+		self._connection.execute('CREATE TABLE IF NOT EXISTS users (name TEXT PRIMARY KEY, level INTEGER NOT NULL, storage BLOB NOT NULL)')
+		index_exists = self._connection.execute('SELECT COUNT(*) FROM sqlite_master WHERE type = \'table\' AND name = \'storage_keys\'').fetchone()[0]
+		self._connection.execute('CREATE TABLE IF NOT EXISTS storage_keys (name TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (key, name))')
+		self._connection.commit()
+		if not index_exists:
+			self._index_storage_keys()
+		if legacy_users is not None:
+			for name, user in legacy_users.items():
+				self[name] = user
+			self.save()
+			self.logger.warning("migrated {0:,} authorized users from the legacy pickle file".format(len(legacy_users)))
+		self._unloaded.update(name for (name,) in self._connection.execute('SELECT name FROM users') if name not in self._users)
+		self.logger.info("successfully found {0:,} authorized users".format(len(self)))
+
+	def _index_storage_keys(self):
+		# databases which were created before the storage keys were indexed are indexed once
+		rows = []
+		for name, storage in self._connection.execute('SELECT name, storage FROM users'):
+			rows.extend((name, key) for key in pickle.loads(storage))
+		with self._connection:
+			self._connection.executemany('INSERT OR REPLACE INTO storage_keys (name, key) VALUES (?, ?)', rows)
+
+	def _load_legacy(self):
 		with open(self.filename, 'rb') as file_h:
-			self._users = pickle.load(file_h)
-		self.logger.info("successfully loaded {0:,} authorized users".format(len(self._users)))
-		for user in self._users.values():
-			if not getattr(user, 'storage', None):
-				user.storage = {}
+			legacy_users = pickle.load(file_h)
+		for user in legacy_users.values():
+			user.storage = getattr(user, '_storage', None) or {}
+		backup_filename = self.filename + '.bak'
+		os.rename(self.filename, backup_filename)
+		self.logger.warning('moved the legacy pickle file to: ' + backup_filename)
+		return legacy_users
+
+	def _load_users(self, name=None):
+		if name is None:
+			rows = self._connection.execute('SELECT name, level, storage FROM users').fetchall()
+		else:
+			rows = self._connection.execute('SELECT name, level, storage FROM users WHERE name = ?', (name,)).fetchall()
+		for name, level, storage in rows:
+			if name not in self._unloaded:
+				continue
+			self._unloaded.remove(name)
+			user = User(name, level)
+			user.storage = pickle.loads(storage)
+			user._on_change = self._mark_dirty
+			self._users[name] = user
+
+	def _mark_dirty(self, user):
+		with self._lock:
+			self._dirty.add(user.name)
 
 	def __contains__(self, item):
-		return item in self._users
+		return item in self._users or item in self._unloaded
 
 	def __delitem__(self, item):
-		del self._users[item]
+		with self._lock:
+			if item in self._unloaded:
+				self._unloaded.remove(item)
+			else:
+				del self._users[item]
+			self._deleted.add(item)
+			self._dirty.discard(item)
 
 	def __getitem__(self, item):
-		return self._users[item]
+		with self._lock:
+			if item in self._unloaded:
+				self._load_users(item)
+			return self._users[item]
 
 	def __setitem__(self, item, value):
-		self._users[item] = value
+		with self._lock:
+			self._unloaded.discard(item)
+			self._users[item] = value
+			value._on_change = self._mark_dirty
+			self._dirty.add(item)
 
 	def __iter__(self):
-		return iter(self._users.values())
+		with self._lock:
+			if self._unloaded:
+				self._load_users()
+			return iter(list(self._users.values()))
 
 	def __len__(self):
-		return len(self._users)
+		return len(self._users) + len(self._unloaded)
+
+	def count_users(self):
+		"""
+		Count the users, excluding rooms, without loading them from the
+		database. Only users are saved, so the users which have not been
+		loaded yet are all counted.
+
+		:rtype: int
+		"""
+		with self._lock:
+			return len(self._unloaded) + sum(1 for user in self._users.values() if user.type == 'user')
+
+	def get_rooms(self):
+		"""
+		Get the rooms, they are never saved so this does not load any users
+		from the database.
+
+		:rtype: list
+		"""
+		with self._lock:
+			return [user for user in self._users.values() if user.type == 'room']
+
+	def get_with_storage(self, key):
+		"""
+		Get the users and rooms which have *key* in their storage. Only the
+		users which have it are loaded from the database.
+
+		:param str key: The storage key to find, typically the name of a module.
+		:rtype: list
+		"""
+		with self._lock:
+			for (name,) in self._connection.execute('SELECT name FROM storage_keys WHERE key = ?', (key,)).fetchall():
+				if name in self._unloaded:
+					self._load_users(name)
+			return [user for user in self._users.values() if key in user.storage]
 
 	def get(self, item, default=None):
-		return self._users.get(item, default)
+		try:
+			return self[item]
+		except KeyError:
+			return default
+
+	def mark_dirty(self, item):
+		"""
+		Mark a user as needing to be saved. This is only necessary for changes
+		which are not made to the user's storage such as the level.
+
+		:param str item: The name of the user.
+		"""
+		self._mark_dirty(self[item])
+
+	def close(self):
+		with self._lock:
+			self._connection.close()
 
 	def save(self):
-		with open(self.filename, 'wb') as file_h:
-			pickle.dump(dict((u, ud) for u, ud in self._users.items() if ud.type == 'user'), file_h)
+		"""
+		Write the users which have changed since they were last loaded or saved
+		to the database in a single transaction. This is called periodically by
+		the bot so changes are persisted shortly after they are made. The
+		storage of each user is copied with the lock held and serialized
+		without it so the users can still be accessed while they are saved.
+		"""
+		with self._lock:
+			dirty, self._dirty = self._dirty, set()
+			deleted, self._deleted = self._deleted, set()
+			snapshots = []
+			for name in dirty:
+				user = self._users.get(name)
+				if user is None or user.type != 'user':
+					continue
+				try:
+					storage = copy.deepcopy(user.storage)
+				except RuntimeError:
+					# the storage was modified by another thread while it was copied
+					self._dirty.add(name)
+					continue
+				snapshots.append((name, user.level, storage))
+		try:
+			rows = [(name, level, pickle.dumps(storage, protocol=pickle.HIGHEST_PROTOCOL)) for name, level, storage in snapshots]
+			if not (rows or deleted):
+				return
+			names = [(name,) for name in deleted] + [(row[0],) for row in rows]
+			keys = [(name, key) for name, _, storage in snapshots for key in storage]
+			with self._lock:
+				with self._connection:
+					self._connection.executemany('DELETE FROM users WHERE name = ?', [(name,) for name in deleted])
+					self._connection.executemany('DELETE FROM storage_keys WHERE name = ?', names)
+					self._connection.executemany('INSERT OR REPLACE INTO users (name, level, storage) VALUES (?, ?, ?)', rows)
+					self._connection.executemany('INSERT INTO storage_keys (name, key) VALUES (?, ?)', keys)
+		except:
+			# the changes are saved again next time
+			with self._lock:
+				self._dirty.update(name for name, _, _ in snapshots if name in self._users)
+				self._deleted.update(deleted)
+			raise
+		self.logger.debug("saved {0:,} changed and {1:,} deleted authorized users".format(len(rows), len(deleted)))
+
+def is_sqlite_file(filename):
+	if not os.path.getsize(filename):
+		return True
+	with open(filename, 'rb') as file_h:
+		return file_h.read(16) == b'SQLite format 3\x00'
 
 def get_level_by_name(name):
 	name = name.strip()
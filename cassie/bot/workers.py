@@ -0,0 +1,104 @@
+import collections
+import logging
+import threading
+
+class KeyedWorkerPool(object):
+	"""
+	A bounded pool of worker threads which execute tasks that are submitted
+	with a key. Tasks which share a key are executed one at a time in the order
+	they were submitted while tasks with different keys execute concurrently.
+	"""
+	def __init__(self, workers=4, queue_size=64, key_queue_size=8, name='worker'):
+		"""
+		:param int workers: The number of worker threads to start.
+		:param int queue_size: The maximum number of tasks waiting to be executed.
+		:param int key_queue_size: The maximum number of tasks waiting to be executed for a single key.
+		:param str name: The name prefix to use for the worker threads.
+		"""
+		self.logger = logging.getLogger('cassie.bot.workers')
+		self.queue_size = queue_size
+		self.key_queue_size = key_queue_size
+		self._lock = threading.Lock()
+		self._ready = collections.deque()
+		self._ready_condition = threading.Condition(self._lock)
+		self._pending = {}
+		self._queued = 0
+		self._running = True
+		self._threads = []
+		for idx in range(workers):
+			thread = threading.Thread(target=self._worker_routine, name="{0}-{1}".format(name, idx))
+			thread.daemon = True
+			thread.start()
+			self._threads.append(thread)
+
+	def __len__(self):
+		return self._queued
+
+	@property
+	def workers(self):
+		return len(self._threads)
+
+	def submit(self, key, callback, *args, **kwargs):
+		"""
+		Submit a task to be executed by the pool. If the pool is not running or
+		the queue limits have been reached, the task is not accepted.
+
+		:param key: The key which the task is ordered with.
+		:param function callback: The function to execute.
+		:return: Whether or not the task was accepted.
+		:rtype: bool
+		"""
+		with self._lock:
+			if not self._running:
+				return False
+			if self._queued >= self.queue_size:
+				return False
+			tasks = self._pending.get(key)
+			if tasks is None:
+				# the key is not being serviced, so schedule it
+				tasks = collections.deque()
+				self._pending[key] = tasks
+				self._ready.append(key)
+				self._ready_condition.notify()
+			elif len(tasks) >= self.key_queue_size:
+				return False
+			tasks.append((callback, args, kwargs))
+			self._queued += 1
+		return True
+
+	def stop(self, wait=True):
+		"""
+		Stop the pool from accepting new tasks. Tasks which have already been
+		accepted are still executed.
+
+		:param bool wait: Whether or not to wait for the worker threads to exit.
+		"""
+		with self._lock:
+			self._running = False
+			self._ready_condition.notify_all()
+		if wait:
+			current_thread = threading.current_thread()
+			for thread in self._threads:
+				if thread is not current_thread:
+					thread.join()
+
+	def _worker_routine(self):
+		while True:
+			with self._lock:
+				while self._running and not self._ready:
+					self._ready_condition.wait()
+				if not self._ready:
+					return
+				key = self._ready.popleft()
+				callback, args, kwargs = self._pending[key].popleft()
+				self._queued -= 1
+			try:
+				callback(*args, **kwargs)
+			except Exception as error:
+				self.logger.error('worker task ' + callback.__name__ + ' encountered exception: ' + error.__class__.__name__, exc_info=True)
+			with self._lock:
+				if self._pending[key]:
+					self._ready.append(key)
+					self._ready_condition.notify()
+				else:
+					del self._pending[key]
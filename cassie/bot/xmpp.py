@@ -1,4 +1,5 @@
 import collections
+import collections.abc
 import datetime
 import fnmatch
 import hashlib
@@ -8,21 +9,65 @@ import signal
 import ssl
 import sys
 import tempfile
-import threading
 import time
-import uuid
 
 from cassie import __version__
 from cassie.errors import *
-from cassie.imcontent import IMContentText, IMContentMarkdown
+from cassie.imcontent import IMContentText, IMContentMarkdown, render_cache
 from cassie.bot import users
+from cassie.bot.exporter import MetricsExporter
+from cassie.bot.handlers import CustomMessageHandlerRegistry
+from cassie.bot.metrics import Metrics
+from cassie.bot.ratelimit import RateLimiter
+from cassie.bot.workers import KeyedWorkerPool
 
 import sleekxmpp
 from smoke_zephyr.job import JobManager, JobRequestDelete
 
+def get_command_names(obj):
+	return [attribute[4:] for attribute in dir(obj) if attribute.startswith('cmd_')]
+
+def get_rate_limit_level(user):
+	if user is None:
+		return 'guest'
+	if user.type == 'room':
+		return 'room'
+	if user.is_admin():
+		return 'admin'
+	if user.is_user():
+		return 'user'
+	return 'guest'
+
+class CommandHandler(object):
+	__slots__ = ('callback', 'level', 'module', 'name')
+	def __init__(self, name, callback, level, module=None):
+		self.name = name
+		self.callback = callback
+		self.level = level
+		self.module = module
+
 class CassieXMPPBot(sleekxmpp.ClientXMPP):
-	def __init__(self, jid, password, admin, users_file, modules=None):
+	default_options = {
+		'command_queue_size': 64,
+		'command_user_queue_size': 8,
+		'command_workers': 4,
+		'message_interval': 0.5,
+		'message_max_size': 4000,
+		'metrics_exporter': None,
+		'metrics_log_interval': 900,
+		'rate_limits': {
+			'admin': None,
+			'user': {'rate': 1, 'burst': 10},
+			'guest': {'rate': 0.2, 'burst': 5},
+			'room': {'rate': 2, 'burst': 20}
+		},
+		'render_cache_size': 256,
+		'users_flush_interval': 30
+	}
+	def __init__(self, jid, password, admin, users_file, modules=None, options=None):
 		self.__shutdown__ = False
+		self.options = dict(self.default_options)
+		self.options.update(options or {})
 		sleekxmpp.ClientXMPP.__init__(self, jid, password)
 		self.register_plugin('xep_0004')  # data forms
 		self.register_plugin('xep_0030')  # service discovery
@@ -47,14 +92,32 @@ class CassieXMPPBot(sleekxmpp.ClientXMPP):
 		self.logger.info('bot has been successfully initialized')
 		self.job_manager = JobManager()
 		self.job_manager.start()
-
-		self.custom_message_handlers = {}
-		self.custom_message_handler_lock = threading.RLock()
+		self.job_manager.job_add(self.authorized_users_flush, seconds=self.options['users_flush_interval'])
+		self.command_workers = KeyedWorkerPool(
+			workers=self.options['command_workers'],
+			queue_size=self.options['command_queue_size'],
+			key_queue_size=self.options['command_user_queue_size'],
+			name='command-worker'
+		)
+		self.rate_limiter = RateLimiter(self.options['rate_limits'])
+		self.metrics = Metrics()
+		render_cache.max_size = self.options['render_cache_size']
+		if self.options['metrics_log_interval']:
+			self.job_manager.job_add(self.metrics_log, seconds=self.options['metrics_log_interval'])
+		self.metrics_exporter = None
+
+		self.custom_message_handlers = CustomMessageHandlerRegistry()
 		self.custom_message_handler_reaper_job_id = None
 
 		self.bot_modules = modules or []
 		self.command_permissions = collections.defaultdict(lambda: users.LVL_ADMIN)
+		self.command_handlers = {}
 		self.command_handler_set_permission('help', 'user')
+		self.command_handlers = self.command_registry_build(self.bot_modules)
+
+		exporter_options = self.options['metrics_exporter']
+		if exporter_options:
+			self.metrics_exporter = MetricsExporter(self, exporter_options.get('host', '127.0.0.1'), exporter_options.get('port', 9100))
 
 	def chat_room_join(self, room, permissions=users.LVL_ROOM):
 		if room in self.plugin['xep_0045'].getJoinedRooms():
@@ -81,12 +144,7 @@ class CassieXMPPBot(sleekxmpp.ClientXMPP):
 		self.send_presence()
 		self.get_roster()
 		self.logger.info('a session to the XMPP server has been established')
-		rooms_to_rejoin = []
-		for room in self.authorized_users:
-			if room.type != 'room':
-				continue
-			rooms_to_rejoin.append(room)
-		for room in rooms_to_rejoin:
+		for room in self.authorized_users.get_rooms():
 			self.chat_room_leave(room.name)
 			self.chat_room_join(room.name, room.level)
 
@@ -97,8 +155,14 @@ class CassieXMPPBot(sleekxmpp.ClientXMPP):
 		jid = msg['from']
 		if msg['type'] in ('chat', 'normal'):
 			if not jid.bare in self.authorized_users:
-				msg.reply('You Are Not Authorized To Use This Service. Registration Is Currently Closed.').send()
-				self.logger.warning('unauthorized user \'' + jid.bare + '\' sent a message')
+				# unauthorized users are limited before they are replied to so they can not flood through the bot
+				bucket = self.rate_limiter.check(jid.bare, 'guest')
+				if bucket is None:
+					msg.reply('You Are Not Authorized To Use This Service. Registration Is Currently Closed.').send()
+					self.logger.warning('unauthorized user \'' + jid.bare + '\' sent a message')
+				elif not bucket.notified:
+					bucket.notified = True
+					self.logger.warning('throttled messages from unauthorized user \'' + jid.bare + '\'')
 				return
 		elif msg['type'] == 'groupchat':
 			if jid.resource == self.boundjid.user:
@@ -107,8 +171,10 @@ class CassieXMPPBot(sleekxmpp.ClientXMPP):
 				return
 		else:
 			return
+		if not self._rate_limit_check(msg):
+			return
 
-		session_id = str(jid)  # session_id as used in the AIML brain
+		session_id = self._get_session_id(msg)
 		if message[0] in ('!', '/'):
 			self.message_command(msg)
 			return
@@ -122,25 +188,12 @@ class CassieXMPPBot(sleekxmpp.ClientXMPP):
 			if len(message) != 2:
 				return
 			message = message[1]
-			session_id = str(jid.bare)
-
-		with self.custom_message_handler_lock:
-			if session_id in self.custom_message_handlers:
-				expiration = self.custom_message_handlers[session_id]['expiration']
-				if expiration <= datetime.datetime.utcnow():
-					self.custom_message_handler_del(jid=session_id)
-				else:
-					handler_info = self.custom_message_handlers[session_id]
-					custom_handler = handler_info['callback']
-					if isinstance(handler_info['lifespan'], datetime.timedelta): # if the lifespan is set, adjust the expiration
-						handler_info['expiration'] = datetime.datetime.utcnow() + handler_info['lifespan']
-					try:
-						response = custom_handler(message, jid, handler_info['handler_id'])
-					except Exception as err:
-						self.logger.error('custom message handler error - name: ' + custom_handler.__name__ + ' jid: ' + str(jid.jid) + ' exception: ' + err.__class__.__name__, exc_info=True)
-						response = 'the message handler encountered an error'
-					self.send_message_formatted(jid, response, msg['type'])
-					return
+
+		handler = self.custom_message_handlers.dispatch(session_id, message, jid)
+		if handler is not None:
+			if not self.command_workers.submit(session_id, self._custom_handler_execute, handler.callback, handler.handler_id, message, msg):
+				msg.reply('Busy, Try Again Later').send()
+			return
 
 		message_body = message.replace('\'', '').replace('-', '')
 		self.records['message count'] += 1
@@ -148,10 +201,59 @@ class CassieXMPPBot(sleekxmpp.ClientXMPP):
 		self.records['failed message count'] += 1
 		return
 
+	def _custom_handler_execute(self, custom_handler, handler_id, message, msg):
+		jid = msg['from']
+		metric_name = 'custom handler.' + custom_handler.__name__
+		try:
+			with self.metrics.timer(metric_name):
+				response = custom_handler(message, jid, handler_id)
+				self.send_message_formatted(jid, response, msg['type'])
+			return
+		except Exception as err:
+			self.metrics.increment(metric_name + ' errors')
+			self.logger.error('custom message handler error - name: ' + custom_handler.__name__ + ' jid: ' + str(jid.jid) + ' exception: ' + err.__class__.__name__, exc_info=True)
+		self.send_message_formatted(jid, 'the message handler encountered an error', msg['type'])
+
+	def _rate_limit_check(self, msg):
+		jid = msg['from']
+		if msg['type'] == 'groupchat':
+			guser = jid.resource + '@' + jid.server.split('.', 1)[-1]
+			checks = ((jid.bare, 'room'), (guser, get_rate_limit_level(self.authorized_users.get(guser))))
+		else:
+			checks = ((jid.bare, get_rate_limit_level(self.authorized_users.get(jid.bare))),)
+		for key, level_name in checks:
+			bucket = self.rate_limiter.check(key, level_name)
+			if bucket is None:
+				continue
+			if not bucket.notified:
+				# the bucket is notified once until it permits a message again
+				bucket.notified = True
+				self.logger.debug('throttled messages from ' + str(jid) + ' due to the rate limit for ' + key)
+				if msg['type'] != 'groupchat':
+					msg.reply('Rate Limit Exceeded, Slow Down').send()
+			return False
+		return True
+
+	def _get_session_id(self, msg):
+		# commands and custom handler input share the session handlers are registered under so
+		# they are executed in order, in group chats the session is the room
+		if msg['type'] == 'groupchat':
+			return str(msg['from'].bare)
+		return str(msg['from'])
+
 	def module_load(self, module_name, config=None):
 		self.logger.info('loading xmpp module: ' + module_name)
 		try:
 			module = __import__('cassie.modules.' + module_name, None, None, ['Module'])
+		except Exception as err:
+			self.logger.error('loading module: ' + module_name + ' failed with error: ' + err.__class__.__name__, exc_info=True)
+			return False
+		# check for collisions before the module is initialized and sets any permissions
+		collisions = [command for command in get_command_names(module.Module) if command in self.command_handlers]
+		if collisions:
+			self.logger.error('loading module: ' + module_name + ' failed due to command name collisions: ' + ', '.join(collisions))
+			return False
+		try:
 			module_instance = module.Module(self)
 		except Exception as err:
 			self.logger.error('loading module: ' + module_name + ' failed with error: ' + err.__class__.__name__, exc_info=True)
@@ -159,32 +261,89 @@ class CassieXMPPBot(sleekxmpp.ClientXMPP):
 		if config:
 			module_instance.update_options(config)
 		self.bot_modules.append(module_instance)
+		self.command_handlers = self.command_registry_build(self.bot_modules)
+		return True
+
+	def module_unload(self, module_name):
+		for module_instance in self.bot_modules:
+			if module_instance.name == module_name:
+				break
+		else:
+			return False
+		self.logger.info('unloading xmpp module: ' + module_name)
+		self.bot_modules.remove(module_instance)
+		self.command_handlers = self.command_registry_build(self.bot_modules)
+		try:
+			module_instance.unload()
+		except Exception as err:
+			self.logger.error('unloading module: ' + module_name + ' failed with error: ' + err.__class__.__name__, exc_info=True)
 		return True
 
 	def send_message_formatted(self, mto, mbody, mtype=None):
+		"""
+		Send a message which is rendered as XHTML. Messages which are larger
+		than the configured maximum size are split on line boundaries, or
+		block boundaries for markdown, into multiple stanzas. If *mbody* is an
+		iterator such as a generator, each item is sent as it is produced.
+
+		The interval between stanzas is slept in the calling thread, when that
+		is a command worker the session's next task waits until the entire
+		message has been sent.
+		"""
+		if isinstance(mbody, collections.abc.Iterator):
+			sent = False
+			for part in mbody:
+				if not part:
+					continue
+				if sent:
+					time.sleep(self.options['message_interval'])
+				sent = self.send_message_formatted(mto, part, mtype)
+			return sent
 		if not mbody:
-			return
+			return False
 		if not isinstance(mbody, (IMContentMarkdown, IMContentText)):
 			mbody = IMContentText(mbody)
 		mbody.font = 'Monospace'
 		if mtype == 'groupchat':
-			self.send_message(mto.bare, mbody.get_text(), mtype=mtype, mhtml=mbody.get_xhtml())
-		else:
-			self.send_message(mto, mbody.get_text(), mtype=mtype, mhtml=mbody.get_xhtml())
-		return
+			mto = mto.bare
+		chunks = mbody.split(self.options['message_max_size'])
+		for idx, chunk in enumerate(chunks):
+			if idx:
+				time.sleep(self.options['message_interval'])
+			with self.metrics.timer('render'):
+				text = chunk.get_text()
+				xhtml = chunk.get_xhtml()
+			self.send_message(mto, text, mtype=mtype, mhtml=xhtml)
+		if len(chunks) > 1:
+			self.metrics.increment('chunked messages')
+		return True
+
+	def authorized_users_flush(self):
+		try:
+			self.authorized_users.save()
+		except Exception:
+			self.logger.error('failed to flush the authorized users to file', exc_info=True)
+
+	def metrics_log(self):
+		lines = self.metrics.report()
+		if lines:
+			self.logger.info('metrics summary:\n  ' + '\n  '.join(lines))
+
+	def command_registry_build(self, modules):
+		registry = {}
+		for module in [None] + list(modules):
+			source = self if module is None else module
+			for command in get_command_names(source):
+				if command in registry:
+					raise CassieError('command name collision: ' + command)
+				registry[command] = CommandHandler(command, getattr(source, 'cmd_' + command), self.command_permissions[command], module)
+		return registry
 
 	def command_handler_get(self, command, userlvl):
-		if userlvl > self.command_permissions[command]:
+		cmd_handler = self.command_handlers.get(command)
+		if cmd_handler is None or userlvl > cmd_handler.level:
 			return None
-		cmd_handler = None
-		if hasattr(self, 'cmd_' + command):
-			cmd_handler = getattr(self, 'cmd_' + command)
-		else:
-			for module in self.bot_modules:
-				if module.has_command(command):
-					cmd_handler = module.get_command_handler(command)
-					break
-		return cmd_handler
+		return cmd_handler.callback
 
 	def command_handler_set_permission(self, command, userlvl):
 		if isinstance(userlvl, str):
@@ -192,6 +351,9 @@ class CassieXMPPBot(sleekxmpp.ClientXMPP):
 		elif not isinstance(userlvl, int):
 			raise TypeError('invalid userlvl type')
 		self.command_permissions[command] = userlvl
+		cmd_handler = self.command_handlers.get(command)
+		if cmd_handler is not None:
+			cmd_handler.level = userlvl
 
 	def message_command(self, msg):
 		message = msg['body']
@@ -222,14 +384,25 @@ class CassieXMPPBot(sleekxmpp.ClientXMPP):
 		if not cmd_handler:
 			msg.reply('Command Not Found').send()
 			return
+		if not self.command_workers.submit(self._get_session_id(msg), self._command_execute, cmd_handler, command, arguments, msg):
+			self.logger.warning('rejected command: ' + command + ' for user ' + jid.bare + ' because the queue is full')
+			msg.reply('Busy, Try Again Later').send()
+		return
+
+	def _command_execute(self, cmd_handler, command, arguments, msg):
+		jid = msg['from']
+		metric_name = 'command.' + command
 		try:
-			response = cmd_handler(arguments, jid, (msg['type'] == 'groupchat'))
-			self.send_message_formatted(jid, response, msg['type'])
+			# generators produce the response as it is sent, so sending is included in the time
+			with self.metrics.timer(metric_name):
+				response = cmd_handler(arguments, jid, (msg['type'] == 'groupchat'))
+				self.send_message_formatted(jid, response, msg['type'])
 			return
 		except CassieCommandError as error:
 			self.logger.warning('command error command: ' + command + ' for user ' + jid.bare)
 			self.send_message_formatted(jid, error.message, msg['type'])
 		except Exception as error:
+			self.metrics.increment(metric_name + ' errors')
 			error_message = getattr(error, 'message', 'N/A')
 			msg.reply('Failed To Execute Command, Error Name: ' + error.__class__.__name__ + ' Message: ' + error_message).send()
 			self.logger.error('failed to execute command: ' + command + ' for user ' + jid.bare)
@@ -241,95 +414,77 @@ class CassieXMPPBot(sleekxmpp.ClientXMPP):
 
 		response = 'Cassie Version: ' + __version__ + '\nAvailable Commands:\n'
 		commands = []
-		for command in dir(self):
-			if not command.startswith('cmd_'):
-				continue
-			command = command[4:]
-			if self.command_handler_get(command, user.level):
+		for command, cmd_handler in self.command_handlers.items():
+			if command != 'help' and user.level <= cmd_handler.level:
 				commands.append(command)
-		for module in self.bot_modules:
-			for command in module.commands:
-				if self.command_handler_get(command, user.level):
-					commands.append(command)
-		if 'help' in commands:
-			commands.remove('help')
 		response += '\n'.join(commands)
 		return response
 
-	def custom_message_handler_add(self, jid, callback, expiration, reset_expiration=True):
+	def custom_message_handler_add(self, jid, callback, expiration, reset_expiration=True, priority=0, predicate=None):
+		"""
+		Add a handler which receives the messages from a session instead of
+		them being processed as commands. A session can have multiple handlers,
+		each message is passed to the handler with the highest priority whose
+		*predicate* accepts it. Messages which no handler accepts are processed
+		normally.
+
+		:param jid: The JID of the session, the bare JID for chat rooms.
+		:param function callback: The function to call with the message, JID and handler ID.
+		:param expiration: The lifespan of the handler in seconds.
+		:type expiration: int, float, :py:class:`datetime.timedelta`
+		:param bool reset_expiration: Whether to extend the expiration each time the handler is used.
+		:param int priority: The priority of the handler in the session's chain.
+		:param function predicate: An optional function called with the message and JID to determine if the handler accepts it.
+		:return: The ID of the new handler.
+		:rtype: :py:class:`uuid.UUID`
+		"""
 		jid = str(jid)
-		handler_id = None
-		if isinstance(expiration, (int, float)):
-			lifespan = datetime.timedelta(0, expiration)
-			expiration = datetime.datetime.utcnow() + lifespan
-		elif isinstance(expiration, datetime.timedelta):
-			lifespan = expiration
-			expiration = datetime.datetime.utcnow() + expiration
-		else:
+		if isinstance(expiration, datetime.timedelta):
+			expiration = expiration.total_seconds()
+		elif not isinstance(expiration, (int, float)):
 			raise Exception('unknown expiration format')
-		with self.custom_message_handler_lock:
-			handler_id = uuid.uuid4()
-			self.logger.debug('setting custom message handler for ' + jid + ' to ' + callback.__name__)
-			if not reset_expiration:
-				lifespan = None
-			self.custom_message_handlers[jid] = {'callback': callback, 'expiration': expiration, 'lifespan': lifespan, 'handler_id': handler_id}
+		self.logger.debug('setting custom message handler for ' + jid + ' to ' + callback.__name__)
+		handler = self.custom_message_handlers.add(jid, callback, expiration, reset_expiration=reset_expiration, priority=priority, predicate=predicate)
 		# start the reaper if necessary
 		if self.custom_message_handler_reaper_job_id is None:
 			self.custom_message_handler_reaper_job_id = self.job_manager.job_add(self.custom_message_handler_reaper, minutes=3)
 		elif not self.job_manager.job_exists(self.custom_message_handler_reaper_job_id):
 			self.custom_message_handler_reaper_job_id = self.job_manager.job_add(self.custom_message_handler_reaper, minutes=3)
-		return handler_id
+		return handler.handler_id
 
-	def custom_message_handler_exists(self, jid=None, handler_id=None):
+	def custom_message_handler_exists(self, jid=None, handler_id=None, callback=None):
 		if not (bool(jid) ^ bool(handler_id)):
 			raise Exception('specify either jid or handler_id')
-		with self.custom_message_handler_lock:
-			if jid:
-				if jid in self.custom_message_handlers:
-					return True
-			if handler_id:
-				if not isinstance(handler_id, uuid.UUID):
-					handler_id = uuid.UUID(handler_id)
-				for jid, handler in self.custom_message_handlers.items():
-					if handler['handler_id'] == handler_id:
-						return True
-		return False
-
-	def custom_message_handler_del(self, jid=None, handler_id=None, safe=False):
+		if jid:
+			# a session's chain can include handlers from other modules
+			if callback is None:
+				raise Exception('specify the callback of the handler with jid')
+			return any(handler.callback == callback for handler in self.custom_message_handlers.get_chain(str(jid)))
+		return self.custom_message_handlers.get(handler_id) is not None
+
+	def custom_message_handler_del(self, jid=None, handler_id=None, safe=False, callback=None):
 		if not (bool(jid) ^ bool(handler_id)):
 			raise Exception('specify either jid or handler_id')
-		with self.custom_message_handler_lock:
-			if jid:
-				jid = str(jid)
-				if jid in self.custom_message_handlers:
-					del self.custom_message_handlers[jid]
-					self.logger.debug('deleting custom message handler for ' + jid)
-					return
-			if handler_id:
-				if not isinstance(handler_id, uuid.UUID):
-					handler_id = uuid.UUID(handler_id)
-				for jid, handler in self.custom_message_handlers.items():
-					if handler['handler_id'] == handler_id:
-						del self.custom_message_handlers[jid]
-						self.logger.debug('deleting custom message handler for ' + jid)
-						return
+		if jid:
+			if callback is None:
+				raise Exception('specify the callback of the handler with jid')
+			handler = self.custom_message_handlers.remove_callback(str(jid), callback)
+		else:
+			handler = self.custom_message_handlers.remove(handler_id)
+		if handler is not None:
+			self.logger.debug('deleting custom message handler for ' + handler.session_id + ' to ' + handler.callback.__name__)
+			return
 		if safe:
 			self.logger.info('the specified custom message handler does not exist')
 			return
 		raise Exception('the specified custom message handler does not exist')
 
 	def custom_message_handler_reaper(self):
-		with self.custom_message_handler_lock:
-			handlers_for_removal = []
-			for jid, handler in self.custom_message_handlers.items():
-				expiration = handler['expiration']
-				if expiration <= datetime.datetime.utcnow():
-					handlers_for_removal.append(jid)
-			for jid in handlers_for_removal:
-				self.custom_message_handler_del(jid=jid)
-			if not self.custom_message_handlers:
-				self.custom_message_handler_reaper_job_id = None
-				return JobRequestDelete()
+		for handler in self.custom_message_handlers.reap():
+			self.logger.debug('deleting expired custom message handler for ' + handler.session_id)
+		if not len(self.custom_message_handlers):
+			self.custom_message_handler_reaper_job_id = None
+			return JobRequestDelete()
 		return None
 
 	def bot_run(self):
@@ -346,11 +501,15 @@ class CassieXMPPBot(sleekxmpp.ClientXMPP):
 			self.logger.warning('received SIGHUP signal, proceeding to stop')
 		self.__shutdown__ = True
 		self.disconnect()
+		self.command_workers.stop()
+		if self.metrics_exporter is not None:
+			self.metrics_exporter.stop()
 		try:
 			self.authorized_users.save()
 			self.logger.info('successfully dumped authorized users to file')
 		except:
 			self.logger.error('failed to dump authorized users to file on clean up')
+		self.authorized_users.close()
 		self.job_manager.stop()
 		sys.exit(1)
 
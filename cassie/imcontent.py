@@ -1,7 +1,63 @@
+import collections
+import copy
+import threading
+
 import markdown
 
 from sleekxmpp.xmlstream import ET
 
+class RenderCache(object):
+	"""
+	A thread safe, size bounded cache of rendered content which evicts the
+	least recently used entries.
+	"""
+	def __init__(self, max_size=256):
+		self.max_size = max_size
+		self.hits = 0
+		self.misses = 0
+		self._cache = collections.OrderedDict()
+		self._lock = threading.Lock()
+
+	def __len__(self):
+		return len(self._cache)
+
+	def clear(self):
+		with self._lock:
+			self._cache.clear()
+
+	def get(self, key):
+		with self._lock:
+			value = self._cache.get(key)
+			if value is None:
+				self.misses += 1
+				return None
+			self._cache.move_to_end(key)
+			self.hits += 1
+		return value
+
+	def set(self, key, value):
+		if self.max_size <= 0:
+			return
+		with self._lock:
+			self._cache[key] = value
+			self._cache.move_to_end(key)
+			while len(self._cache) > self.max_size:
+				self._cache.popitem(last=False)
+
+render_cache = RenderCache()
+
+_markdown_lock = threading.Lock()
+_markdown_html = markdown.Markdown(extensions=['nl2br'], output_format='html4')
+_markdown_xhtml = markdown.Markdown(extensions=['nl2br'], output_format='xhtml1')
+
+def _markdown_convert(converter, text):
+	# the converter instances are reused, so they must be reset after each use
+	with _markdown_lock:
+		try:
+			return converter.convert(text)
+		finally:
+			converter.reset()
+
 def normalize_text(text):
 	if isinstance(text, (list, tuple)):
 		text = '\n'.join(text)
@@ -11,10 +67,119 @@ def normalize_text(text):
 	return text
 
 def markdown_to_html(text):
-	return markdown.markdown(text, extensions=['nl2br'], output_format='html4')
+	return _markdown_convert(_markdown_html, text)
 
 def markdown_to_xhtml(text):
-	return markdown.markdown(text, extensions=['nl2br'], output_format='xhtml1')
+	return _markdown_convert(_markdown_xhtml, text)
+
+def split_text(text, max_size):
+	"""
+	Split text into chunks which are no larger than *max_size* characters.
+	Chunks are split on line boundaries unless a single line is too large, in
+	which case the line is split.
+
+	:param str text: The text to split.
+	:param int max_size: The maximum size of each chunk.
+	:return: The chunks of text.
+	:rtype: list
+	"""
+	if len(text) <= max_size:
+		return [text]
+	chunks = []
+	chunk = []
+	chunk_size = 0
+	for line in text.split('\n'):
+		while len(line) > max_size:
+			if chunk:
+				chunks.append('\n'.join(chunk))
+				chunk = []
+				chunk_size = 0
+			chunks.append(line[:max_size])
+			line = line[max_size:]
+		# account for the newline which joins the line to the chunk
+		if chunk and chunk_size + 1 + len(line) > max_size:
+			chunks.append('\n'.join(chunk))
+			chunk = []
+			chunk_size = 0
+		chunk_size += len(line) + (1 if chunk else 0)
+		chunk.append(line)
+	if chunk:
+		chunks.append('\n'.join(chunk))
+	return chunks
+
+def _get_fence(line):
+	stripped = line.lstrip()
+	for character in ('`', '~'):
+		if stripped.startswith(character * 3):
+			return stripped[:len(stripped) - len(stripped.lstrip(character))]
+	return None
+
+def _split_markdown_blocks(text):
+	# blocks are separated by blank lines except within fenced code blocks
+	blocks = []
+	block = []
+	fence = None
+	for line in text.split('\n'):
+		line_fence = _get_fence(line)
+		if fence is None:
+			if not line.strip():
+				if block:
+					blocks.append(block)
+					block = []
+				continue
+			fence = line_fence
+		elif line_fence is not None and line_fence.startswith(fence) and not line.strip()[len(line_fence):].strip():
+			fence = None
+		block.append(line)
+	if block:
+		blocks.append(block)
+	return blocks
+
+def _split_markdown_block(lines, max_size):
+	fence = _get_fence(lines[0])
+	if fence is None:
+		return split_text('\n'.join(lines), max_size)
+	opening = lines[0]
+	lines = lines[1:]
+	if lines and lines[-1].strip() == fence:
+		lines = lines[:-1]
+	# each chunk is wrapped in the fence so the code block is continued in the next one
+	chunks = split_text('\n'.join(lines), max(1, max_size - len(opening) - len(fence) - 2))
+	return [opening + '\n' + chunk + '\n' + fence for chunk in chunks]
+
+def split_markdown(text, max_size):
+	"""
+	Split markdown into chunks which are no larger than *max_size* characters.
+	Chunks are split on the blank lines between blocks, blocks which are too
+	large are split like :py:func:`.split_text` and fenced code blocks which
+	are split are closed at the end of a chunk and opened again at the start
+	of the next one.
+
+	:param str text: The markdown to split.
+	:param int max_size: The maximum size of each chunk.
+	:return: The chunks of markdown.
+	:rtype: list
+	"""
+	if len(text) <= max_size:
+		return [text]
+	chunks = []
+	chunk = ''
+	for block in _split_markdown_blocks(text):
+		block_text = '\n'.join(block)
+		if chunk and len(chunk) + 2 + len(block_text) <= max_size:
+			chunk += '\n\n' + block_text
+			continue
+		if chunk:
+			chunks.append(chunk)
+		if len(block_text) <= max_size:
+			chunk = block_text
+			continue
+		block_chunks = _split_markdown_block(block, max_size)
+		chunks.extend(block_chunks[:-1])
+		chunk = block_chunks[-1]
+	if chunk:
+		chunks.append(chunk)
+	return chunks
 
 class IMContentText(object):
 	def __init__(self, text, font=None, prepend_newline=False):
@@ -26,7 +191,39 @@ class IMContentText(object):
 	def get_text(self):
 		return self.text
 
+	def split(self, max_size):
+		"""
+		Split the content into multiple instances of the same type, each of
+		which has text no larger than *max_size* characters.
+
+		:param int max_size: The maximum size of each instance's text.
+		:return: The split content instances.
+		:rtype: list
+		"""
+		if not max_size or len(self.text) <= max_size:
+			return [self]
+		instances = []
+		for chunk in self._split_text(max_size):
+			instance = copy.copy(self)
+			instance.text = chunk
+			instances.append(instance)
+		return instances
+
+	def _split_text(self, max_size):
+		return split_text(self.text, max_size)
+
 	def get_xhtml(self, element=True):
+		cache_key = (self.__class__.__name__, self.text, self.font)
+		xhtml = render_cache.get(cache_key)
+		if xhtml is None:
+			xhtml = self._render_xhtml()
+			render_cache.set(cache_key, xhtml)
+		if element:
+			# callers may modify the element so the cached one is never returned
+			return copy.deepcopy(xhtml)
+		return ET.tostring(xhtml)
+
+	def _render_xhtml(self):
 		lines = self.text.split('\n')
 		xhtml = ET.Element('span')
 		if self.font:
@@ -37,18 +234,17 @@ class IMContentText(object):
 			ET.SubElement(xhtml, 'br')
 		p = ET.SubElement(xhtml, 'p')
 		p.text = lines[-1]
-		if element:
-			return xhtml
-		return ET.tostring(xhtml)
+		return xhtml
 
 class IMContentMarkdown(IMContentText):
-	def get_xhtml(self, element=True):
+	def _split_text(self, max_size):
+		return split_markdown(self.text, max_size)
+
+	def _render_xhtml(self):
 		xhtml = ET.XML(markdown_to_xhtml(self.text))
 		if self.font:
 			span = ET.Element('span')
 			span.set('style', 'font-family: ' + self.font + ';')
 			span.append(xhtml)
 			xhtml = span
-		if element:
-			return xhtml
-		return ET.tostring(xhtml)
+		return xhtml
@@ -4,22 +4,29 @@ import time
 
 from cassie import __version__
 from cassie.argparselite import ArgumentParserLite
+from cassie.imcontent import render_cache
 from cassie.templates import CassieXMPPBotModule
 
 MINUTE = 60
 HOUR = 60 * MINUTE
 DAY = 24 * HOUR
 
+bot_parser = ArgumentParserLite('bot', 'control the bot')
+bot_parser.add_argument('-l', '--log', dest='loglvl', action='store', default=None, help='set the bots logging level')
+bot_parser.add_argument('--shutdown', dest='stop', action='store_true', default=False, help='stop the bot from running')
+bot_parser.add_argument('--join', dest='chat_room_join', action='store', default=None, help='join a chat room')
+bot_parser.add_argument('--leave', dest='chat_room_leave', action='store', default=None, help='leave a chat room')
+bot_parser.add_argument('--load', dest='module_load', action='store', default=None, help='load a module with its default options')
+bot_parser.add_argument('--unload', dest='module_unload', action='store', default=None, help='unload a module')
+
+metrics_parser = ArgumentParserLite('metrics', 'show command and message handling latency')
+metrics_parser.add_argument('-f', '--filter', dest='prefix', action='store', default=None, help='only show metrics starting with this prefix')
+
 class Module(CassieXMPPBotModule):
 	def cmd_bot(self, args, jid, is_muc):
-		parser = ArgumentParserLite('bot', 'control the bot')
-		parser.add_argument('-l', '--log', dest='loglvl', action='store', default=None, help='set the bots logging level')
-		parser.add_argument('--shutdown', dest='stop', action='store_true', default=False, help='stop the bot from running')
-		parser.add_argument('--join', dest='chat_room_join', action='store', default=None, help='join a chat room')
-		parser.add_argument('--leave', dest='chat_room_leave', action='store', default=None, help='leave a chat room')
 		if not len(args):
-			return parser.format_help()
-		results = parser.parse_args(args)
+			return bot_parser.format_help()
+		results = bot_parser.parse_args(args)
 		response = ''
 		if results['loglvl']:
 			results['loglvl'] = results['loglvl'].upper()
@@ -36,10 +43,33 @@ class Module(CassieXMPPBotModule):
 		if results['chat_room_leave']:
 			self.bot.chat_room_leave(results['chat_room_leave'])
 			response += 'Left chat room: ' + results['chat_room_leave'] + '\n'
+		if results['module_unload']:
+			if results['module_unload'] == self.name:
+				response += 'Can not unload the module which controls the bot\n'
+			elif self.bot.module_unload(results['module_unload']):
+				response += 'Unloaded module: ' + results['module_unload'] + '\n'
+			else:
+				response += 'Module is not loaded: ' + results['module_unload'] + '\n'
+		if results['module_load']:
+			if any(module.name == results['module_load'] for module in self.bot.bot_modules):
+				response += 'Module is already loaded: ' + results['module_load'] + '\n'
+			elif self.bot.module_load(results['module_load']):
+				response += 'Loaded module: ' + results['module_load'] + '\n'
+			else:
+				response += 'Failed to load module: ' + results['module_load'] + '\n'
 		if results['stop']:
 			self.bot.bot_request_stop()
 		return response
 
+	def cmd_metrics(self, args, jid, is_muc):
+		results = metrics_parser.parse_args(args)
+		lines = self.bot.metrics.report(prefix=results['prefix'])
+		if not results['prefix']:
+			lines.append("render cache: entries: {0:,} hits: {1:,} misses: {2:,}".format(len(render_cache), render_cache.hits, render_cache.misses))
+		if not lines:
+			return 'No metrics have been recorded'
+		return '\n'.join(lines)
+
 	def cmd_info(self, args, jid, is_muc):
 		records = self.bot.records
 		now = int(time.time())
@@ -52,6 +82,10 @@ class Module(CassieXMPPBotModule):
 		if records['message count'] != 0:
 			response += "Message Success Rate: {:.2f}%\n".format((float(records['message count'] - records['failed message count']) / float(records['message count'])) * 100)
 		response += "Number of Jobs: Enabled: {:,} Total: {:,}\n".format(self.bot.job_manager.job_count_enabled(), self.bot.job_manager.job_count())
+		rate_limiter = self.bot.rate_limiter
+		response += "Number of Throttled Messages: {:,}\n".format(rate_limiter.throttled_count)
+		for key, count in rate_limiter.throttled.most_common(5):
+			response += "    {0}: {1:,}\n".format(key, count)
 		if len(self.bot.bot_modules):
 			response += 'Loaded Modules:'
 			response += '\n    ' + "\n    ".join(sorted(mod.name for mod in self.bot.bot_modules))
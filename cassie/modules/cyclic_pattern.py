@@ -1,48 +1,159 @@
+import binascii
+import functools
+import itertools
+import string
+
 from cassie.argparselite import ArgumentParserLite
 from cassie.templates import CassieXMPPBotModule
 
-# some clients don't like large messages
-MAX_PATTERN_SIZE = 4096
+METASPLOIT_CHARSETS = (string.ascii_uppercase, string.ascii_lowercase, string.digits)
+# the length of the pattern before it repeats, large responses are split into multiple messages by the bot
+MAX_PATTERN_SIZE = len(METASPLOIT_CHARSETS[0]) * len(METASPLOIT_CHARSETS[1]) * len(METASPLOIT_CHARSETS[2]) * 3
+MAX_DE_BRUIJN_SIZE = 65536
+DE_BRUIJN_ALPHABET = string.ascii_lowercase
+DE_BRUIJN_SUBSEQUENCE = 4
+
+@functools.lru_cache(maxsize=None)
+def metasploit_pattern():
+	"""
+	Generate the complete Metasploit compatible cyclic pattern. The result is
+	cached so the pattern is only generated once.
+
+	:return: The pattern.
+	:rtype: str
+	"""
+	return ''.join(ch1 + ch2 + ch3 for ch1, ch2, ch3 in itertools.product(*METASPLOIT_CHARSETS))
 
 def create_cyclic_pattern(size):
-	char1 = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
-	char2 = "abcdefghijklmnopqrstuvwxyz"
-	char3 = "0123456789"
-
-	charcnt = 0
-	pattern = ""
-	max = int(size)
-	while charcnt < max:
-		for ch1 in char1:
-			for ch2 in char2:
-				for ch3 in char3:
-					if charcnt < max:
-						pattern = pattern + ch1
-						charcnt = charcnt + 1
-					if charcnt < max:
-						pattern = pattern + ch2
-						charcnt = charcnt + 1
-					if charcnt < max:
-						pattern = pattern + ch3
-						charcnt = charcnt + 1
-	return pattern
+	pattern = metasploit_pattern()
+	size = int(size)
+	if size > len(pattern):
+		pattern = pattern * ((size // len(pattern)) + 1)
+	return pattern[:size]
+
+def build_pattern_index(pattern, subsequence=4):
+	index = {}
+	for offset in range(len(pattern) - subsequence + 1):
+		index.setdefault(pattern[offset:offset + subsequence], offset)
+	return index
+
+@functools.lru_cache(maxsize=None)
+def metasploit_pattern_index():
+	return build_pattern_index(metasploit_pattern())
+
+def find_cyclic_pattern_offset(value):
+	"""
+	Find the offset of *value* within the Metasploit compatible pattern using
+	a precomputed index of the offset of every 4 character subsequence.
+
+	:param str value: The pattern value to find.
+	:return: The offset or None if it could not be found.
+	:rtype: int
+	"""
+	offset = metasploit_pattern_index().get(value[:4])
+	if offset is None or metasploit_pattern()[offset:offset + len(value)] != value:
+		return None
+	return offset
+
+def _de_bruijn(alphabet, subsequence):
+	# generate the sequence using the algorithm by Fredricksen, Kessler and Maiorana
+	alphabet_size = len(alphabet)
+	a = [0] * (alphabet_size * subsequence)
+	def db(t, p):
+		if t > subsequence:
+			if subsequence % p == 0:
+				for idx in a[1:p + 1]:
+					yield alphabet[idx]
+		else:
+			a[t] = a[t - p]
+			yield from db(t + 1, p)
+			for j in range(a[t - p] + 1, alphabet_size):
+				a[t] = j
+				yield from db(t + 1, t)
+	return db(1, 1)
+
+@functools.lru_cache(maxsize=8)
+def de_bruijn_pattern(alphabet=DE_BRUIJN_ALPHABET, subsequence=DE_BRUIJN_SUBSEQUENCE):
+	"""
+	Generate a de Bruijn sequence in which every subsequence of the specified
+	length occurs exactly once. The sequence is limited to
+	:py:data:`MAX_DE_BRUIJN_SIZE` characters and is returned along with an
+	index of each subsequence to its offset. The result is cached.
+
+	:param str alphabet: The characters to use in the sequence.
+	:param int subsequence: The length of the unique subsequences.
+	:return: The sequence and the index of subsequence offsets.
+	:rtype: tuple
+	"""
+	pattern = ''.join(itertools.islice(_de_bruijn(alphabet, subsequence), MAX_DE_BRUIJN_SIZE))
+	return pattern, build_pattern_index(pattern, subsequence)
+
+def find_de_bruijn_offset(value, alphabet=DE_BRUIJN_ALPHABET, subsequence=DE_BRUIJN_SUBSEQUENCE):
+	pattern, index = de_bruijn_pattern(alphabet, subsequence)
+	offset = index.get(value[:subsequence])
+	if offset is None or pattern[offset:offset + len(value)] != value:
+		return None
+	return offset
+
+def parse_register_value(value, big_endian=False):
+	"""
+	Parse a pattern value which was either copied from a register as a 32 or
+	64-bit hex number, or from memory as a string of 4 or 8 characters. Some
+	values are valid as both, in which case the register interpretation is
+	first.
+
+	:param str value: The value to parse.
+	:param bool big_endian: Whether a register value is big endian.
+	:return: The candidate pattern characters.
+	:rtype: list
+	"""
+	candidates = []
+	hex_value = value[2:] if value.lower().startswith('0x') else value
+	if hex_value != value or len(value) in (8, 16):
+		try:
+			data = binascii.unhexlify(hex_value.zfill(8 if len(hex_value) <= 8 else 16))
+		except (binascii.Error, ValueError):
+			data = None
+		if data is not None:
+			candidates.append(data.decode('latin-1') if big_endian else data[::-1].decode('latin-1'))
+	if hex_value == value and len(value) in (4, 8):
+		candidates.append(value)
+	return candidates
+
+cyclic_pattern_parser = ArgumentParserLite('cyclic_pattern', 'create and search a cyclic pattern')
+cyclic_pattern_parser.add_argument('-s', '--size', dest='size', type=int, help='pattern size to create')
+cyclic_pattern_parser.add_argument('-p', '--pattern', dest='pattern', help='pattern to find, either 4 or 8 characters or a 32 or 64-bit register value')
+cyclic_pattern_parser.add_argument('-t', '--type', dest='type', choices=('metasploit', 'debruijn'), default='metasploit', help='the type of pattern to use')
+cyclic_pattern_parser.add_argument('-a', '--alphabet', dest='alphabet', default=DE_BRUIJN_ALPHABET, help='the characters to use for a de bruijn pattern')
+cyclic_pattern_parser.add_argument('--big-endian', dest='big_endian', action='store_true', help='register values are big endian')
+cyclic_pattern_parser.add_argument('--code', dest='code', action='store_true', help='format the pattern for code')
 
 class Module(CassieXMPPBotModule):
 	permissions = {'cyclic_pattern': 'user'}
 	def cmd_cyclic_pattern(self, args, jid, is_muc):
-		parser = ArgumentParserLite('cyclic_pattern', 'create and search a cyclic pattern')
-		parser.add_argument('-s', '--size', dest='size', type=int, required=True, help='pattern size to create')
-		parser.add_argument('-p', '--pattern', dest='pattern', help='pattern to find')
-		parser.add_argument('--code', dest='code', action='store_true', help='format the pattern for code')
 		if not len(args):
-			return parser.format_help()
-		results = parser.parse_args(args)
+			return cyclic_pattern_parser.format_help()
+		results = cyclic_pattern_parser.parse_args(args)
 
 		size = results['size']
-		if size > MAX_PATTERN_SIZE:
-			return 'size is too large, max is ' + str(MAX_PATTERN_SIZE)
-		pattern = create_cyclic_pattern(size)
+		if results['type'] == 'debruijn':
+			alphabet = results['alphabet']
+			if len(alphabet) < 2 or len(set(alphabet)) != len(alphabet):
+				return 'the alphabet must contain at least 2 unique characters'
+			pattern, _ = de_bruijn_pattern(alphabet)
+			max_size = len(pattern)
+		else:
+			max_size = MAX_PATTERN_SIZE
+		if size is not None and size > max_size:
+			return 'size is too large, max is ' + str(max_size)
+
 		if results['pattern'] is None:
+			if size is None:
+				return 'the size of the pattern to create must be specified'
+			if results['type'] == 'debruijn':
+				pattern = pattern[:size]
+			else:
+				pattern = create_cyclic_pattern(size)
 			if results['code']:
 				code = "# Cyclic Pattern Length: {0}\n".format(len(pattern))
 				code += 'pattern  = ""\n'
@@ -50,15 +161,15 @@ class Module(CassieXMPPBotModule):
 					code += "pattern += \"{0}\"\n".format(pattern[idx:idx + 32])
 				return code
 			return pattern
-		search_pattern = results['pattern']
-		if len(search_pattern) == 8:
-			search_pattern = search_pattern.decode('hex')
-			search_pattern = list(search_pattern)
-			search_pattern.reverse()
-			search_pattern = ''.join(search_pattern)
-		if len(search_pattern) != 4:
+
+		search_patterns = parse_register_value(results['pattern'], big_endian=results['big_endian'])
+		if not search_patterns:
 			return 'the search pattern is invalid'
-		index = pattern.find(search_pattern)
-		if index == -1:
-			return 'could not find the search pattern'
-		return 'found exact match at ' + str(index)
+		for search_pattern in search_patterns:
+			if results['type'] == 'debruijn':
+				index = find_de_bruijn_offset(search_pattern, alphabet)
+			else:
+				index = find_cyclic_pattern_offset(search_pattern)
+			if index is not None and (size is None or index + len(search_pattern) <= size):
+				return 'found exact match at ' + str(index)
+		return 'could not find the search pattern'
@@ -1,4 +1,8 @@
+import collections
+import concurrent.futures
 import datetime
+import threading
+import time
 
 from urllib.parse import urlparse
 
@@ -7,18 +11,48 @@ from cassie.imcontent import IMContentMarkdown
 from cassie.templates import CassieXMPPBotModule
 
 import requests
+import sleekxmpp
+
+class CircuitBreaker(object):
+	"""Track the consecutive failures of a server and back off exponentially before it is tried again"""
+
+	def __init__(self, base_delay=18, max_delay=3600):
+		self.base_delay = base_delay
+		self.max_delay = max_delay
+		self.failures = 0
+		self.retry_time = 0
+
+	@property
+	def is_open(self):
+		"""Whether requests to the server should not be made because it has been failing"""
+		return time.time() < self.retry_time
+
+	def record_failure(self):
+		"""Record a failure and return the number of seconds until the server is tried again"""
+		self.failures += 1
+		delay = min(self.max_delay, self.base_delay * (2 ** (self.failures - 1)))
+		self.retry_time = time.time() + delay
+		return delay
+
+	def record_success(self):
+		self.failures = 0
+		self.retry_time = 0
 
 class EmpireAPI(object):
 	"""Class to provide access to various functionality exposed through the Empire API"""
 
-	def __init__(self, empire_config):
+	def __init__(self, empire_config, session=None, timeout=10):
 		"""Initialize a new instance of the EmpireAPI class"""
 		self.username = empire_config['user']
 		self.password = empire_config['pass']
 		self.api_base_url = empire_config['url'] + 'api/'
 		self.json_request_headers = {'Content-Type': 'application/json'}
 		self.verify_server_cert = False
-		self._token = self._get_api_token()
+		self.session = session or requests.Session()
+		self.timeout = timeout
+		self.circuit_breaker = CircuitBreaker()
+		self._token = None
+		self._token_lock = threading.Lock()
 
 	def _get_api_token(self):
 		"""Get the token for the Empire server"""
@@ -28,61 +62,149 @@ class EmpireAPI(object):
 		token = response['token']
 		return token
 
+	def _send_authenticated_request(self, method, path, json=None):
+		"""Send a request with the cached token, logging in again if the server rejects it"""
+		token = self.get_api_token()
+		response = self.session.request(method, self.api_base_url + path, params={'token': token}, headers=self.json_request_headers, json=json, verify=self.verify_server_cert, timeout=self.timeout)
+		if response.status_code == 401:
+			with self._token_lock:
+				if self._token == token:
+					self._token = None
+			response = self.session.request(method, self.api_base_url + path, params={'token': self.get_api_token()}, headers=self.json_request_headers, json=json, verify=self.verify_server_cert, timeout=self.timeout)
+		return response.json()
+
 	def send_get_request(self, url):
 		"""Send a GET request to the Empire server API"""
-		response = requests.get(url, headers=self.json_request_headers, verify=self.verify_server_cert)
+		response = self.session.get(url, headers=self.json_request_headers, verify=self.verify_server_cert, timeout=self.timeout)
 		return response.json()
 
 	def send_post_request(self, url, json):
 		"""Send a POST request to the Empire server API """
-		response = requests.post(url, headers=self.json_request_headers, json=json, verify=self.verify_server_cert)
+		response = self.session.post(url, headers=self.json_request_headers, json=json, verify=self.verify_server_cert, timeout=self.timeout)
 		return response.json()
 
 	def get_api_token(self):
-		"""Get the token for the Empire server"""
-		server_url = self.api_base_url + 'admin/login'
-		creds = {"username": self.username, "password": self.password}
-		response = self.send_post_request(server_url, json=creds)
-		return response['token']
+		"""Get the token for the Empire server, logging in if there is not one cached"""
+		with self._token_lock:
+			if self._token is None:
+				self._token = self._get_api_token()
+			return self._token
 
 	def get_listeners(self):
 		"""Get the details of current listeners on the server"""
-		server_url = self.api_base_url + 'listeners?token={0}'.format(self._token)
-		response = self.send_get_request(server_url)
-		return response
+		return self._send_authenticated_request('GET', 'listeners')
 
 	def get_agents(self):
 		"""Get the details of current agents on the server"""
-		server_url = self.api_base_url + 'agents?token={0}'.format(self._token)
-		response = self.send_get_request(server_url)
-		return response
+		return self._send_authenticated_request('GET', 'agents')
 
 	def exec_shell_cmd(self, agent, cmd):
 		"""Execute specified command on the specified agent"""
-		server_url = self.api_base_url + 'agents/' + agent + '/shell?token={0}'.format(self._token)
 		params = {"command": cmd}
-		response = self.send_post_request(server_url, json=params)
-		return response
+		return self._send_authenticated_request('POST', 'agents/' + agent + '/shell', json=params)
 
 	def get_cmd_output(self, agent):
 		"""Get the results of previously executed command"""
-		server_url = self.api_base_url + 'agents/' + agent + '/results?token={0}'.format(self._token)
-		response = self.send_get_request(server_url)
-		return response
+		return self._send_authenticated_request('GET', 'agents/' + agent + '/results')
 
 	def get_creds(self):
 		"""Get credentials from the database"""
-		server_url = self.api_base_url + 'creds?token={0}'.format(self._token)
-		response = self.send_get_request(server_url)
-		return response
+		return self._send_authenticated_request('GET', 'creds')
+
+	def close(self):
+		"""Close the connections to the Empire server"""
+		self.session.close()
+
+class EmpireAPICache(object):
+	"""A thread safe cache of API clients keyed by server URL and user so connections and tokens are reused"""
+
+	def __init__(self, timeout=10, max_backoff=3600):
+		self.timeout = timeout
+		self.max_backoff = max_backoff
+		self._clients = {}
+		self._lock = threading.Lock()
+
+	def __len__(self):
+		return len(self._clients)
+
+	def get(self, empire_config):
+		"""Get the client for the server in the specified config, creating a new one if the config has changed"""
+		key = (empire_config['url'], empire_config['user'])
+		with self._lock:
+			api = self._clients.get(key)
+			if api is None or api.password != empire_config['pass']:
+				if api is not None:
+					api.close()
+				api = EmpireAPI(empire_config, timeout=self.timeout)
+				api.circuit_breaker.max_delay = self.max_backoff
+				self._clients[key] = api
+			return api
+
+	def clear(self):
+		with self._lock:
+			for api in self._clients.values():
+				api.close()
+			self._clients.clear()
+
+empire_setup_parser = ArgumentParserLite('empire_setup', 'Create an Empire config.')
+empire_setup_parser.add_argument('-s', '--server-url', dest='server_url', help='URL of Empire server (i.e. "https://127.0.0.1:1337/")', required=False)
+empire_setup_parser.add_argument('-u', '--username', dest='server_user', help='username for Empire API', required=False)
+empire_setup_parser.add_argument('-p', '--password', dest='server_pass', help='password for Empire API', required=False)
+empire_setup_parser.add_argument('-e', '--enable', dest='enable_server', help='enable automatic polling for your server', action='store_true', required=False, default=False)
+empire_setup_parser.add_argument('-d', '--disable', dest='disable_server', help='disable automatic polling for your server', action='store_true', required=False, default=False)
+empire_setup_parser.add_argument('-c', '--show-config', dest='show_config', help='displays your current Empire config', action='store_true', required=False, default=False)
+
+empire_list_parser = ArgumentParserLite('empire_list', 'list listeners/agents on an Empire server')
+empire_list_parser.add_argument('-l', '--listeners', dest='list_listeners', help='list listeners', action='store_true', default=False)
+empire_list_parser.add_argument('-a', '--agents', dest='list_agents', help='list agents', action='store_true', default=False)
+empire_list_parser.add_argument('-c', '--creds', dest='list_creds', help='list credentials in the database', action='store_true', default=False)
+empire_list_parser.add_argument('-v', '--verbose', dest='verbose', help='verbose output', action='store_true', default=False)
+
+empire_shell_exec_parser = ArgumentParserLite('empire_shell_cmd', 'execute a shell command on empire agent')
+empire_shell_exec_parser.add_argument('-a', '--agent', dest='emp_agent', help='run command on specified agent')
+empire_shell_exec_parser.add_argument('-c', '--command', dest='emp_command', help='command to run')
+#empire_shell_exec_parser.add_argument('-m', '--mimikatz', dest='emp_mimi', help='execute mimikatz on specified agent')
+
+def parse_lastseen_time(value):
+	"""
+	Parse the last seen time of an agent. Older Empire servers use their
+	local time without an offset while newer ones use ISO 8601 with one.
+
+	:return: The time or None if it can not be parsed.
+	:rtype: :py:class:`datetime.datetime`
+	"""
+	if not isinstance(value, str):
+		return None
+	try:
+		return datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+	except ValueError:
+		return None
 
 class Module(CassieXMPPBotModule):
 	permissions = {'empire_list': 'user', 'empire_shell_exec': 'user', 'empire_setup': 'user'}
 
 	def __init__(self, *args, **kwargs):
 		super(Module, self).__init__(*args, **kwargs)
+		self.options['agent_lost_timeout'] = 300
+		self.options['agent_retention'] = 604800
+		self.options['max_agents'] = 1000
+		self.options['max_backoff'] = 3600
+		self.options['results_interval'] = 5
+		self.options['task_timeout'] = 600
+		self.options['timeout'] = 10
+		self.options['workers'] = 8
 		self.report_rooms = []
+		self.api_cache = EmpireAPICache()
 		self.check_frequency = datetime.timedelta(0, 18)  # in seconds
+		self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.options['workers'], thread_name_prefix='empire')
+		self.polls_in_progress = set()
+		self.polls_in_progress_lock = threading.Lock()
+		# the last seen time of each agent by server along with when it last changed
+		self.agent_activity = collections.defaultdict(dict)
+		# the shell commands waiting for output keyed by server and agent
+		self.pending_tasks = {}
+		self.pending_tasks_lock = threading.Lock()
+		self.results_job_id = self.bot.job_manager.job_add(self._empire_results_poll, seconds=self.options['results_interval'])
 		self.job_id = None
 		self.job_start_time = datetime.datetime.utcnow()
 		self.job_id = self.bot.job_manager.job_add(self._empire_poll, seconds=self.check_frequency.seconds)
@@ -90,8 +212,24 @@ class Module(CassieXMPPBotModule):
 	def update_options(self, config):
 		if 'room' in config:
 			self.report_rooms.append(config['room'])
+		for option in ('agent_lost_timeout', 'agent_retention', 'max_agents', 'max_backoff', 'results_interval', 'task_timeout', 'timeout', 'workers'):
+			self.options[option] = config.get(option, self.options[option])
+		if self.bot.job_manager.job_exists(self.results_job_id):
+			self.bot.job_manager.job_delete(self.results_job_id, wait=False)
+		self.results_job_id = self.bot.job_manager.job_add(self._empire_results_poll, seconds=self.options['results_interval'])
+		self.api_cache.clear()
+		self.api_cache = EmpireAPICache(timeout=self.options['timeout'], max_backoff=self.options['max_backoff'])
+		self.executor.shutdown(wait=False)
+		self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.options['workers'], thread_name_prefix='empire')
 		return self.options
 
+	def unload(self):
+		for job_id in (self.job_id, self.results_job_id):
+			if self.bot.job_manager.job_exists(job_id):
+				self.bot.job_manager.job_delete(job_id, wait=False)
+		self.executor.shutdown(wait=False)
+		self.api_cache.clear()
+
 	def get_authorized_users(self):
 		"""Gets a list of users authorized for the application"""
 		authorized_users = self.bot.authorized_users
@@ -99,9 +237,7 @@ class Module(CassieXMPPBotModule):
 
 	def get_storage(self, user_jid):
 		"""Makes the Empire storage object available"""
-		storage = self.bot.authorized_users[user_jid].storage.get('empire', {})
-		self.bot.authorized_users[user_jid].storage['empire'] = storage
-		return storage
+		return self.bot.authorized_users[user_jid].storage.setdefault('empire', {})
 
 	def user_is_configured(self, user_jid):
 		"""Check that the user has a valid Empire config"""
@@ -127,17 +263,9 @@ class Module(CassieXMPPBotModule):
 
 	def cmd_empire_setup(self, args, jid, is_muc):
 		"""Create the Empire config file required by this module"""
-		parser = ArgumentParserLite('empire_setup', 'Create an Empire config.')
-		parser.add_argument('-s', '--server-url', dest='server_url', help='URL of Empire server (i.e. "https://127.0.0.1:1337/")', required=False)
-		parser.add_argument('-u', '--username', dest='server_user', help='username for Empire API', required=False)
-		parser.add_argument('-p', '--password', dest='server_pass', help='password for Empire API', required=False)
-		parser.add_argument('-e', '--enable', dest='enable_server', help='enable automatic polling for your server', action='store_true', required=False, default=False)
-		parser.add_argument('-d', '--disable', dest='disable_server', help='disable automatic polling for your server', action='store_true', required=False, default=False)
-		parser.add_argument('-c', '--show-config', dest='show_config', help='displays your current Empire config', action='store_true', required=False, default=False)
-
 		if not len(args):
-			return parser.format_help()
-		results = parser.parse_args(args)
+			return empire_setup_parser.format_help()
+		results = empire_setup_parser.parse_args(args)
 		user_jid = str(jid).split('/')[0]
 		user_storage = self.get_storage(user_jid)
 		report_user = str(jid).split('@')[0]
@@ -162,7 +290,7 @@ class Module(CassieXMPPBotModule):
 
 		if results['disable_server'] and self.polling_is_enabled(user_jid):
 			user_storage['is_enabled'] = False
-			user_storage['agents'] = []
+			user_storage['agents'] = {}
 			report += '  Automatic polling has been disabled for your server.\n'
 
 		if results['server_user'] is not None:
@@ -181,7 +309,7 @@ class Module(CassieXMPPBotModule):
 		if results['show_config']:
 			if not report:
 				report = ''
-			report += 'Current Empire Config:\n'.format(report_user)
+			report += 'Current Empire Config:\n'
 			report += '\tUser: {0}\n'.format(user_storage.get('user', 'None'))
 			report += '\tPassword: {0}\n'.format(user_storage.get('pass', 'None'))
 			report += '\tURL: {0}\n'.format(user_storage.get('url', 'None'))
@@ -190,22 +318,16 @@ class Module(CassieXMPPBotModule):
 		return report
 
 	def cmd_empire_list(self, args, jid, is_muc):
-		parser = ArgumentParserLite('empire_list', 'list listeners/agents on an Empire server')
-		parser.add_argument('-l', '--listeners', dest='list_listeners', help='list listeners', action='store_true', default=False)
-		parser.add_argument('-a', '--agents', dest='list_agents', help='list agents', action='store_true', default=False)
-		parser.add_argument('-c', '--creds', dest='list_creds', help='list credentials in the database', action='store_true', default=False)
-		parser.add_argument('-v', '--verbose', dest='verbose', help='verbose output', action='store_true', default=False)
 		if not len(args):
-			return parser.format_help()
-		results = parser.parse_args(args)
+			return empire_list_parser.format_help()
+		results = empire_list_parser.parse_args(args)
 
 		user_jid = str(jid).split('/')[0]
 		if not self.user_is_configured(user_jid):
 			report = 'Sorry {0}, it looks like you do not have an Empire config yet.  Create one with the "empire_setup" module.'.format(user_jid.split('@')[0])
 			return report
 		empire_config = self.get_storage(user_jid)
-		api = EmpireAPI(empire_config)
-		token = api.get_api_token()
+		api = self.api_cache.get(empire_config)
 
 		if results['list_listeners']:
 			listeners_dict = api.get_listeners()
@@ -261,58 +383,311 @@ class Module(CassieXMPPBotModule):
 			return report
 
 	def cmd_empire_shell_exec(self, args, jid, is_muc):
-		parser = ArgumentParserLite('empire_shell_cmd', 'execute a shell command on empire agent')
-		parser.add_argument('-a', '--agent', dest='emp_agent', help='run command on specified agent')
-		parser.add_argument('-c', '--command', dest='emp_command', help='command to run')
-		#parser.add_argument('-m', '--mimikatz', dest='emp_mimi', help='execute mimikatz on specified agent')
 		if not len(args):
-			return parser.format_help()
-		results = parser.parse_args(args)
+			return empire_shell_exec_parser.format_help()
+		results = empire_shell_exec_parser.parse_args(args)
 
 		user_jid = str(jid).split('/')[0]
 		if not self.user_is_configured(user_jid):
 			report = 'Sorry {0}, it looks like you do not have an Empire config yet.  Create one with the "empire_setup" module.'.format(user_jid.split('@')[0])
 			return report
 		empire_config = self.get_storage(user_jid)
-		api = EmpireAPI(empire_config)
-		token = api.get_api_token()
+		api = self.api_cache.get(empire_config)
+		agent = results['emp_agent']
+		key = ((empire_config['url'], empire_config['user']), agent)
 
-		exec_cmd = api.exec_shell_cmd(results['emp_agent'], results['emp_command'])
-		report = 'Executing command "{0}" on agent: {1}\n'.format(results['emp_command'], results['emp_agent'])
+		exec_cmd = api.exec_shell_cmd(agent, results['emp_command'])
+		report = 'Executing command "{0}" on agent: {1}\n'.format(results['emp_command'], agent)
 		if exec_cmd['success'] is True:
-			report += 'Success!\n'
+			report += 'Success! The output will be sent as it is received.\n'
+			with self.pending_tasks_lock:
+				entry = self.pending_tasks.get(key)
+			if entry is None:
+				entry = {'api': api, 'offset': 0, 'tasks': []}
+				if exec_cmd.get('taskID') is None:
+					# servers which do not identify results by task return all of the output, so skip what is already
+					# there, the agent does not return the output of the new command until it next checks in
+					entry['offset'] = len(self._get_results_text(api.get_cmd_output(agent)))
+			with self.pending_tasks_lock:
+				entry = self.pending_tasks.setdefault(key, entry)
+				entry['tasks'].append({
+					'command': results['emp_command'],
+					'completed': False,
+					'created': time.time(),
+					'jid': (sleekxmpp.JID(jid.bare) if is_muc else jid),
+					'mtype': ('groupchat' if is_muc else 'chat'),
+					'received': False,
+					'task_id': exec_cmd.get('taskID')
+				})
 		else:
 			report += 'Command execution failed.\n'
 		return report
 
+	def _get_results_text(self, response):
+		"""
+		Get the output from a results response which is not separated by task.
+		Empire servers respond with ``{'results': [{'AgentName': name, 'AgentResults': results}]}``.
+		Older servers return the agent's results as a single string containing
+		all of its output, or a list of strings, while newer servers return a
+		list of dictionaries with the ``taskID``, ``command`` and ``results``
+		of each task which are handled by :py:meth:`._get_task_results`.
+		"""
+		text = ''
+		for result in response.get('results', []):
+			agent_results = result.get('AgentResults')
+			if isinstance(agent_results, str):
+				text += agent_results
+			elif isinstance(agent_results, list):
+				text += '\n'.join(item for item in agent_results if isinstance(item, str))
+		return text
+
+	def _get_task_results(self, response):
+		"""Get the results which are separated by task from a results response as a dictionary of output keyed by task ID"""
+		task_results = {}
+		for result in response.get('results', []):
+			agent_results = result.get('AgentResults')
+			if not isinstance(agent_results, list):
+				continue
+			for task_result in agent_results:
+				if isinstance(task_result, dict) and task_result.get('taskID') is not None and task_result.get('results'):
+					task_results[task_result['taskID']] = task_result['results']
+		return task_results
+
+	def _empire_results_poll(self, *args):
+		"""check for the output of pending shell commands with one request for each agent"""
+		with self.pending_tasks_lock:
+			entries = list(self.pending_tasks.items())
+		futures = []
+		for key, entry in entries:
+			with self.polls_in_progress_lock:
+				if key in self.polls_in_progress:
+					continue
+				self.polls_in_progress.add(key)
+			future = self.executor.submit(self._empire_results_poll_agent, key, entry)
+			future.add_done_callback(self._log_future_exception)
+			futures.append(future)
+		concurrent.futures.wait(futures, timeout=self.options['results_interval'])
+		return futures
+
+	def _empire_results_poll_agent(self, key, entry):
+		"""fetch the results for one agent and send the new output to the users waiting for it"""
+		(server, agent) = key
+		try:
+			response = entry['api'].get_cmd_output(agent)
+		except Exception:
+			self.logger.warning("failed to get the results for agent {0} from empire server {1}".format(agent, server[0]), exc_info=True)
+			response = None
+		finally:
+			with self.polls_in_progress_lock:
+				self.polls_in_progress.discard(key)
+
+		messages = []
+		with self.pending_tasks_lock:
+			tasks = entry['tasks']
+			if response is not None:
+				try:
+					self._handle_results(agent, entry, response, messages)
+				except Exception:
+					self.logger.warning("failed to parse the results for agent {0} from empire server {1}".format(agent, server[0]), exc_info=True)
+
+			now = time.time()
+			for task in tasks:
+				if task['completed'] or now - task['created'] < self.options['task_timeout']:
+					continue
+				task['completed'] = True
+				if not task['received']:
+					messages.append((task['jid'], 'No output was received for command "{0}" on agent: {1}'.format(task['command'], agent), task['mtype']))
+			entry['tasks'] = [task for task in tasks if not task['completed']]
+			if not entry['tasks'] and self.pending_tasks.get(key) is entry:
+				del self.pending_tasks[key]
+		# the messages are sent without the lock held since large output is split into paced messages
+		for mto, mbody, mtype in messages:
+			self.bot.send_message_formatted(mto, mbody, mtype)
+
+	def _handle_results(self, agent, entry, response, messages):
+		"""match the output in a results response to the pending tasks, adding the messages to send to *messages*"""
+		tasks = entry['tasks']
+		text = self._get_results_text(response)
+		output, entry['offset'] = text[entry['offset']:], len(text)
+		if output.strip():
+			# output which is not separated by task is sent once to each user waiting for it
+			recipients = []
+			for task in tasks:
+				if task['task_id'] is None:
+					task['received'] = True
+					if (task['jid'], task['mtype']) not in recipients:
+						recipients.append((task['jid'], task['mtype']))
+			for mto, mtype in recipients:
+				messages.append((mto, 'Output from agent {0}:\n{1}'.format(agent, output), mtype))
+		task_results = self._get_task_results(response)
+		for task in tasks:
+			if task['task_id'] is not None and task['task_id'] in task_results:
+				messages.append(self._get_task_output_message(task, agent, task_results[task['task_id']]))
+				task['completed'] = True
+
+	def _get_task_output_message(self, task, agent, output):
+		task['received'] = True
+		return (task['jid'], 'Output of command "{0}" on agent {1}:\n{2}'.format(task['command'], agent, output), task['mtype'])
+
+	def _log_future_exception(self, future):
+		"""log the exception raised by a task submitted to the executor which would otherwise be discarded"""
+		if future.cancelled():
+			return
+		error = future.exception()
+		if error is not None:
+			self.logger.error('empire task encountered exception: ' + error.__class__.__name__, exc_info=error)
+
 	def _empire_poll(self, *args):
-		"""check each users Empire listener for new agents"""
-		configured_users = []
-		for user in self.bot.authorized_users:
+		"""check each users Empire server for new agents, polling each server concurrently"""
+		# users which share a server and account are polled with a single request
+		servers = collections.defaultdict(list)
+		# only the users with empire storage are loaded
+		for user in self.bot.authorized_users.get_with_storage('empire'):
 			user = user.name
-			if self.user_is_configured(user):
-				configured_users.append(user)
-
-		for user in configured_users:
-			empire_config = self.get_storage(user)
-			try:
-				api = EmpireAPI(empire_config)
-			except Exception:
-				self.logger.warning('empire api instance failed to connect', exc_info=True)
-				empire_config['is_enabled'] = False
+			if self.user_is_configured(user) and self.polling_is_enabled(user):
+				empire_config = self.get_storage(user)
+				servers[(empire_config['url'], empire_config['user'])].append(user)
+
+		futures = []
+		for server, users in servers.items():
+			api = self.api_cache.get(self.get_storage(users[0]))
+			if api.circuit_breaker.is_open:
 				continue
-			if not 'agents' in empire_config:
-				empire_config['agents'] = []
+			with self.polls_in_progress_lock:
+				# a server which is still being polled from a previous cycle is skipped
+				if server in self.polls_in_progress:
+					continue
+				self.polls_in_progress.add(server)
+			future = self.executor.submit(self._empire_poll_server, server, api, users)
+			future.add_done_callback(self._log_future_exception)
+			futures.append(future)
+		# wait for the servers to respond so the next cycle starts on time without waiting for slow servers
+		concurrent.futures.wait(futures, timeout=self.check_frequency.total_seconds())
+		return futures
+
+	def _empire_poll_server(self, server, api, users):
+		"""check one Empire server for new agents and notify each of the users which share it"""
+		try:
 			agents = api.get_agents()['agents']
-			new_agent_count = 0
-			for agent in agents:
-				if agent['name'] not in empire_config['agents']:
-					empire_config['agents'].append(agent['name'])
-					new_agent_count += 1
-			if new_agent_count == 0:
+		except Exception:
+			delay = api.circuit_breaker.record_failure()
+			self.logger.warning("empire server {0} could not be polled, retrying in {1} seconds".format(server[0], delay), exc_info=(api.circuit_breaker.failures == 1))
+			return
+		finally:
+			with self.polls_in_progress_lock:
+				self.polls_in_progress.discard(server)
+		if api.circuit_breaker.failures:
+			self.logger.info("empire server {0} is responding again after {1} failures".format(server[0], api.circuit_breaker.failures))
+		api.circuit_breaker.record_success()
+
+		active_agents, unconfirmed_agents = self.update_agent_activity(server, agents)
+		for user in users:
+			report = self.update_agents(user, active_agents, unconfirmed_agents)
+			if report:
+				self.send_report(report)
+
+	def update_agent_activity(self, server, agents):
+		"""
+		Track when the last seen time of each agent on a server changes. An
+		agent is active while its last seen time keeps changing, until then it
+		is unconfirmed for up to the lost timeout after it is first seen. An
+		agent which had not checked in for the lost timeout when it was first
+		seen, such as a dead agent after a restart, is lost instead.
+
+		:return: The names of the active agents and the names of the unconfirmed agents.
+		:rtype: tuple
+		"""
+		now = time.monotonic()
+		activity = self.agent_activity[server]
+		previous_activity = dict(activity)
+		activity.clear()
+		is_stale = None
+		for agent in agents:
+			name = agent['name']
+			lastseen_time = agent.get('lastseen_time')
+			previous = previous_activity.get(name)
+			if previous is None:
+				if is_stale is None:
+					is_stale = self._get_stale_check(agents)
+				activity[name] = (lastseen_time, (now - self.options['agent_lost_timeout'] if is_stale(lastseen_time) else now), False)
+			elif previous[0] != lastseen_time:
+				activity[name] = (lastseen_time, now, True)
+			else:
+				activity[name] = previous
+		active_agents = set()
+		unconfirmed_agents = set()
+		for name, (_, changed, confirmed) in activity.items():
+			if now - changed >= self.options['agent_lost_timeout']:
+				continue
+			if confirmed:
+				active_agents.add(name)
+			else:
+				unconfirmed_agents.add(name)
+		return active_agents, unconfirmed_agents
+
+	def _get_stale_check(self, agents):
+		"""
+		Get a function which checks if a last seen time is older than the lost
+		timeout. Times without an offset are in the server's unknown time zone
+		so they are compared to the most recent one the server reported.
+		"""
+		local_times = [lastseen_time for lastseen_time in (parse_lastseen_time(agent.get('lastseen_time')) for agent in agents) if lastseen_time is not None and lastseen_time.tzinfo is None]
+		newest_local_time = max(local_times) if local_times else None
+		utc_now = datetime.datetime.now(datetime.timezone.utc)
+		timeout = self.options['agent_lost_timeout']
+		def is_stale(lastseen_time):
+			lastseen_time = parse_lastseen_time(lastseen_time)
+			if lastseen_time is None:
+				return False
+			if lastseen_time.tzinfo is None:
+				return (newest_local_time - lastseen_time).total_seconds() >= timeout
+			return (utc_now - lastseen_time).total_seconds() >= timeout
+		return is_stale
+
+	def update_agents(self, user, active_agents, unconfirmed_agents):
+		"""Update the agents tracked for a user and return a report of the new, returning and lost agents"""
+		empire_config = self.get_storage(user)
+		now = time.time()
+		agents = empire_config.get('agents')
+		if not isinstance(agents, dict):
+			# agents used to be tracked as a list of names, the ones which are not present are silently marked as lost
+			agents = {}
+			for name in (empire_config.get('agents') or []):
+				agents[name] = {'status': ('active' if name in active_agents or name in unconfirmed_agents else 'lost'), 'changed': now}
+			empire_config['agents'] = agents
+			agents = empire_config['agents']
+
+		new_agents = []
+		returning_agents = []
+		lost_agents = []
+		for name in active_agents | unconfirmed_agents:
+			agent = agents.get(name)
+			if agent is None:
+				agents[name] = {'status': 'active', 'changed': now}
+				new_agents.append(name)
+			elif agent['status'] == 'lost' and name in active_agents:
+				# unconfirmed agents are not returning, they may have been lost before a restart
+				agents[name] = {'status': 'active', 'changed': now}
+				returning_agents.append(name)
+		for name, agent in tuple(agents.items()):
+			if agent['status'] == 'active' and not (name in active_agents or name in unconfirmed_agents):
+				agents[name] = {'status': 'lost', 'changed': now}
+				lost_agents.append(name)
+
+		# forget the agents which have been lost for longer than the retention period, or the oldest ones
+		# when there are too many
+		lost = sorted((agent['changed'], name) for name, agent in agents.items() if agent['status'] == 'lost')
+		excess = max(0, len(agents) - self.options['max_agents'])
+		for index, (changed, name) in enumerate(lost):
+			if index < excess or now - changed > self.options['agent_retention']:
+				del agents[name]
+
+		report = []
+		for agent_names, description in ((new_agents, 'new'), (returning_agents, 'returning'), (lost_agents, 'lost')):
+			if not agent_names:
 				continue
-			report = '{0}: you have {1} new agent{2} on your listener'.format(user, new_agent_count, ('s' if new_agent_count > 1 else ''))
-			self.send_report(report)
+			report.append('{0}: you have {1} {2} agent{3} on your listener: {4}'.format(user, len(agent_names), description, ('s' if len(agent_names) > 1 else ''), ', '.join(sorted(agent_names))))
+		return '\n'.join(report)
 
 	def send_report(self, report):
 		"""Displays the report in the chat window to notify the user of new agents"""
@@ -89,6 +89,14 @@ class Frotz(object):
 	def running(self):
 		return self.frotz_proc.poll() is None
 
+frotz_parser = ArgumentParserLite('frotz', 'play z-machine games with frotz', 'each user can create one save file per game')
+frotz_parser.add_argument('-n', '--new', dest='new_game', action='store_true', help='start a new game')
+frotz_parser.add_argument('-r', '--restore', dest='restore_game', action='store_true', help='restore a previous game')
+frotz_parser.add_argument('-q', '--quit', dest='quit_game', action='store_true', help='quit playing the game')
+frotz_parser.add_argument('-s', '--save', dest='save_game', action='store_true', help='save the current game')
+frotz_parser.add_argument('-g', '--game', dest='game', action='store', help='game to play')
+frotz_parser.add_argument('--list-games', dest='list_games', action='store_true', help='list available games')
+
 class Module(CassieXMPPBotModule):
 	permissions = {'frotz': 'user'}
 	def __init__(self, *args, **kwargs):
@@ -97,17 +105,17 @@ class Module(CassieXMPPBotModule):
 		self.frotz_instances_lock = threading.RLock()
 		self.job_id = self.bot.job_manager.job_add(self.game_reaper, minutes=5)
 
+	def unload(self):
+		if self.bot.job_manager.job_exists(self.job_id):
+			self.bot.job_manager.job_delete(self.job_id, wait=False)
+		with self.frotz_instances_lock:
+			for user in list(self.frotz_instances.keys()):
+				self.cleanup_game(user)
+
 	def cmd_frotz(self, args, jid, is_muc):
-		parser = ArgumentParserLite('frotz', 'play z-machine games with frotz', 'each user can create one save file per game')
-		parser.add_argument('-n', '--new', dest='new_game', action='store_true', help='start a new game')
-		parser.add_argument('-r', '--restore', dest='restore_game', action='store_true', help='restore a previous game')
-		parser.add_argument('-q', '--quit', dest='quit_game', action='store_true', help='quit playing the game')
-		parser.add_argument('-s', '--save', dest='save_game', action='store_true', help='save the current game')
-		parser.add_argument('-g', '--game', dest='game', action='store', help='game to play')
-		parser.add_argument('--list-games', dest='list_games', action='store_true', help='list available games')
 		if not len(args):
-			return parser.format_help()
-		results = parser.parse_args(args)
+			return frotz_parser.format_help()
+		results = frotz_parser.parse_args(args)
 		user = str(jid.bare)
 
 		if results['list_games']:
@@ -185,11 +193,16 @@ class Module(CassieXMPPBotModule):
 				self.cleanup_game(user)
 
 	def callback_play_game(self, msg, jid, handler_id):
-		user = str(jid.bare)
-		frotz = self.frotz_instances[user]['frotz']
 		msg = msg.strip()
 		if not msg:
 			return
+		# the game is played with the lock held so it can not be saved or ended at the same time
+		with self.frotz_instances_lock:
+			return self._play_game(msg, jid)
+
+	def _play_game(self, msg, jid):
+		user = str(jid.bare)
+		frotz = self.frotz_instances[user]['frotz']
 		cmd = msg.split(' ', 1)[0]
 		if cmd.lower() in ['new', 'restore', 'save', 'q', 'quit']:  # command to arguments ie new to --new and save to --save
 			cmd = cmd.lower()
@@ -1,9 +1,24 @@
+import bisect
 import collections
+import concurrent.futures
 import datetime
+import email.utils
+import hashlib
+import hmac
+import http.server
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
 
+from cassie import __version__
 from cassie.argparselite import ArgumentParserLite
 from cassie.imcontent import IMContentMarkdown
 from cassie.templates import CassieXMPPBotModule
+from cassie.utils import start_http_server
 
 import requests
 import smoke_zephyr.utilities as utilities
@@ -12,37 +27,376 @@ def github_repo_exists(repository):
 	resp = requests.get('https://api.github.com/repos/' + repository)
 	return resp.ok
 
+class GitHubPoller(object):
+	"""
+	Poll the GitHub API using a shared session. The ETag and Last-Modified
+	headers of each response are stored so subsequent requests for the same
+	resource are conditional and responses which have not changed, which do
+	not count against the rate limit, are skipped. Requests are not made
+	while the rate limit is exhausted or the server has asked to back off.
+	The headers are stored by resource without the parameters which change
+	between polls, so each resource has one entry which is replaced by the
+	latest response.
+	"""
+	api_url = 'https://api.github.com/'
+	volatile_params = ('since',)
+	def __init__(self, token=None, timeout=30, pool_size=10):
+		self.session = requests.Session()
+		self.session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+		self.session.headers['Accept'] = 'application/vnd.github.v3+json'
+		self.session.headers['User-Agent'] = 'cassie-bot/' + __version__
+		if token:
+			self.session.headers['Authorization'] = 'token ' + token
+		self.timeout = timeout
+		self.blocked_until = 0
+		self.rate_limit_remaining = None
+		self._cache = {}
+		self._lock = threading.Lock()
+
+	def _update_rate_limit(self, resp):
+		remaining = resp.headers.get('X-RateLimit-Remaining')
+		if remaining is not None:
+			self.rate_limit_remaining = int(remaining)
+		retry_after = resp.headers.get('Retry-After')
+		if retry_after is not None:
+			if retry_after.isdigit():
+				retry_after = time.time() + int(retry_after)
+			else:
+				retry_after = email.utils.mktime_tz(email.utils.parsedate_tz(retry_after))
+			self.blocked_until = max(self.blocked_until, retry_after)
+		elif self.rate_limit_remaining == 0 and 'X-RateLimit-Reset' in resp.headers:
+			self.blocked_until = max(self.blocked_until, int(resp.headers['X-RateLimit-Reset']))
+
+	@property
+	def is_blocked(self):
+		return time.time() < self.blocked_until
+
+	def get(self, path, params=None):
+		"""
+		Request a resource from the GitHub API.
+
+		:param str path: The path of the resource relative to the API URL.
+		:param dict params: Optional query parameters for the request.
+		:return: The decoded response or None if the resource has not changed or the request was not made.
+		"""
+		if self.is_blocked:
+			return None
+		key = (path, tuple(sorted(item for item in (params or {}).items() if item[0] not in self.volatile_params)))
+		headers = {}
+		with self._lock:
+			etag, last_modified = self._cache.get(key, (None, None))
+		if etag:
+			headers['If-None-Match'] = etag
+		elif last_modified:
+			headers['If-Modified-Since'] = last_modified
+		resp = self.session.get(self.api_url + path, params=params, headers=headers, timeout=self.timeout)
+		with self._lock:
+			self._update_rate_limit(resp)
+			if resp.status_code == 304:
+				return None
+			if resp.status_code in (403, 429) and self.is_blocked:
+				return None
+			resp.raise_for_status()
+			self._cache[key] = (resp.headers.get('ETag'), resp.headers.get('Last-Modified'))
+		return resp.json()
+
+	def close(self):
+		self.session.close()
+
+github_parser = ArgumentParserLite('github', 'monitor new commits and pull requests to a github repository')
+github_parser.add_argument('action', required=True, help='github plugin action (disable, enable, status)')
+
+GITHUB_DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+class RepositoryCursors(object):
+	"""
+	Track the most recent commit and pull request which have been reported
+	for each repository so nothing is reported twice, even after a restart
+	when a state file is used. GitHub's date strings are stored as is since
+	they sort chronologically. The commits which have been reported are
+	kept sorted by their dates, regardless of the order they are reported
+	in, and are evicted from the front once they are older than *max_age*
+	relative to the repository's newest commit, commits older than that are
+	not reported.
+	"""
+	def __init__(self, filename=None, max_age=datetime.timedelta(1)):
+		self.filename = filename
+		self.max_age = max_age
+		self.lock = threading.RLock()
+		self._repositories = {}
+		self._dirty = False
+		self.logger = logging.getLogger('cassie.bot.xmpp.modules.github.cursors')
+		if filename and os.path.isfile(filename):
+			try:
+				self._load(filename)
+			except (AttributeError, KeyError, OSError, TypeError, ValueError):
+				self.logger.warning('failed to load the github state file ' + filename + ', starting with empty cursors', exc_info=True)
+				self._repositories = {}
+
+	def _load(self, filename):
+		with open(filename, 'r') as file_h:
+			repositories = json.load(file_h)
+		for repository, cursor in repositories.items():
+			for key in ('commit_date', 'created'):
+				# raises ValueError if the date is missing or malformed
+				datetime.datetime.strptime(cursor.get(key) or '', GITHUB_DATE_FORMAT)
+			if not isinstance(cursor.get('pull_request'), (int, type(None))):
+				raise ValueError('the pull request for ' + repository + ' is not a number')
+			commits = []
+			for commit_date, commit_id in cursor['commits']:
+				if not (isinstance(commit_date, str) and isinstance(commit_id, str)):
+					raise ValueError('a commit for ' + repository + ' is malformed')
+				commits.append((commit_date, commit_id))
+			cursor['commits'] = collections.deque(sorted(commits))
+			self._repositories[repository] = cursor
+
+	def __contains__(self, repository):
+		return repository in self._repositories
+
+	def get(self, repository, start_time):
+		"""
+		Get the cursor for a repository, creating it if necessary. A new cursor
+		starts at *start_time* so earlier activity is not reported.
+
+		:param str repository: The name of the repository.
+		:param start_time: The time to start a new cursor at.
+		:type start_time: :py:class:`datetime.datetime`
+		:return: The repository's cursor.
+		:rtype: dict
+		"""
+		with self.lock:
+			cursor = self._repositories.get(repository)
+			if cursor is None:
+				start_time = start_time.strftime(GITHUB_DATE_FORMAT)
+				cursor = {'commit_date': start_time, 'commits': collections.deque(), 'created': start_time, 'pull_request': None}
+				self._repositories[repository] = cursor
+				self._dirty = True
+			return cursor
+
+	def get_since(self, repository):
+		"""
+		Get the date which commits for a repository must be newer than to be
+		reported. It only changes when a newer commit is reported.
+
+		:param str repository: The name of the repository.
+		:rtype: str
+		"""
+		cursor = self._repositories[repository]
+		cutoff = (datetime.datetime.strptime(cursor['commit_date'], GITHUB_DATE_FORMAT) - self.max_age).strftime(GITHUB_DATE_FORMAT)
+		return max(cursor['created'], cutoff)
+
+	def add_commit(self, repository, commit_date, commit_id):
+		with self.lock:
+			cursor = self._repositories[repository]
+			# webhook deliveries and polls can report commits out of order
+			bisect.insort(cursor['commits'], (commit_date, commit_id))
+			if commit_date > cursor['commit_date']:
+				cursor['commit_date'] = commit_date
+				since = self.get_since(repository)
+				commits = cursor['commits']
+				while commits and commits[0][0] < since:
+					commits.popleft()
+			self._dirty = True
+
+	def set_pull_request(self, repository, number):
+		with self.lock:
+			cursor = self._repositories[repository]
+			cursor['pull_request'] = max(cursor['pull_request'] or 0, number)
+			self._dirty = True
+
+	def save(self):
+		"""
+		Write the cursors to the state file if they have changed. The file is
+		replaced atomically so it is never left partially written.
+		"""
+		with self.lock:
+			if not (self.filename and self._dirty):
+				return
+			repositories = {}
+			for repository, cursor in self._repositories.items():
+				cursor = dict(cursor)
+				cursor['commits'] = list(cursor['commits'])
+				repositories[repository] = cursor
+			directory = os.path.dirname(os.path.abspath(self.filename))
+			file_d, temp_filename = tempfile.mkstemp(dir=directory, prefix='.github-state-')
+			try:
+				with os.fdopen(file_d, 'w') as file_h:
+					json.dump(repositories, file_h)
+				os.replace(temp_filename, self.filename)
+			except:
+				os.unlink(temp_filename)
+				raise
+			self._dirty = False
+
+def parse_webhook_date(value):
+	# webhook payloads use offsets instead of UTC like the rest of the API
+	value = datetime.datetime.strptime(value.replace('Z', '+00:00').replace(':', ''), "%Y-%m-%dT%H%M%S%z")
+	return value.astimezone(datetime.timezone.utc).strftime(GITHUB_DATE_FORMAT)
+
+def verify_webhook_signature(secret, body, headers):
+	"""
+	Verify the HMAC signature GitHub includes with webhook deliveries, the
+	SHA-256 signature is used when it is present.
+
+	:param bytes secret: The webhook's secret.
+	:param bytes body: The body of the request.
+	:param headers: The headers of the request.
+	:return: Whether or not the signature is valid.
+	:rtype: bool
+	"""
+	for header, digestmod in (('X-Hub-Signature-256', hashlib.sha256), ('X-Hub-Signature', hashlib.sha1)):
+		signature = headers.get(header)
+		if signature is None:
+			continue
+		expected = digestmod().name + '=' + hmac.new(secret, body, digestmod).hexdigest()
+		return hmac.compare_digest(expected, signature)
+	return False
+
+class GitHubWebhookReceiver(object):
+	"""
+	Receive push and pull request events from a GitHub webhook on a local
+	HTTP listener. Deliveries must be signed with the configured secret and
+	are handed to *callback* with the event name and decoded payload.
+	"""
+	max_body_size = 10 * 1024 * 1024
+	def __init__(self, callback, secret, host='127.0.0.1', port=8090, path='/github'):
+		self.callback = callback
+		self.secret = secret.encode('utf-8')
+		self.path = path
+		self.logger = logging.getLogger('cassie.bot.xmpp.modules.github.webhook')
+		receiver = self
+
+		class RequestHandler(http.server.BaseHTTPRequestHandler):
+			def do_POST(self):
+				if self.path.split('?', 1)[0] != receiver.path:
+					self.send_error(404)
+					return
+				try:
+					content_length = int(self.headers.get('Content-Length', 0))
+				except ValueError:
+					content_length = -1
+				if content_length < 0 or content_length > receiver.max_body_size:
+					self.send_error(413)
+					return
+				body = self.rfile.read(content_length)
+				if not verify_webhook_signature(receiver.secret, body, self.headers):
+					receiver.logger.warning('rejected a github webhook delivery with an invalid signature from ' + self.address_string())
+					self.send_error(403)
+					return
+				try:
+					payload = json.loads(body.decode('utf-8'))
+				except ValueError:
+					self.send_error(400)
+					return
+				event = self.headers.get('X-GitHub-Event', '')
+				receiver.logger.debug("received github webhook event: {0} (delivery: {1})".format(event, self.headers.get('X-GitHub-Delivery')))
+				try:
+					receiver.callback(event, payload)
+				except (AttributeError, KeyError, TypeError, ValueError):
+					receiver.logger.warning('failed to process a github webhook ' + event + ' event with an unexpected payload', exc_info=True)
+					self.send_error(400)
+					return
+				except Exception:
+					receiver.logger.error('an error occurred while processing a github webhook ' + event + ' event', exc_info=True)
+					self.send_error(500)
+					return
+				self.send_response(202)
+				self.send_header('Content-Length', '0')
+				self.end_headers()
+
+			def log_message(self, format, *args):
+				receiver.logger.debug('webhook request from ' + self.address_string() + ': ' + (format % args))
+
+		self.server = start_http_server((host, port), RequestHandler, name='github-webhook')
+		self.logger.info("receiving github webhooks on {0}:{1}{2}".format(host, self.server.server_address[1], path))
+
+	def stop(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+def parse_frequency(frequency):
+	if isinstance(frequency, str):
+		frequency = utilities.parse_timespan(frequency)
+	return datetime.timedelta(0, frequency)
+
 class Module(CassieXMPPBotModule):
 	def __init__(self, *args, **kwargs):
 		super(Module, self).__init__(*args, **kwargs)
-		self.repositories = []
+		self.options['jitter'] = 0.1
+		self.options['workers'] = 4
+		self.repositories = collections.OrderedDict()
+		self.repository_checks = {}
+		self.repository_checks_lock = threading.Lock()
+		self.reports_lock = threading.RLock()
 		self.report_rooms = []
-		self.reported_commits = {}
-		self.reported_commits_cache_age = datetime.timedelta(1, 0)
-		self.reported_pull_requests = collections.deque(maxlen=10)
+		self.cursors = RepositoryCursors()
+		self.webhook = None
 		self.check_frequency = datetime.timedelta(0, 1200)  # in seconds
 		self.job_id = None
 		self.job_start_time = datetime.datetime.utcnow()
-		self.job_start_time = datetime.datetime.utcnow()
-		self.job_id = self.bot.job_manager.job_add(self.check_github_repo_activity, seconds=self.check_frequency.seconds)
+		self.poller = GitHubPoller()
+		self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.options['workers'], thread_name_prefix='github')
+		self.job_id = self.bot.job_manager.job_add(self.check_github_repo_activity, seconds=self.job_interval)
 
 	def update_options(self, config):
-		self.repositories.extend(config.get('repositories', []))
 		if 'room' in config:
 			self.report_rooms.append(config['room'])
-		check_frequency = config.get('frequency', 1200)
-		if isinstance(check_frequency, str):
-			check_frequency = utilities.parse_timespan(check_frequency)
-		self.check_frequency = datetime.timedelta(0, check_frequency)
+		self.check_frequency = parse_frequency(config.get('frequency', 1200))
+		self.options['jitter'] = config.get('jitter', self.options['jitter'])
+		if config.get('state_file'):
+			self.cursors = RepositoryCursors(config['state_file'])
+		if self.webhook is not None:
+			self.webhook.stop()
+			self.webhook = None
+		webhook = config.get('webhook')
+		if webhook:
+			if not webhook.get('secret'):
+				self.logger.error('the github webhook receiver requires a secret to be configured')
+			else:
+				self.webhook = GitHubWebhookReceiver(
+					self.handle_webhook_event,
+					webhook['secret'],
+					host=webhook.get('host', '127.0.0.1'),
+					port=webhook.get('port', 8090),
+					path=webhook.get('path', '/github')
+				)
+		# repositories are either names or dictionaries with a name and frequency
+		for repository in config.get('repositories', []):
+			if isinstance(repository, dict):
+				self.repositories[repository['name']] = parse_frequency(repository.get('frequency', self.check_frequency.total_seconds()))
+			else:
+				self.repositories[repository] = self.check_frequency
+		workers = config.get('workers', self.options['workers'])
+		if config.get('token') or workers != self.options['workers']:
+			self.options['workers'] = workers
+			self.poller.close()
+			self.poller = GitHubPoller(token=config.get('token'), pool_size=workers)
+			self.executor.shutdown(wait=False)
+			self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='github')
+		if self.bot.job_manager.job_exists(self.job_id):
+			self.bot.job_manager.job_delete(self.job_id, wait=False)
+		self.job_id = self.bot.job_manager.job_add(self.check_github_repo_activity, seconds=self.job_interval)
 		return self.options
 
+	@property
+	def job_interval(self):
+		# the job runs often enough to start each check on time, the checks themselves are scheduled per repository
+		frequencies = [self.check_frequency] + list(self.repositories.values())
+		return int(max(1, min(60, min(frequency.total_seconds() for frequency in frequencies))))
+
+	def unload(self):
+		if self.bot.job_manager.job_exists(self.job_id):
+			self.bot.job_manager.job_delete(self.job_id, wait=False)
+		if self.webhook is not None:
+			self.webhook.stop()
+		self.executor.shutdown(wait=False)
+		self.poller.close()
+
 	def cmd_github(self, args, jid, is_muc):
-		parser = ArgumentParserLite('github', 'monitor new commits and pull requests to a github repository')
-		parser.add_argument('action', required=True, help='github plugin action (disable, enable, status)')
 		if not len(args):
 			action = 'status'
 		else:
-			results = parser.parse_args(args)
+			results = github_parser.parse_args(args)
 			action = results['action']
 			if not action in ['disable', 'enable', 'status']:
 				return 'action must be either disable, enable or status'
@@ -50,15 +404,30 @@ class Module(CassieXMPPBotModule):
 		job_manager = self.bot.job_manager
 		if not job_manager.job_exists(self.job_id):
 			self.job_start_time = datetime.datetime.utcnow()
-			self.job_id = job_manager.job_add(self.check_github_repo_activity, seconds=self.check_frequency.seconds)
+			self.job_id = job_manager.job_add(self.check_github_repo_activity, seconds=self.job_interval)
 		if action == 'status':
 			status = job_manager.job_is_enabled(self.job_id)
 			response.append("github repository monitor is {0}running".format(('' if status else 'not ')))
 			if len(self.repositories):
 				response.append('the following repositories are configured for monitoring')
-				response.extend('  ' + repo for repo in self.repositories)
+				now = time.time()
+				for repository, frequency in self.repositories.items():
+					next_check = self.repository_checks.get(repository)
+					if next_check is None:
+						response.append("  {0} (every {1})".format(repository, frequency))
+					elif next_check == float('inf'):
+						response.append("  {0} (every {1}, checking now)".format(repository, frequency))
+					else:
+						response.append("  {0} (every {1}, next check in {2:.0f} seconds)".format(repository, frequency, max(0, next_check - now)))
 			else:
 				response.append('no repositories are configured for monitoring')
+			if self.webhook is not None:
+				host, port = self.webhook.server.server_address[:2]
+				response.append("receiving webhook events on {0}:{1}{2}".format(host, port, self.webhook.path))
+			if self.poller.rate_limit_remaining is not None:
+				response.append("{0:,} github api requests remain before the rate limit".format(self.poller.rate_limit_remaining))
+			if self.poller.is_blocked:
+				response.append("requests are paused for {0:.0f} seconds by the rate limit".format(self.poller.blocked_until - time.time()))
 		elif action == 'enable':
 			job_manager.job_enable(self.job_id)
 			response.append('enabled the github repository monitor')
@@ -67,61 +436,127 @@ class Module(CassieXMPPBotModule):
 			response.append('disabled the github repository monitor')
 		return '\n'.join(response)
 
+	def _schedule_check(self, repository, frequency, now):
+		# spread the checks out so they do not all hit the api at once
+		frequency = frequency.total_seconds()
+		self.repository_checks[repository] = now + frequency + random.uniform(0, frequency * self.options['jitter'])
+
 	def check_github_repo_activity(self, *args):
-		for repository in self.repositories:
-			try:
-				resp = requests.get('https://api.github.com/repos/' + repository + '/commits')
-				commits = resp.json()
-				if len(commits):
-					self.handle_commits(repository, commits)
-			except:
-				self.logger.error('an error occurred while processing commits', exc_info=True)
+		"""
+		Start checking each of the repositories which are due on the thread
+		pool. Checks for a repository which is still being checked are not
+		started again.
+		"""
+		if self.poller.is_blocked:
+			self.logger.warning('skipping github repository checks until the rate limit resets')
+			return
+		now = time.time()
+		with self.repository_checks_lock:
+			for repository, frequency in self.repositories.items():
+				next_check = self.repository_checks.get(repository)
+				if next_check is None:
+					# the first check for a repository is a full period after it was added
+					self._schedule_check(repository, frequency, now)
+					continue
+				if next_check > now:
+					continue
+				# a check which is running is marked as not due until it completes
+				self.repository_checks[repository] = float('inf')
+				self.executor.submit(self.check_repository, repository, frequency)
+
+	def check_repository(self, repository, frequency):
+		try:
+			self.cursors.get(repository, self.job_start_time)
+			# the since parameter only changes when new commits are reported so the requests remain conditional
+			since = self.cursors.get_since(repository)
+			commits = self.poller.get('repos/' + repository + '/commits', params={'since': since})
+			if commits:
+				self.handle_commits(repository, commits)
+		except:
+			self.logger.error('an error occurred while processing commits', exc_info=True)
+		try:
+			pulls = self.poller.get('repos/' + repository + '/pulls', params={'sort': 'created', 'direction': 'desc'})
+			if pulls:
+				self.handle_pull_requests(repository, pulls)
+		except:
+			self.logger.error('an error occurred while processing pull requests', exc_info=True)
+		finally:
 			try:
-				resp = requests.get('https://api.github.com/repos/' + repository + '/pulls')
-				pulls = resp.json()
-				if len(pulls):
-					self.handle_pull_requests(repository, pulls)
+				self.cursors.save()
 			except:
-				self.logger.error('an error occurred while processing pull requests', exc_info=True)
+				self.logger.error('an error occurred while saving the github state file', exc_info=True)
+			with self.repository_checks_lock:
+				self._schedule_check(repository, frequency, time.time())
 
 	def handle_commits(self, repository, commits):
-		now = datetime.datetime.utcnow()
-		# Remove old commits from the cache
-		commit_ids_for_removal = []
-		for commit_id, commit_date in self.reported_commits.items():
-			if commit_date <= now - self.reported_commits_cache_age:
-				commit_ids_for_removal.append(commit_id)
-		for commit_id in commit_ids_for_removal:
-			del self.reported_commits[commit_id]
-
-		commits.reverse()
-		for commit in commits:
-			commit_id = commit['sha']
-			if commit_id in self.reported_commits:
-				continue
-			commit = commit['commit']
-			committer = commit['committer']['name']
-			commit_date = datetime.datetime.strptime(commit['committer']['date'], "%Y-%m-%dT%H:%M:%SZ")
-			if commit_date <= max(self.job_start_time, now - self.reported_commits_cache_age):
-				continue
-			self.reported_commits[commit_id] = commit_date
-			message = commit['message'].split('\n')[0]
-			report = "GitHub {repo}: {user} pushed [commit](https://github.com/{repo}/commit/{commit_id})\n\"{msg}\"".format(repo=repository, user=committer, commit_id=commit_id, msg=message)
-			self.send_report(report)
+		with self.reports_lock:
+			cursor = self.cursors.get(repository, self.job_start_time)
+			reported_commits = set(commit_id for _, commit_id in cursor['commits'])
+			# sort the commits from oldest to newest
+			for commit in sorted(commits, key=lambda commit: commit['commit']['committer']['date']):
+				commit_id = commit['sha']
+				commit = commit['commit']
+				commit_date = commit['committer']['date']
+				if commit_date < self.cursors.get_since(repository) or commit_id in reported_commits:
+					continue
+				self.cursors.add_commit(repository, commit_date, commit_id)
+				reported_commits.add(commit_id)
+				committer = commit['committer']['name']
+				message = commit['message'].split('\n')[0]
+				report = "GitHub {repo}: {user} pushed [commit](https://github.com/{repo}/commit/{commit_id})\n\"{msg}\"".format(repo=repository, user=committer, commit_id=commit_id, msg=message)
+				self.send_report(report)
 
 	def handle_pull_requests(self, repository, pull_rqs):
-		now = datetime.datetime.utcnow()
-		recent_pulls = [pull_rq for pull_rq in pull_rqs if datetime.datetime.strptime(pull_rq['created_at'], "%Y-%m-%dT%H:%M:%SZ") + self.check_frequency >= now]
-		recent_pulls.reverse()
-		for pull_rq in recent_pulls:
-			number = pull_rq['number']
-			if number in self.reported_pull_requests:
-				continue
-			self.reported_pull_requests.append(number)
-			user = pull_rq['user']['login']
-			title = pull_rq['title']
-			report = "GitHub {repo}: {user} opened [PR #{number}](https://github.com/{repo}/pull/{number})\n\"{msg}\"".format(repo=repository, user=user, number=number, msg=title)
-			self.send_report(report)
+		with self.reports_lock:
+			cursor = self.cursors.get(repository, self.job_start_time)
+			for pull_rq in sorted(pull_rqs, key=lambda pull_rq: pull_rq['number']):
+				number = pull_rq['number']
+				if cursor['pull_request'] is None:
+					# without a cursor, only pull requests opened since the cursor was created are new
+					if pull_rq['created_at'] < cursor['created']:
+						continue
+				elif number <= cursor['pull_request']:
+					continue
+				self.cursors.set_pull_request(repository, number)
+				user = pull_rq['user']['login']
+				title = pull_rq['title']
+				report = "GitHub {repo}: {user} opened [PR #{number}](https://github.com/{repo}/pull/{number})\n\"{msg}\"".format(repo=repository, user=user, number=number, msg=title)
+				self.send_report(report)
+			if cursor['pull_request'] is None and pull_rqs:
+				self.cursors.set_pull_request(repository, max(pull_rq['number'] for pull_rq in pull_rqs))
+
+	def handle_webhook_event(self, event, payload):
+		repository = payload.get('repository', {}).get('full_name')
+		if repository not in self.repositories:
+			return
+		self.cursors.get(repository, self.job_start_time)
+		if event == 'push':
+			# only the default branch is polled so pushes to other branches are not reported either
+			if payload.get('ref') != 'refs/heads/' + payload['repository']['default_branch']:
+				return
+			commits = []
+			for commit in payload.get('commits', []):
+				# commits which are not distinct have already been pushed to another branch
+				if not commit.get('distinct', True):
+					continue
+				commits.append({
+					'sha': commit['id'],
+					'commit': {
+						'committer': {'name': commit['committer']['name'], 'date': parse_webhook_date(commit['timestamp'])},
+						'message': commit['message']
+					}
+				})
+			if commits:
+				self.executor.submit(self._handle_webhook_reports, self.handle_commits, repository, commits)
+		elif event == 'pull_request' and payload.get('action') == 'opened':
+			self.executor.submit(self._handle_webhook_reports, self.handle_pull_requests, repository, [payload['pull_request']])
+
+	def _handle_webhook_reports(self, handler, repository, items):
+		try:
+			handler(repository, items)
+			self.cursors.save()
+		except:
+			self.logger.error('an error occurred while processing a github webhook event', exc_info=True)
 
 	def send_report(self, report):
 		report = IMContentMarkdown(report, 'Monospace')
@@ -1,29 +1,277 @@
+import collections
+import os
+import threading
+import time
+
+from cassie.argparselite import ArgumentParserLite
+from cassie.imcontent import IMContentMarkdown
 from cassie.templates import CassieXMPPBotModule
 from cassie.utils import generate_progress_bar
 
 import psutil
 
+# file systems which are read-only images or are backed by memory, their usage is not reported as disk usage
+IGNORED_FILE_SYSTEMS = ('devtmpfs', 'squashfs', 'tmpfs')
+
+Sample = collections.namedtuple('Sample', ('timestamp', 'cpu', 'memory', 'swap', 'disks', 'network', 'load'))
+
+def take_sample():
+	"""
+	Collect a sample of the current system statistics. None of the calls made
+	block, the CPU usage is relative to the previous call. Read-only mounts
+	and the file systems in :py:data:`.IGNORED_FILE_SYSTEMS` are not included
+	in the disk usage because they are always full or do not use a disk.
+
+	:rtype: :py:class:`.Sample`
+	"""
+	disks = []
+	for device in psutil.disk_partitions():
+		if device.fstype in IGNORED_FILE_SYSTEMS or 'ro' in device.opts.split(','):
+			continue
+		try:
+			usage = psutil.disk_usage(device.mountpoint)
+		except OSError:
+			continue
+		disks.append((device.mountpoint, ((float(usage.used) / usage.total) * 100 if usage.total else 0.0)))
+	network = psutil.net_io_counters()
+	return Sample(
+		timestamp=time.time(),
+		cpu=tuple(psutil.cpu_percent(interval=None, percpu=True)),
+		memory=psutil.virtual_memory().percent,
+		swap=psutil.swap_memory().percent,
+		disks=tuple(disks),
+		network=(network.bytes_sent, network.bytes_recv),
+		load=os.getloadavg()
+	)
+
+class AlertState(object):
+	__slots__ = ('active', 'last_notified', 'value')
+	def __init__(self):
+		self.active = False
+		self.last_notified = None
+		self.value = None
+
+def format_alert_value(key, value):
+	if key == 'load':
+		return "{0:.2f}".format(value)
+	return "{0:.1f}%".format(value)
+
+def format_bytes(value):
+	for unit in ('B', 'KB', 'MB', 'GB'):
+		if value < 1024:
+			break
+		value /= 1024.0
+	return "{0:,.1f}{1}".format(value, unit)
+
+sysstat_parser = ArgumentParserLite('sysstat', 'show system resource usage')
+sysstat_parser.add_argument('-a', '--alerts', dest='alerts', action='store_true', help='show the alert thresholds and any active alerts')
+sysstat_parser.add_argument('-m', '--minutes', dest='minutes', type=int, help='show the min/avg/max usage over the last number of minutes')
+
 class Module(CassieXMPPBotModule):
+	def __init__(self, *args, **kwargs):
+		super(Module, self).__init__(*args, **kwargs)
+		self.options['sample_interval'] = 10
+		self.options['history'] = 60
+		self.options['alerts'] = {
+			'rooms': [],
+			'cooldown': 1800,
+			'hysteresis': 10,
+			'disk': None,
+			'memory': None,
+			'cpu': None,
+			'cpu_duration': 300,
+			'load': None
+		}
+		self.alert_states = collections.defaultdict(AlertState)
+		self.alert_states_lock = threading.Lock()
+		self.samples = collections.deque(maxlen=self._history_size())
+		self.samples_lock = threading.Lock()
+		# the first cpu measurement is meaningless, so take it now
+		psutil.cpu_percent(interval=None, percpu=True)
+		self.job_id = self.bot.job_manager.job_add(self.sample_job, seconds=self.options['sample_interval'])
+
+	def _history_size(self):
+		return max(2, int((self.options['history'] * 60) / self.options['sample_interval']))
+
+	def update_options(self, config):
+		self.options['sample_interval'] = config.get('sample_interval', self.options['sample_interval'])
+		self.options['history'] = config.get('history', self.options['history'])
+		self.options['alerts'].update(config.get('alerts', {}))
+		with self.alert_states_lock:
+			self.alert_states.clear()
+		with self.samples_lock:
+			self.samples = collections.deque(self.samples, maxlen=self._history_size())
+		if self.bot.job_manager.job_exists(self.job_id):
+			self.bot.job_manager.job_delete(self.job_id, wait=False)
+		self.job_id = self.bot.job_manager.job_add(self.sample_job, seconds=self.options['sample_interval'])
+		return self.options
+
+	def unload(self):
+		if self.bot.job_manager.job_exists(self.job_id):
+			self.bot.job_manager.job_delete(self.job_id, wait=False)
+
+	def sample(self):
+		"""
+		Take a sample and add it to the history without checking the alert
+		thresholds.
+
+		:rtype: :py:class:`.Sample`
+		"""
+		sample = take_sample()
+		with self.samples_lock:
+			self.samples.append(sample)
+		return sample
+
+	def sample_job(self):
+		sample = self.sample()
+		try:
+			self.check_alerts(sample)
+		except Exception:
+			self.logger.error('an error occurred while checking the alert thresholds', exc_info=True)
+		return sample
+
+	def get_alert_values(self, sample):
+		"""
+		Get the values from the sampled data which are compared to the
+		configured alert thresholds. CPU usage is averaged across all cores over
+		the *cpu_duration* so short spikes do not trigger an alert, the load is
+		the 5 minute average.
+
+		:param sample: The most recent sample.
+		:type sample: :py:class:`.Sample`
+		:return: A list of tuples of the alert key, description, value and threshold.
+		:rtype: list
+		"""
+		alerts = self.options['alerts']
+		values = []
+		if alerts['disk'] is not None:
+			for mountpoint, percent in sample.disks:
+				values.append(('disk:' + mountpoint, 'Disk usage on ' + mountpoint, percent, alerts['disk']))
+		if alerts['memory'] is not None:
+			values.append(('memory', 'Memory usage', sample.memory, alerts['memory']))
+		if alerts['cpu'] is not None:
+			samples = self.get_samples(alerts['cpu_duration'])
+			# only alert once the entire duration has been sampled
+			if samples and sample.timestamp - samples[0].timestamp >= alerts['cpu_duration'] - self.options['sample_interval']:
+				usage = sum(sum(cpu_sample.cpu) / len(cpu_sample.cpu) for cpu_sample in samples) / len(samples)
+				values.append(('cpu', 'Sustained CPU usage', usage, alerts['cpu']))
+		if alerts['load'] is not None:
+			values.append(('load', 'Load average', sample.load[1], alerts['load']))
+		return values
+
+	def check_alerts(self, sample):
+		"""
+		Compare the sampled data to the configured thresholds and notify the
+		alert rooms. An alert is raised when a value reaches its threshold and
+		is cleared once the value drops *hysteresis* percent below it. While an
+		alert is active, reminders are sent at most once every *cooldown*
+		seconds.
+
+		:param sample: The most recent sample.
+		:type sample: :py:class:`.Sample`
+		"""
+		alerts = self.options['alerts']
+		if not alerts['rooms']:
+			return
+		for key, description, value, threshold in self.get_alert_values(sample):
+			with self.alert_states_lock:
+				state = self.alert_states[key]
+			state.value = value
+			if value >= threshold:
+				if state.active and sample.timestamp - state.last_notified < alerts['cooldown']:
+					continue
+				state.active = True
+				state.last_notified = sample.timestamp
+				self.send_alert(key, "System alert: {0} is at {1} (threshold: {2})".format(description, format_alert_value(key, value), threshold), value)
+			elif state.active and value < threshold * (1 - (alerts['hysteresis'] / 100.0)):
+				state.active = False
+				self.send_alert(key, "System recovered: {0} is at {1} (threshold: {2})".format(description, format_alert_value(key, value), threshold), value)
+
+	def send_alert(self, key, message, value):
+		self.logger.warning(message)
+		report = [message]
+		if key != 'load':
+			report.append(generate_progress_bar(value))
+		report = IMContentMarkdown('\n'.join(report), 'Monospace')
+		for room in self.options['alerts']['rooms']:
+			self.bot.chat_room_join(room)
+			self.bot.send_message(room, report.get_text(), mtype='groupchat', mhtml=report.get_xhtml())
+
+	def get_samples(self, seconds=None):
+		with self.samples_lock:
+			samples = list(self.samples)
+		if seconds is not None:
+			threshold = time.time() - seconds
+			samples = [sample for sample in samples if sample.timestamp >= threshold]
+		return samples
+
 	def cmd_sysstat(self, args, jid, is_muc):
+		results = sysstat_parser.parse_args(args)
+		if results['alerts']:
+			return self.format_alerts()
+		samples = self.get_samples()
+		if not samples:
+			samples = [self.sample()]
+		if results['minutes']:
+			return self.format_history(self.get_samples(results['minutes'] * 60), results['minutes'])
+		return self.format_snapshot(samples[-1], (samples[-2] if len(samples) > 1 else None))
+
+	def format_snapshot(self, sample, previous_sample=None):
 		response = []
-		mp_lengths = [len(mp.mountpoint) for mp in psutil.disk_partitions()]
-		mp_lengths.sort()
-		longest_mount_point = mp_lengths.pop()
+		longest_mount_point = max([len(mountpoint) for mountpoint, _ in sample.disks] or [0])
 		disk_format_string = "{0: <" + str(max(longest_mount_point, 8)) + "} {1}"
 		response.append('')
 		response.append('== Disk Usage ==')
-		for device in psutil.disk_partitions():
-			usage = psutil.disk_usage(device.mountpoint)
-			response.append(disk_format_string.format(device.mountpoint, generate_progress_bar(usage.used, usage.total)))
+		for mountpoint, percent in sample.disks:
+			response.append(disk_format_string.format(mountpoint, generate_progress_bar(percent)))
 		response.append('')
 		response.append('== Memory Usage ==')
-		vmem = psutil.virtual_memory()
-		response.append("{0: <8} {1}".format('Virtual', generate_progress_bar(vmem.percent)))
-		swap = psutil.swap_memory()
-		response.append("{0: <8} {1}".format('Swap', generate_progress_bar(swap.percent)))
+		response.append("{0: <8} {1}".format('Virtual', generate_progress_bar(sample.memory)))
+		response.append("{0: <8} {1}".format('Swap', generate_progress_bar(sample.swap)))
 		response.append('')
 		response.append('== CPU Usage ==')
-		cpu_usages = psutil.cpu_percent(interval=1, percpu=True)
-		for cpu in range(len(cpu_usages)):
-			response.append("{0: <8} {1}".format('CPU-' + str(cpu), generate_progress_bar(cpu_usages[cpu])))
+		for cpu, usage in enumerate(sample.cpu):
+			response.append("{0: <8} {1}".format('CPU-' + str(cpu), generate_progress_bar(usage)))
+		response.append("{0: <8} {1:.2f} {2:.2f} {3:.2f}".format('Load', *sample.load))
+		if previous_sample is not None:
+			elapsed = sample.timestamp - previous_sample.timestamp
+			response.append('')
+			response.append('== Network ==')
+			response.append("{0: <8} {1}/s".format('Sent', format_bytes((sample.network[0] - previous_sample.network[0]) / elapsed)))
+			response.append("{0: <8} {1}/s".format('Received', format_bytes((sample.network[1] - previous_sample.network[1]) / elapsed)))
+		response.append('')
+		response.append("Sampled {0:.0f} seconds ago".format(time.time() - sample.timestamp))
+		return '\n'.join(response)
+
+	def format_alerts(self):
+		alerts = self.options['alerts']
+		response = []
+		for name in ('disk', 'memory', 'cpu', 'load'):
+			response.append("{0: <8} {1}".format(name, ('disabled' if alerts[name] is None else alerts[name])))
+		if not alerts['rooms']:
+			response.append('No alert rooms are configured')
+		with self.alert_states_lock:
+			active = sorted(((key, state) for key, state in self.alert_states.items() if state.active), key=lambda item: item[0])
+		if active:
+			response.append('Active alerts:')
+			response.extend("  {0} ({1})".format(key, format_alert_value(key, state.value)) for key, state in active)
+		else:
+			response.append('There are no active alerts')
+		return '\n'.join(response)
+
+	def format_history(self, samples, minutes):
+		if len(samples) < 2:
+			return 'Not enough samples have been collected yet'
+		series = collections.OrderedDict()
+		series['CPU'] = [sum(sample.cpu) / len(sample.cpu) for sample in samples]
+		series['Virtual'] = [sample.memory for sample in samples]
+		series['Swap'] = [sample.swap for sample in samples]
+		series['Load-1'] = [sample.load[0] for sample in samples]
+		for mountpoint, _ in samples[-1].disks:
+			series[mountpoint] = [percent for sample in samples for disk, percent in sample.disks if disk == mountpoint]
+		name_width = max(8, max(len(name) for name in series))
+		response = ["Usage over the last {0} minutes ({1} samples):".format(minutes, len(samples))]
+		response.append(("{0: <" + str(name_width) + "} {1:>8} {2:>8} {3:>8}").format('', 'min', 'avg', 'max'))
+		for name, values in series.items():
+			response.append(("{0: <" + str(name_width) + "} {1:>8.2f} {2:>8.2f} {3:>8.2f}").format(name, min(values), sum(values) / len(values), max(values)))
 		return '\n'.join(response)
@@ -2,17 +2,18 @@ from cassie.bot import users
 from cassie.argparselite import ArgumentParserLite
 from cassie.templates import CassieXMPPBotModule
 
+user_parser = ArgumentParserLite('user', 'add/delete/modify users')
+user_parser.add_argument('-a', '--add', dest='add user', action='store', default=None, help='add user')
+user_parser.add_argument('-d', '--del', dest='delete user', action='store', default=None, help='delete user')
+user_parser.add_argument('-l', '--lvl', dest='level', action='store', default='USER', help='permission level of user')
+user_parser.add_argument('-s', '--show', dest='show', action='store_true', default=False, help='show the user database')
+
 class Module(CassieXMPPBotModule):
 	def cmd_user(self, args, jid, is_muc):
-		parser = ArgumentParserLite('user', 'add/delete/modify users')
-		parser.add_argument('-a', '--add', dest='add user', action='store', default=None, help='add user')
-		parser.add_argument('-d', '--del', dest='delete user', action='store', default=None, help='delete user')
-		parser.add_argument('-l', '--lvl', dest='level', action='store', default='USER', help='permission level of user')
-		parser.add_argument('-s', '--show', dest='show', action='store_true', default=False, help='show the user database')
 		if not len(args):
-			return parser.format_help()
+			return user_parser.format_help()
 
-		results = parser.parse_args(args)
+		results = user_parser.parse_args(args)
 		response = ''
 		authorized_users = self.bot.authorized_users
 		privilege_level = users.get_level_by_name(results['level'])
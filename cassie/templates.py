@@ -1,5 +1,4 @@
 import logging
-import os
 
 class CassieXMPPBotModule(object):
 	permissions = {}
@@ -15,6 +14,9 @@ class CassieXMPPBotModule(object):
 	def update_options(self, options):
 		self.options.update(options)
 
+	def unload(self):
+		pass
+
 	def has_command(self, command):
 		return hasattr(self, 'cmd_' + command)
 
@@ -1,3 +1,6 @@
+import http.server
+import threading
+
 def set_proc_name(newname):
 	from ctypes import cdll, byref, create_string_buffer
 	try:
@@ -19,3 +22,21 @@ def generate_progress_bar(part, total=None, percision=4, number_of_bars=40):
 	progress_bar = bar_template.format(format(percent, '.' + str(percision) + '%'), ('=' * bars))
 	return progress_bar
 
+
+def start_http_server(address, handler_class, name='http-server'):
+	"""
+	Start a threaded HTTP server which serves requests from a daemon thread so
+	it never blocks the caller.
+
+	:param tuple address: The host and port to bind to.
+	:param handler_class: The :py:class:`http.server.BaseHTTPRequestHandler` subclass to handle requests with.
+	:param str name: The name to use for the serving thread.
+	:return: The running server, stop it with :py:meth:`~http.server.HTTPServer.shutdown`.
+	:rtype: :py:class:`http.server.ThreadingHTTPServer`
+	"""
+	server = http.server.ThreadingHTTPServer(address, handler_class)
+	server.daemon_threads = True
+	thread = threading.Thread(target=server.serve_forever, name=name)
+	thread.daemon = True
+	thread.start()
+	return server
@@ -0,0 +1,115 @@
+import logging
+import os
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'tools')))
+
+from cassie.bot import users
+from cassie.bot import xmpp
+from cassie.bot.metrics import Metrics
+
+# errors which are expected are logged by the code under test, so they are not written to stderr
+logging.getLogger('cassie').addHandler(logging.NullHandler())
+
+class StubJobManager(object):
+	"""A job manager which never runs jobs, tests and benchmarks call the job callbacks directly."""
+	def job_add(self, callback, *args, **kwargs):
+		return None
+
+	def job_delete(self, job_id, wait=True):
+		pass
+
+	def job_exists(self, job_id):
+		return False
+
+class TemporaryUserManager(users.UserManager):
+	"""A user manager whose database is in a temporary directory which is removed when it is closed."""
+	__slots__ = ('directory',)
+	def __init__(self):
+		self.directory = tempfile.TemporaryDirectory()
+		filename = os.path.join(self.directory.name, 'users.db')
+		# an empty file is used as a new database so no warning is logged about it missing
+		open(filename, 'wb').close()
+		super(TemporaryUserManager, self).__init__(filename)
+
+	def close(self):
+		super(TemporaryUserManager, self).close()
+		self.directory.cleanup()
+
+class StubBot(object):
+	"""
+	The minimal interface modules require from the bot. Messages are recorded
+	instead of being sent and formatted messages are rendered with the bot's
+	own method.
+	"""
+	send_message_formatted = xmpp.CassieXMPPBot.send_message_formatted
+	def __init__(self):
+		self.authorized_users = TemporaryUserManager()
+		self.job_manager = StubJobManager()
+		self.metrics = Metrics()
+		self.options = dict(xmpp.CassieXMPPBot.default_options, message_interval=0)
+		self.sent = []
+
+	def close(self):
+		self.authorized_users.close()
+
+	def command_handler_set_permission(self, command, userlvl):
+		pass
+
+	def chat_room_join(self, room):
+		pass
+
+	def send_message(self, mto, mbody, mtype=None, mhtml=None):
+		self.sent.append((mto, mbody, mtype))
+
+class TestXMPPBot(xmpp.CassieXMPPBot):
+	"""
+	A bot which is never connected. The stanzas it sends are recorded instead
+	and its users are stored in a temporary directory.
+	"""
+	def __init__(self, modules=None, options=None):
+		self.directory = tempfile.TemporaryDirectory()
+		self.stanzas = []
+		users_file = os.path.join(self.directory.name, 'users.db')
+		open(users_file, 'wb').close()
+		options = dict({'metrics_log_interval': 0}, **(options or {}))
+		super(TestXMPPBot, self).__init__('cassie@localhost/bot', 'password', 'admin@localhost', users_file, modules=modules, options=options)
+
+	@property
+	def sent(self):
+		return [(str(stanza['to']), stanza['body'], stanza['type']) for stanza in self.stanzas if stanza.name == 'message']
+
+	def send(self, data, mask=None, timeout=None, now=False, use_filters=True):
+		self.stanzas.append(data)
+
+	def receive(self, body, mfrom, mtype='chat'):
+		"""Handle a message as if it was received from *mfrom*."""
+		msg = self.Message()
+		msg['from'] = mfrom
+		msg['to'] = self.boundjid
+		msg['type'] = mtype
+		msg['body'] = body
+		self.message(msg)
+		return msg
+
+	def close(self):
+		self.command_workers.stop()
+		self.job_manager.stop()
+		self.authorized_users.close()
+		self.directory.cleanup()
+
+def trace_peak_memory(callback):
+	"""
+	Run *callback* once while tracing memory allocations and return the peak
+	number of bytes which were allocated. Tracing slows down allocations, so
+	benchmarks measure memory in a separate run from the one they time.
+	"""
+	tracemalloc.start()
+	try:
+		callback()
+		return tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
@@ -0,0 +1,145 @@
+import datetime
+import unittest
+import unittest.mock
+
+from support import StubBot
+
+from cassie.bot import users
+from cassie.modules import empire
+from empire_mock_server import MockEmpireServer
+
+import sleekxmpp
+
+class CircuitBreakerTests(unittest.TestCase):
+	def setUp(self):
+		self.now = 1000.0
+		patcher = unittest.mock.patch.object(empire.time, 'time', lambda: self.now)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def test_exponential_backoff(self):
+		breaker = empire.CircuitBreaker(base_delay=10, max_delay=35)
+		self.assertFalse(breaker.is_open)
+		self.assertEqual([breaker.record_failure() for _ in range(4)], [10, 20, 35, 35])
+		self.assertTrue(breaker.is_open)
+		self.now += 35
+		self.assertFalse(breaker.is_open)
+
+	def test_success_resets(self):
+		breaker = empire.CircuitBreaker(base_delay=10)
+		breaker.record_failure()
+		breaker.record_failure()
+		breaker.record_success()
+		self.assertFalse(breaker.is_open)
+		self.assertEqual(breaker.failures, 0)
+		self.assertEqual(breaker.record_failure(), 10)
+
+class EmpireShellExecTests(unittest.TestCase):
+	room = 'room@conference.localhost'
+	def setUp(self):
+		self.server = MockEmpireServer(port=0, agents=1)
+		self.agent = next(iter(self.server.agents))
+		self.bot = StubBot()
+		self.module = empire.Module(self.bot)
+		self.module.update_options({'room': self.room})
+		# commands from a room use the room's configuration
+		self.bot.authorized_users[self.room] = users.User(self.room, users.LVL_USER)
+		self.module.get_storage(self.room).update({'url': self.server.url, 'user': self.server.username, 'pass': self.server.password})
+
+	def tearDown(self):
+		self.module.unload()
+		self.server.stop()
+		self.bot.close()
+
+	def poll_results(self):
+		for future in self.module._empire_results_poll():
+			future.result()
+
+	def test_shell_exec_muc(self):
+		jid = sleekxmpp.JID(self.room + '/alice')
+		report = self.module.cmd_empire_shell_exec(['-a', self.agent, '-c', 'hostname'], jid, True)
+		self.assertIn('Success!', report)
+		self.poll_results()
+		self.assertEqual(len(self.bot.sent), 1)
+		mto, mbody, mtype = self.bot.sent[0]
+		self.assertEqual(str(mto), self.room)
+		self.assertEqual(mtype, 'groupchat')
+		self.assertIn('output of: hostname', mbody)
+		self.assertEqual(self.module.pending_tasks, {})
+
+	def test_results_are_not_fetched_for_tasks_with_ids(self):
+		with unittest.mock.patch.object(empire.EmpireAPI, 'get_cmd_output') as get_cmd_output:
+			self.module.cmd_empire_shell_exec(['-a', self.agent, '-c', 'hostname'], sleekxmpp.JID(self.room + '/alice'), True)
+		get_cmd_output.assert_not_called()
+
+	def test_malformed_results_time_out(self):
+		self.module.options['task_timeout'] = 0
+		self.module.cmd_empire_shell_exec(['-a', self.agent, '-c', 'hostname'], sleekxmpp.JID(self.room + '/alice'), True)
+		self.server.results[self.agent] = ['not a task result', None]
+		self.poll_results()
+		self.assertEqual(self.module.pending_tasks, {})
+		self.assertEqual(len(self.bot.sent), 1)
+		mto, mbody, mtype = self.bot.sent[0]
+		self.assertEqual(str(mto), self.room)
+		self.assertIn('No output was received', mbody)
+
+class EmpireAgentTrackingTests(unittest.TestCase):
+	user = 'alice@localhost'
+	def setUp(self):
+		self.server = MockEmpireServer(port=0, agents=3)
+		self.bot = StubBot()
+		self.bot.authorized_users[self.user] = users.User(self.user, users.LVL_USER)
+		self.module = self.load_module()
+		self.module.get_storage(self.user).update({'url': self.server.url, 'user': self.server.username, 'pass': self.server.password})
+
+	def tearDown(self):
+		self.module.unload()
+		self.server.stop()
+		self.bot.close()
+
+	def load_module(self):
+		module = empire.Module(self.bot)
+		module.update_options({'room': 'room@conference.localhost'})
+		return module
+
+	def poll(self):
+		del self.bot.sent[:]
+		for future in self.module._empire_poll():
+			future.result()
+		return '\n'.join(mbody for _, mbody, _ in self.bot.sent)
+
+	def test_new_agents(self):
+		self.assertIn('3 new agents', self.poll())
+		self.assertEqual(self.poll(), '')
+		self.server.add_agents(1)
+		self.assertIn('1 new agent', self.poll())
+
+	def test_failing_server_is_not_polled(self):
+		self.server.failure_rate = 1.0
+		with self.assertLogs('cassie.bot.xmpp.modules.empire', 'WARNING'):
+			self.assertEqual(self.poll(), '')
+		requests = self.server.requests
+		self.assertEqual(self.poll(), '')
+		self.assertEqual(self.server.requests, requests)
+		# the server is polled again once the backoff expires
+		self.server.failure_rate = 0.0
+		self.module.api_cache.get(self.module.get_storage(self.user)).circuit_breaker.retry_time = 0
+		self.assertIn('3 new agents', self.poll())
+
+	def test_restart_with_evicted_dead_agent(self):
+		dead_agent = next(iter(self.server.agents))
+		self.server.agents[dead_agent]['lastseen_time'] = (datetime.datetime.now() - datetime.timedelta(hours=2)).strftime('%Y-%m-%d %H:%M:%S')
+		report = self.poll()
+		self.assertIn('2 new agents', report)
+		self.assertNotIn(dead_agent, report)
+		# restart the module, the dead agent is not in storage as if it was evicted after it was lost
+		self.module.unload()
+		self.module = self.load_module()
+		self.assertNotIn(dead_agent, self.module.get_storage(self.user)['agents'])
+		self.assertEqual(self.poll(), '')
+		# the dead agent is new once it checks in again
+		self.server.check_in()
+		self.assertIn('1 new agent on your listener: ' + dead_agent, self.poll())
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,122 @@
+import datetime
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+import unittest
+
+from support import StubBot
+
+from cassie.modules import github
+import github_webhook_replay
+
+class WebhookSignatureTests(unittest.TestCase):
+	secret = b'secret'
+	body = b'{"zen": "Keep it logically awesome."}'
+	def test_sha256_signature(self):
+		signature = 'sha256=' + hmac.new(self.secret, self.body, hashlib.sha256).hexdigest()
+		self.assertTrue(github.verify_webhook_signature(self.secret, self.body, {'X-Hub-Signature-256': signature}))
+		self.assertFalse(github.verify_webhook_signature(b'wrong', self.body, {'X-Hub-Signature-256': signature}))
+
+	def test_sha1_signature(self):
+		signature = 'sha1=' + hmac.new(self.secret, self.body, hashlib.sha1).hexdigest()
+		self.assertTrue(github.verify_webhook_signature(self.secret, self.body, {'X-Hub-Signature': signature}))
+
+	def test_sha256_signature_is_preferred(self):
+		headers = {
+			'X-Hub-Signature': 'sha1=' + hmac.new(self.secret, self.body, hashlib.sha1).hexdigest(),
+			'X-Hub-Signature-256': 'sha256=' + hmac.new(b'wrong', self.body, hashlib.sha256).hexdigest()
+		}
+		self.assertFalse(github.verify_webhook_signature(self.secret, self.body, headers))
+
+	def test_missing_signature(self):
+		self.assertFalse(github.verify_webhook_signature(self.secret, self.body, {}))
+
+class RepositoryCursorsTests(unittest.TestCase):
+	repository = 'zeroSteiner/cassie-bot'
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.addCleanup(self.directory.cleanup)
+		self.filename = os.path.join(self.directory.name, 'github_state.json')
+
+	def new_cursors(self):
+		cursors = github.RepositoryCursors(self.filename, max_age=datetime.timedelta(hours=1))
+		cursors.get(self.repository, datetime.datetime(2020, 1, 1))
+		return cursors
+
+	def test_commits_are_kept_in_date_order(self):
+		cursors = self.new_cursors()
+		cursors.add_commit(self.repository, '2020-01-01T12:00:00Z', 'c')
+		cursors.add_commit(self.repository, '2020-01-01T10:00:00Z', 'a')
+		cursors.add_commit(self.repository, '2020-01-01T11:50:00Z', 'b')
+		self.assertEqual([commit_id for _, commit_id in cursors.get(self.repository, None)['commits']], ['a', 'b', 'c'])
+		# commits older than the maximum age are evicted even if they were reported last
+		cursors.add_commit(self.repository, '2020-01-01T12:45:00Z', 'd')
+		self.assertEqual([commit_id for _, commit_id in cursors.get(self.repository, None)['commits']], ['b', 'c', 'd'])
+
+	def test_state_file_round_trip(self):
+		cursors = self.new_cursors()
+		cursors.add_commit(self.repository, '2020-01-01T12:00:00Z', 'a')
+		cursors.set_pull_request(self.repository, 7)
+		cursors.save()
+		cursor = github.RepositoryCursors(self.filename).get(self.repository, None)
+		self.assertEqual(list(cursor['commits']), [('2020-01-01T12:00:00Z', 'a')])
+		self.assertEqual(cursor['pull_request'], 7)
+
+	def test_malformed_state_file(self):
+		for state in ([], {self.repository: {'commits': []}}, {self.repository: {'commit_date': 'yesterday', 'created': '2020-01-01T00:00:00Z', 'commits': []}}):
+			with open(self.filename, 'w') as file_h:
+				json.dump(state, file_h)
+			with self.assertLogs('cassie.bot.xmpp.modules.github.cursors', 'WARNING'):
+				cursors = github.RepositoryCursors(self.filename)
+			self.assertNotIn(self.repository, cursors)
+
+class WebhookReceiverTests(unittest.TestCase):
+	repository = 'zeroSteiner/cassie-bot'
+	secret = b'secret'
+	def setUp(self):
+		self.bot = StubBot()
+		self.module = github.Module(self.bot)
+		self.module.update_options({
+			'repositories': [self.repository],
+			'room': 'room@conference.localhost',
+			'webhook': {'port': 0, 'secret': self.secret.decode('utf-8')}
+		})
+		host, port = self.module.webhook.server.server_address[:2]
+		self.url = "http://{0}:{1}/github".format(host, port)
+
+	def tearDown(self):
+		self.module.unload()
+		self.bot.close()
+
+	def replay(self, event, payload, secret=None):
+		status = github_webhook_replay.post_payload(self.url, secret or self.secret, event, json.dumps(payload).encode('utf-8'))
+		# wait for the reports to be sent
+		self.module.executor.shutdown(wait=True)
+		return status
+
+	def test_default_branch_push(self):
+		self.assertEqual(self.replay('push', github_webhook_replay.sample_payload('push', self.repository)), 202)
+		self.assertEqual(len(self.bot.sent), 1)
+		self.assertIn('pushed', self.bot.sent[0][1])
+
+	def test_other_branch_push(self):
+		self.assertEqual(self.replay('push', github_webhook_replay.sample_payload('push', self.repository, branch='feature')), 202)
+		self.assertEqual(self.bot.sent, [])
+
+	def test_push_without_distinct_commits(self):
+		payload = github_webhook_replay.sample_payload('push', self.repository)
+		payload['commits'][0]['distinct'] = False
+		self.assertEqual(self.replay('push', payload), 202)
+		self.assertEqual(self.bot.sent, [])
+
+	def test_invalid_signature(self):
+		self.assertEqual(self.replay('push', github_webhook_replay.sample_payload('push', self.repository), secret=b'wrong'), 403)
+		self.assertEqual(self.bot.sent, [])
+
+	def test_unexpected_payload(self):
+		self.assertEqual(self.replay('push', {'repository': {'full_name': self.repository}}), 400)
+
+if __name__ == '__main__':
+	unittest.main()
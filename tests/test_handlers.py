@@ -0,0 +1,63 @@
+import time
+import unittest
+
+import support  # noqa: F401 (adds the repository to the import path)
+
+from cassie.bot import handlers
+
+def first(message, jid):
+	pass
+
+def second(message, jid):
+	pass
+
+class CustomMessageHandlerRegistryTests(unittest.TestCase):
+	session_id = 'alice@localhost/resource'
+	def setUp(self):
+		self.registry = handlers.CustomMessageHandlerRegistry()
+
+	def test_priority_order(self):
+		low = self.registry.add(self.session_id, first, 60)
+		high = self.registry.add(self.session_id, second, 60, priority=10)
+		self.assertEqual(self.registry.get_chain(self.session_id), (high, low))
+		self.assertIs(self.registry.dispatch(self.session_id, 'look', self.session_id), high)
+
+	def test_predicate(self):
+		low = self.registry.add(self.session_id, first, 60)
+		self.registry.add(self.session_id, second, 60, priority=10, predicate=lambda message, jid: message.startswith('!'))
+		self.assertIs(self.registry.dispatch(self.session_id, 'look', self.session_id), low)
+
+	def test_add_replaces_callback(self):
+		self.registry.add(self.session_id, first, 60)
+		handler = self.registry.add(self.session_id, first, 60)
+		self.assertEqual(self.registry.get_chain(self.session_id), (handler,))
+		self.assertEqual(len(self.registry), 1)
+
+	def test_expired_handlers_are_reaped(self):
+		expired = self.registry.add(self.session_id, first, 0)
+		handler = self.registry.add(self.session_id, second, 60)
+		self.assertIsNone(self.registry.get(expired.handler_id))
+		self.assertIs(self.registry.dispatch(self.session_id, 'look', self.session_id), handler)
+		self.assertEqual(self.registry.reap(), [expired])
+		self.assertEqual(self.registry.get_chain(self.session_id), (handler,))
+		self.assertEqual(len(self.registry), 1)
+
+	def test_used_handlers_are_not_reaped(self):
+		handler = self.registry.add(self.session_id, first, 0.05)
+		time.sleep(0.03)
+		self.registry.dispatch(self.session_id, 'look', self.session_id)
+		time.sleep(0.03)
+		self.assertEqual(self.registry.reap(), [])
+		self.assertIs(self.registry.get(handler.handler_id), handler)
+
+	def test_remove_callback_only_removes_its_handler(self):
+		self.registry.add(self.session_id, first, 60)
+		handler = self.registry.add(self.session_id, second, 60)
+		self.assertIsNotNone(self.registry.remove_callback(self.session_id, first))
+		self.assertIsNone(self.registry.remove_callback(self.session_id, first))
+		self.assertEqual(self.registry.get_chain(self.session_id), (handler,))
+		self.assertIs(self.registry.remove(handler.handler_id), handler)
+		self.assertNotIn(self.session_id, self.registry)
+
+if __name__ == '__main__':
+	unittest.main()
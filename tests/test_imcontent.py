@@ -0,0 +1,68 @@
+import unittest
+
+import support  # noqa: F401 (adds the repository to the import path)
+
+from cassie import imcontent
+
+class RenderCacheTests(unittest.TestCase):
+	def test_least_recently_used_is_evicted(self):
+		cache = imcontent.RenderCache(max_size=2)
+		cache.set('a', 1)
+		cache.set('b', 2)
+		self.assertEqual(cache.get('a'), 1)
+		cache.set('c', 3)
+		self.assertIsNone(cache.get('b'))
+		self.assertEqual(cache.get('a'), 1)
+		self.assertEqual(cache.get('c'), 3)
+		self.assertEqual(len(cache), 2)
+		self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+	def test_disabled(self):
+		cache = imcontent.RenderCache(max_size=0)
+		cache.set('a', 1)
+		self.assertIsNone(cache.get('a'))
+		self.assertEqual(len(cache), 0)
+
+	def test_cached_xhtml_is_copied(self):
+		content = imcontent.IMContentMarkdown('**bold**', 'Monospace')
+		xhtml = content.get_xhtml()
+		xhtml.set('style', 'changed')
+		self.assertNotEqual(content.get_xhtml().get('style'), 'changed')
+		self.assertEqual(content.get_xhtml(element=False), imcontent.IMContentMarkdown('**bold**', 'Monospace').get_xhtml(element=False))
+
+class SplitTests(unittest.TestCase):
+	def test_split_text_on_lines(self):
+		self.assertEqual(imcontent.split_text('aaa\nbbb\nccc', 7), ['aaa\nbbb', 'ccc'])
+		self.assertEqual(imcontent.split_text('aaaaaaaaaa', 4), ['aaaa', 'aaaa', 'aa'])
+
+	def test_split_markdown_on_blocks(self):
+		text = 'first paragraph\nstill first\n\nsecond paragraph\n\nthird'
+		self.assertEqual(imcontent.split_markdown(text, 40), ['first paragraph\nstill first', 'second paragraph\n\nthird'])
+
+	def test_split_markdown_keeps_code_blocks(self):
+		code = '```\nline one\n\nline two\n```'
+		text = 'intro paragraph\n\n' + code + '\n\nthe end'
+		chunks = imcontent.split_markdown(text, len(code) + 2)
+		self.assertEqual(chunks, ['intro paragraph', code, 'the end'])
+
+	def test_split_markdown_reopens_code_fences(self):
+		text = '```python\n' + '\n'.join('print({0})'.format(idx) for idx in range(10)) + '\n```'
+		chunks = imcontent.split_markdown(text, 40)
+		self.assertGreater(len(chunks), 1)
+		for chunk in chunks:
+			self.assertLessEqual(len(chunk), 40)
+			lines = chunk.split('\n')
+			self.assertEqual(lines[0], '```python')
+			self.assertEqual(lines[-1], '```')
+		body = [line for chunk in chunks for line in chunk.split('\n')[1:-1]]
+		self.assertEqual(body, ['print({0})'.format(idx) for idx in range(10)])
+
+	def test_markdown_content_split(self):
+		content = imcontent.IMContentMarkdown('one\n\ntwo', 'Monospace')
+		chunks = content.split(4)
+		self.assertEqual([chunk.get_text() for chunk in chunks], ['one', 'two'])
+		self.assertTrue(all(isinstance(chunk, imcontent.IMContentMarkdown) for chunk in chunks))
+		self.assertEqual(chunks[0].font, 'Monospace')
+
+if __name__ == '__main__':
+	unittest.main()
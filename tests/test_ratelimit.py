@@ -0,0 +1,64 @@
+import unittest
+import unittest.mock
+
+import support  # noqa: F401 (adds the repository to the import path)
+
+from cassie.bot import ratelimit
+
+class RateLimiterTests(unittest.TestCase):
+	def setUp(self):
+		self.now = 1000.0
+		patcher = unittest.mock.patch.object(ratelimit.time, 'monotonic', lambda: self.now)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		self.limiter = ratelimit.RateLimiter({'admin': None, 'user': {'rate': 1, 'burst': 3}}, max_buckets=2, max_throttled=1)
+
+	def test_burst_is_throttled(self):
+		for _ in range(3):
+			self.assertIsNone(self.limiter.check('alice@localhost', 'user'))
+		bucket = self.limiter.check('alice@localhost', 'user')
+		self.assertIsInstance(bucket, ratelimit.TokenBucket)
+		self.assertEqual(self.limiter.throttled['alice@localhost'], 1)
+		self.assertEqual(self.limiter.throttled_count, 1)
+		# other keys have their own bucket
+		self.assertIsNone(self.limiter.check('bob@localhost', 'user'))
+
+	def test_bucket_refills(self):
+		for _ in range(3):
+			self.limiter.check('alice@localhost', 'user')
+		bucket = self.limiter.check('alice@localhost', 'user')
+		bucket.notified = True
+		self.now += 1
+		self.assertIsNone(self.limiter.check('alice@localhost', 'user'))
+		self.assertFalse(bucket.notified)
+		self.assertIsNotNone(self.limiter.check('alice@localhost', 'user'))
+		self.now += 10
+		for _ in range(3):
+			self.assertIsNone(self.limiter.check('alice@localhost', 'user'))
+
+	def test_unlimited_levels(self):
+		for _ in range(10):
+			self.assertIsNone(self.limiter.check('admin@localhost', 'admin'))
+			self.assertIsNone(self.limiter.check('room@conference.localhost', 'room'))
+		self.assertEqual(len(self.limiter), 0)
+
+	def test_idle_buckets_are_pruned(self):
+		for _ in range(4):
+			self.limiter.check('alice@localhost', 'user')
+		for _ in range(2):
+			self.limiter.check('bob@localhost', 'user')
+		self.now += 1
+		for _ in range(5):
+			self.limiter.check('carol@localhost', 'user')
+		# no buckets were full when carol's was added
+		self.assertEqual(len(self.limiter), 3)
+		self.now += 2
+		# alice's and bob's buckets are full again so they are dropped when the next key is added
+		self.limiter.check('dave@localhost', 'user')
+		self.assertEqual(len(self.limiter), 2)
+		# only the count of the key with the most throttled messages is kept
+		self.assertEqual(dict(self.limiter.throttled), {'carol@localhost': 2})
+		self.assertEqual(self.limiter.throttled_count, 3)
+
+if __name__ == '__main__':
+	unittest.main()
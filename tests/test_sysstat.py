@@ -0,0 +1,54 @@
+import collections
+import unittest
+import unittest.mock
+
+from support import StubBot
+
+from cassie.modules import sysstat
+
+DiskPartition = collections.namedtuple('DiskPartition', ('device', 'mountpoint', 'fstype', 'opts'))
+DiskUsage = collections.namedtuple('DiskUsage', ('total', 'used'))
+
+class TakeSampleTests(unittest.TestCase):
+	def test_read_only_and_memory_file_systems_are_skipped(self):
+		partitions = [
+			DiskPartition('/dev/sda1', '/', 'ext4', 'rw,relatime'),
+			DiskPartition('/dev/loop0', '/snap/core/1', 'squashfs', 'ro,nodev,relatime'),
+			DiskPartition('/dev/sr0', '/media/cdrom', 'iso9660', 'ro'),
+			DiskPartition('tmpfs', '/run', 'tmpfs', 'rw,nosuid'),
+			DiskPartition('/dev/sda2', '/srv/robots', 'ext4', 'rw,errors=remount-ro')
+		]
+		with unittest.mock.patch.object(sysstat.psutil, 'disk_partitions', return_value=partitions), \
+				unittest.mock.patch.object(sysstat.psutil, 'disk_usage', return_value=DiskUsage(100, 100)):
+			sample = sysstat.take_sample()
+		self.assertEqual(sample.disks, (('/', 100.0), ('/srv/robots', 100.0)))
+
+class SysstatAlertTests(unittest.TestCase):
+	room = 'alerts@conference.localhost'
+	def setUp(self):
+		self.bot = StubBot()
+		self.module = sysstat.Module(self.bot)
+		self.module.update_options({'alerts': {'rooms': [self.room], 'memory': 0}})
+
+	def tearDown(self):
+		self.module.unload()
+		self.bot.close()
+
+	def test_command_does_not_check_alerts(self):
+		self.assertIn('Memory Usage', self.module.cmd_sysstat([], 'alice@localhost/laptop', False))
+		self.assertEqual(self.bot.sent, [])
+		self.assertEqual(len(self.module.get_samples()), 1)
+
+	def test_sample_job_sends_alerts(self):
+		self.module.sample_job()
+		self.assertEqual(len(self.bot.sent), 1)
+		mto, mbody, mtype = self.bot.sent[0]
+		self.assertEqual(mto, self.room)
+		self.assertIn('System alert: Memory usage', mbody)
+		self.assertIn('memory', self.module.format_alerts())
+		# reminders are not sent until the cooldown has passed
+		self.module.sample_job()
+		self.assertEqual(len(self.bot.sent), 1)
+
+if __name__ == '__main__':
+	unittest.main()
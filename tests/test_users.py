@@ -0,0 +1,189 @@
+import os
+import pickle
+import tempfile
+import unittest
+import unittest.mock
+
+import support  # noqa: F401 (adds the repository to the import path)
+
+from cassie.bot import users
+
+class LegacyUser(object):
+	"""Pickles like a user from before the users were stored in SQLite, when the storage was a slot."""
+	def __init__(self, name, level, storage):
+		self.name = name
+		self.level = level
+		self.storage = storage
+
+	def __reduce__(self):
+		return (object.__new__, (users.User,), (None, {'level': self.level, 'name': self.name, 'storage': self.storage}))
+
+class TrackedStorageTests(unittest.TestCase):
+	def setUp(self):
+		self.changes = 0
+		self.user = users.User('alice@localhost', users.LVL_USER)
+		self.user._on_change = self.on_change
+
+	def on_change(self, user):
+		self.changes += 1
+
+	def test_nested_changes_are_tracked(self):
+		self.user.storage['module'] = {'items': []}
+		self.user.storage['module']['items'].append({'name': 'one'})
+		self.user.storage['module']['items'][0]['name'] = 'two'
+		self.user.storage.setdefault('module', {})
+		self.assertEqual(self.changes, 3)
+		self.assertIsInstance(self.user.storage['module']['items'][0], users.TrackedDict)
+
+	def test_reads_are_not_tracked(self):
+		self.user.storage['module'] = {'items': [1, 2]}
+		self.changes = 0
+		self.user.storage.get('module')
+		list(self.user.storage['module']['items'])
+		self.assertEqual(self.changes, 0)
+
+	def test_storage_pickles_as_builtin_types(self):
+		self.user.storage['module'] = {'items': [{'name': 'one'}]}
+		storage = pickle.loads(pickle.dumps(self.user.storage))
+		self.assertIs(type(storage), dict)
+		self.assertIs(type(storage['module']['items']), list)
+		self.assertEqual(storage, {'module': {'items': [{'name': 'one'}]}})
+
+class UserManagerTests(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.filename = os.path.join(self.directory.name, 'users.db')
+
+	def tearDown(self):
+		self.directory.cleanup()
+
+	def open_manager(self):
+		manager = users.UserManager(self.filename)
+		self.addCleanup(manager.close)
+		return manager
+
+	def test_users_are_loaded_lazily(self):
+		manager = self.open_manager()
+		for name in ('alice@localhost', 'bob@localhost'):
+			manager[name] = users.User(name, users.LVL_USER)
+			manager[name].storage['greeting'] = 'hello ' + name
+		manager.save()
+		manager.close()
+
+		manager = self.open_manager()
+		self.assertEqual(len(manager), 2)
+		self.assertIn('alice@localhost', manager)
+		self.assertEqual(manager.count_users(), 2)
+		self.assertEqual(manager['alice@localhost'].storage['greeting'], 'hello alice@localhost')
+		self.assertEqual(manager._unloaded, set(['bob@localhost']))
+
+	def test_deleted_users_are_removed(self):
+		manager = self.open_manager()
+		manager['alice@localhost'] = users.User('alice@localhost', users.LVL_USER)
+		manager.save()
+		del manager['alice@localhost']
+		manager.save()
+		manager.close()
+		self.assertNotIn('alice@localhost', self.open_manager())
+
+	def test_rooms_are_not_saved(self):
+		manager = self.open_manager()
+		manager['room@conference.localhost'] = users.Room('room@conference.localhost')
+		manager['alice@localhost'] = users.User('alice@localhost', users.LVL_USER)
+		self.assertEqual([room.name for room in manager.get_rooms()], ['room@conference.localhost'])
+		manager.save()
+		manager.close()
+		manager = self.open_manager()
+		self.assertEqual(manager.get_rooms(), [])
+		self.assertEqual(len(manager), 1)
+
+	def test_count_users_excludes_rooms(self):
+		manager = self.open_manager()
+		manager['alice@localhost'] = users.User('alice@localhost', users.LVL_USER)
+		manager['bob@localhost'] = users.User('bob@localhost', users.LVL_USER)
+		manager.save()
+		manager.close()
+		manager = self.open_manager()
+		manager['room@conference.localhost'] = users.Room('room@conference.localhost')
+		manager['alice@localhost'].storage['greeting'] = 'hello'
+		self.assertEqual(manager.count_users(), 2)
+		self.assertEqual(len(manager), 3)
+
+	def test_get_with_storage(self):
+		manager = self.open_manager()
+		for name in ('alice@localhost', 'bob@localhost', 'carol@localhost'):
+			manager[name] = users.User(name, users.LVL_USER)
+		manager['alice@localhost'].storage['empire'] = {'url': 'http://localhost/'}
+		manager.save()
+		manager.close()
+
+		manager = self.open_manager()
+		manager['carol@localhost'].storage['empire'] = {}
+		self.assertEqual(sorted(user.name for user in manager.get_with_storage('empire')), ['alice@localhost', 'carol@localhost'])
+		# bob does not have empire storage so he is not loaded
+		self.assertIn('bob@localhost', manager._unloaded)
+
+	def test_storage_keys_are_indexed_for_existing_databases(self):
+		manager = self.open_manager()
+		manager['alice@localhost'] = users.User('alice@localhost', users.LVL_USER)
+		manager['alice@localhost'].storage['empire'] = {}
+		manager.save()
+		manager._connection.execute('DROP TABLE storage_keys')
+		manager._connection.commit()
+		manager.close()
+		self.assertEqual([user.name for user in self.open_manager().get_with_storage('empire')], ['alice@localhost'])
+
+	def test_only_changed_users_are_saved(self):
+		manager = self.open_manager()
+		manager['alice@localhost'] = users.User('alice@localhost', users.LVL_USER)
+		manager['bob@localhost'] = users.User('bob@localhost', users.LVL_USER)
+		manager.save()
+		self.assertEqual(manager._dirty, set())
+		manager['alice@localhost'].storage['module'] = {'items': []}
+		manager['alice@localhost'].storage['module']['items'].append(1)
+		self.assertEqual(manager._dirty, set(['alice@localhost']))
+		with self.assertLogs('cassie.bot.user_manager', 'DEBUG') as logs:
+			manager.save()
+		self.assertIn('saved 1 changed and 0 deleted authorized users', '\n'.join(logs.output))
+		manager.close()
+		self.assertEqual(self.open_manager()['alice@localhost'].storage, {'module': {'items': [1]}})
+
+	def test_legacy_pickle_migration(self):
+		legacy_users = {
+			'alice@localhost': LegacyUser('alice@localhost', users.LVL_ADMIN, {'empire': {'agents': ['A1']}}),
+			'bob@localhost': LegacyUser('bob@localhost', users.LVL_USER, None)
+		}
+		with open(self.filename, 'wb') as file_h:
+			pickle.dump(legacy_users, file_h)
+		with self.assertLogs('cassie.bot.user_manager', 'INFO') as logs:
+			manager = self.open_manager()
+		self.assertTrue(os.path.isfile(self.filename + '.bak'))
+		self.assertTrue(users.is_sqlite_file(self.filename))
+		self.assertIn('successfully found 2 authorized users', '\n'.join(logs.output))
+		self.assertTrue(manager['alice@localhost'].is_admin())
+		self.assertEqual(manager['alice@localhost'].storage, {'empire': {'agents': ['A1']}})
+		self.assertEqual(manager['bob@localhost'].storage, {})
+		manager.close()
+
+		manager = self.open_manager()
+		self.assertEqual(manager['alice@localhost'].storage['empire']['agents'], ['A1'])
+
+	def test_save_retries_users_modified_while_copying(self):
+		manager = self.open_manager()
+		manager['alice@localhost'] = users.User('alice@localhost', users.LVL_USER)
+		manager['bob@localhost'] = users.User('bob@localhost', users.LVL_USER)
+		manager['alice@localhost'].storage['fail'] = True
+		original_deepcopy = users.copy.deepcopy
+		def deepcopy(value):
+			if 'fail' in value:
+				raise RuntimeError('dictionary changed size during iteration')
+			return original_deepcopy(value)
+		with unittest.mock.patch.object(users.copy, 'deepcopy', deepcopy):
+			manager.save()
+		self.assertEqual(manager._dirty, set(['alice@localhost']))
+		manager.save()
+		manager.close()
+		self.assertEqual(len(self.open_manager()), 2)
+
+if __name__ == '__main__':
+	unittest.main()
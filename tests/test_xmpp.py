@@ -0,0 +1,120 @@
+import threading
+import time
+import unittest
+
+from support import TestXMPPBot
+
+from cassie.bot import users
+from cassie.bot import xmpp
+
+import sleekxmpp
+
+class SessionOrderTests(unittest.TestCase):
+	def setUp(self):
+		self.bot = TestXMPPBot()
+		self.bot.authorized_users['alice@localhost'] = users.User('alice@localhost', users.LVL_USER)
+		self.events = []
+		self.events_lock = threading.Lock()
+		self.bot.command_handlers['slow'] = xmpp.CommandHandler('slow', self.cmd_slow, users.LVL_USER)
+
+	def tearDown(self):
+		self.bot.close()
+
+	def record(self, event):
+		with self.events_lock:
+			self.events.append(event)
+
+	def cmd_slow(self, args, jid, is_muc):
+		self.record('command started')
+		time.sleep(0.2)
+		self.record('command finished')
+		return 'done'
+
+	def callback_input(self, message, jid, handler_id):
+		self.record('input ' + message)
+		return 'ok'
+
+	def test_command_and_handler_input_are_ordered(self):
+		jid = 'alice@localhost/laptop'
+		self.bot.custom_message_handler_add(jid, self.callback_input, 60)
+		self.bot.receive('!slow', jid)
+		self.bot.receive('look', jid)
+		# stopping waits for the accepted tasks to finish
+		self.bot.command_workers.stop()
+		self.assertEqual(self.events, ['command started', 'command finished', 'input look'])
+
+	def test_room_command_and_handler_input_are_ordered(self):
+		room = 'room@conference.localhost'
+		self.bot.authorized_users[room] = users.Room(room)
+		self.bot.custom_message_handler_add(room, self.callback_input, 60)
+		self.bot.receive('!cassie.slow', room + '/alice', 'groupchat')
+		self.bot.receive('@cassie. look', room + '/bob', 'groupchat')
+		self.bot.command_workers.stop()
+		self.assertEqual(self.events, ['command started', 'command finished', 'input look'])
+
+class CommandMetricsTests(unittest.TestCase):
+	def setUp(self):
+		self.bot = TestXMPPBot(options={'message_interval': 0})
+		self.bot.authorized_users['alice@localhost'] = users.User('alice@localhost', users.LVL_USER)
+		self.bot.command_handlers['stream'] = xmpp.CommandHandler('stream', self.cmd_stream, users.LVL_USER)
+
+	def tearDown(self):
+		self.bot.close()
+
+	def cmd_stream(self, args, jid, is_muc):
+		yield 'first'
+		time.sleep(0.1)
+		yield 'second'
+
+	def test_generator_commands_are_timed(self):
+		self.bot.receive('!stream', 'alice@localhost/laptop')
+		self.bot.command_workers.stop()
+		self.assertEqual([mbody for _, mbody, _ in self.bot.sent], ['first', 'second'])
+		histogram = self.bot.metrics.histograms['command.stream']
+		self.assertEqual(histogram.count, 1)
+		self.assertGreaterEqual(histogram.total, 0.1)
+
+class ModuleControlTests(unittest.TestCase):
+	admin = 'admin@localhost/laptop'
+	def setUp(self):
+		self.bot = TestXMPPBot()
+		self.assertTrue(self.bot.module_load('bot_control'))
+		self.assertTrue(self.bot.module_load('cyclic_pattern'))
+
+	def tearDown(self):
+		self.bot.close()
+
+	def cmd_bot(self, *args):
+		return self.bot.command_handlers['bot'].callback(list(args), sleekxmpp.JID(self.admin), False)
+
+	def test_unload_and_load(self):
+		self.assertIn('Unloaded module: cyclic_pattern', self.cmd_bot('--unload', 'cyclic_pattern'))
+		self.assertNotIn('cyclic_pattern', [module.name for module in self.bot.bot_modules])
+		self.assertNotIn('cyclic_pattern', self.bot.command_handlers)
+		self.assertIn('Module is not loaded: cyclic_pattern', self.cmd_bot('--unload', 'cyclic_pattern'))
+		self.assertIn('Loaded module: cyclic_pattern', self.cmd_bot('--load', 'cyclic_pattern'))
+		self.assertIn('cyclic_pattern', self.bot.command_handlers)
+		self.assertIn('Module is already loaded: cyclic_pattern', self.cmd_bot('--load', 'cyclic_pattern'))
+
+	def test_bot_control_can_not_be_unloaded(self):
+		self.assertIn('Can not unload', self.cmd_bot('--unload', 'bot_control'))
+		self.assertIn('bot', self.bot.command_handlers)
+
+class UnauthorizedUserTests(unittest.TestCase):
+	def setUp(self):
+		self.bot = TestXMPPBot()
+
+	def tearDown(self):
+		self.bot.close()
+
+	def test_replies_are_rate_limited(self):
+		burst = int(self.bot.options['rate_limits']['guest']['burst'])
+		with self.assertLogs('cassie.bot', 'WARNING') as logs:
+			for _ in range(burst * 4):
+				self.bot.receive('hello', 'mallory@localhost/laptop')
+		self.assertEqual(len(self.bot.sent), burst)
+		self.assertTrue(all(mto == 'mallory@localhost/laptop' for mto, _, _ in self.bot.sent))
+		self.assertEqual(len(logs.output), burst + 1)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,197 @@
+#!/usr/bin/python3 -B
+import argparse
+import datetime
+import http.server
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+
+class MockHTTPServer(http.server.ThreadingHTTPServer):
+	daemon_threads = True
+	# many users are polled concurrently so accept bursts of connections
+	request_queue_size = 128
+
+class MockEmpireServer(object):
+	"""
+	A local stand-in for the Empire REST API which implements the endpoints
+	used by the empire module. Any number of agents can be simulated and
+	responses can be delayed or fail at random to exercise error handling.
+	"""
+	def __init__(self, host='127.0.0.1', port=1337, agents=10, username='empireadmin', password='Password123!', latency=0.0, failure_rate=0.0, token_lifetime=None):
+		self.username = username
+		self.password = password
+		self.latency = latency
+		self.failure_rate = failure_rate
+		self.token_lifetime = token_lifetime
+		self.tokens = {}
+		self.agents = {}
+		self.results = {}
+		self.requests = 0
+		self.lock = threading.Lock()
+		self.add_agents(agents)
+		server = self
+
+		class RequestHandler(http.server.BaseHTTPRequestHandler):
+			disable_nagle_algorithm = True
+			protocol_version = 'HTTP/1.1'
+			def send_json(self, status, data):
+				body = json.dumps(data).encode('utf-8')
+				self.send_response(status)
+				self.send_header('Content-Type', 'application/json')
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def handle_request(self, method):
+				with server.lock:
+					server.requests += 1
+				# the body is always read so it is not parsed as the next request on the connection
+				body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+				if server.latency:
+					time.sleep(server.latency)
+				if server.failure_rate and random.random() < server.failure_rate:
+					self.send_json(500, {'error': 'simulated failure'})
+					return
+				url = urllib.parse.urlparse(self.path)
+				query = urllib.parse.parse_qs(url.query)
+				body = json.loads(body or b'{}') if method == 'POST' else None
+				path = url.path.strip('/').split('/')
+				if path[:1] != ['api']:
+					self.send_json(404, {'error': 'not found'})
+					return
+				status, data = server.dispatch(method, path[1:], query.get('token', [None])[0], body)
+				self.send_json(status, data)
+
+			def do_GET(self):
+				self.handle_request('GET')
+
+			def do_POST(self):
+				self.handle_request('POST')
+
+			def log_message(self, format, *args):
+				pass
+
+		self.server = MockHTTPServer((host, port), RequestHandler)
+		thread = threading.Thread(target=self.server.serve_forever, name='empire-mock-server')
+		thread.daemon = True
+		thread.start()
+
+	@property
+	def url(self):
+		host, port = self.server.server_address[:2]
+		return "http://{0}:{1}/".format(host, port)
+
+	def add_agents(self, count):
+		with self.lock:
+			for _ in range(count):
+				name = uuid.uuid4().hex[:8].upper()
+				self.agents[name] = {
+					'name': name,
+					'ID': len(self.agents) + 1,
+					'username': 'CORP\\user' + str(len(self.agents)),
+					'high_integrity': random.randint(0, 1),
+					'external_ip': '203.0.113.' + str(random.randint(1, 254)),
+					'internal_ip': '10.0.' + str(random.randint(0, 254)) + '.' + str(random.randint(1, 254)),
+					'os_details': 'Microsoft Windows 10 Enterprise',
+					'lastseen_time': self.now()
+				}
+				self.results[name] = []
+
+	def remove_agents(self, count):
+		with self.lock:
+			for name in list(self.agents)[:count]:
+				del self.agents[name]
+				del self.results[name]
+
+	def check_in(self, ratio=1.0):
+		"""Update the last seen time of the specified ratio of the agents as if they checked in"""
+		with self.lock:
+			for agent in self.agents.values():
+				if random.random() < ratio:
+					agent['lastseen_time'] = self.now()
+
+	@staticmethod
+	def now():
+		return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
+
+	def is_authenticated(self, token):
+		with self.lock:
+			created = self.tokens.get(token)
+		if created is None:
+			return False
+		return self.token_lifetime is None or time.time() - created < self.token_lifetime
+
+	def dispatch(self, method, path, token, body):
+		if method == 'POST' and path == ['admin', 'login']:
+			if body.get('username') != self.username or body.get('password') != self.password:
+				return 401, {'error': 'invalid credentials'}
+			token = uuid.uuid4().hex
+			with self.lock:
+				self.tokens[token] = time.time()
+			return 200, {'token': token}
+		if not self.is_authenticated(token):
+			return 401, {'error': 'invalid token'}
+		with self.lock:
+			if method == 'GET' and path == ['listeners']:
+				return 200, {'listeners': [{'name': 'http', 'module': 'http', 'listener_type': 'native', 'options': {'Host': {'Value': self.url}}}]}
+			if method == 'GET' and path == ['agents']:
+				return 200, {'agents': list(self.agents.values())}
+			if method == 'GET' and path == ['creds']:
+				return 200, {'creds': [{'credtype': 'password', 'domain': 'CORP', 'username': 'user0', 'password': 'Summer2026!'}]}
+			if len(path) == 3 and path[0] == 'agents' and path[1] in self.agents:
+				name = path[1]
+				if method == 'POST' and path[2] == 'shell':
+					task_id = len(self.results[name]) + 1
+					self.results[name].append({'taskID': task_id, 'command': body.get('command'), 'results': 'output of: ' + str(body.get('command'))})
+					return 200, {'success': True, 'taskID': task_id}
+				if method == 'GET' and path[2] == 'results':
+					return 200, {'results': [{'AgentName': name, 'AgentResults': list(self.results[name])}]}
+		return 404, {'error': 'not found'}
+
+	def stop(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+def main():
+	parser = argparse.ArgumentParser(description='Cassie: Mock Empire REST Server', conflict_handler='resolve')
+	parser.add_argument('--host', default='127.0.0.1', help='the host to listen on')
+	parser.add_argument('-p', '--port', type=int, default=1337, help='the port to listen on')
+	parser.add_argument('-a', '--agents', type=int, default=10, help='the number of agents to simulate')
+	parser.add_argument('-u', '--username', default='empireadmin', help='the username to accept')
+	parser.add_argument('-P', '--password', default='Password123!', help='the password to accept')
+	parser.add_argument('-l', '--latency', type=float, default=0.0, help='the number of seconds to delay each response')
+	parser.add_argument('-f', '--failure-rate', dest='failure_rate', type=float, default=0.0, help='the fraction of requests which fail')
+	parser.add_argument('-t', '--token-lifetime', dest='token_lifetime', type=float, help='the number of seconds before tokens expire')
+	parser.add_argument('--churn', type=float, default=0.0, help='the fraction of agents replaced every ten seconds')
+	arguments = parser.parse_args()
+
+	server = MockEmpireServer(
+		host=arguments.host,
+		port=arguments.port,
+		agents=arguments.agents,
+		username=arguments.username,
+		password=arguments.password,
+		latency=arguments.latency,
+		failure_rate=arguments.failure_rate,
+		token_lifetime=arguments.token_lifetime
+	)
+	print("serving a mock empire server with {0:,} agents on {1}".format(arguments.agents, server.url))
+	try:
+		while True:
+			time.sleep(10)
+			server.check_in(0.9)
+			if arguments.churn:
+				count = int(len(server.agents) * arguments.churn)
+				server.remove_agents(count)
+				server.add_agents(count)
+	except KeyboardInterrupt:
+		server.stop()
+	return os.EX_OK
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,86 @@
+#!/usr/bin/python3 -B
+import argparse
+import datetime
+import hashlib
+import hmac
+import json
+import sys
+import urllib.error
+import urllib.request
+import uuid
+
+def sample_payload(event, repository, branch='master'):
+	"""Build a minimal payload with the fields the github module uses, the default branch is master."""
+	now = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+	if event == 'push':
+		commit_id = uuid.uuid4().hex + uuid.uuid4().hex[:8]
+		return {
+			'ref': 'refs/heads/' + branch,
+			'repository': {'default_branch': 'master', 'full_name': repository},
+			'commits': [{
+				'distinct': True,
+				'id': commit_id,
+				'message': 'Replayed commit ' + commit_id[:7],
+				'timestamp': now,
+				'committer': {'name': 'Webhook Replay', 'email': 'replay@localhost'}
+			}]
+		}
+	if event == 'pull_request':
+		return {
+			'action': 'opened',
+			'repository': {'full_name': repository},
+			'pull_request': {
+				'number': int(datetime.datetime.now().timestamp()) % 100000,
+				'title': 'Replayed pull request',
+				'created_at': now,
+				'user': {'login': 'webhook-replay'}
+			}
+		}
+	return {'zen': 'Keep it logically awesome.', 'repository': {'full_name': repository}}
+
+def post_payload(url, secret, event, body):
+	headers = {
+		'Content-Type': 'application/json',
+		'User-Agent': 'GitHub-Hookshot/replay',
+		'X-GitHub-Delivery': str(uuid.uuid4()),
+		'X-GitHub-Event': event,
+		'X-Hub-Signature': 'sha1=' + hmac.new(secret, body, hashlib.sha1).hexdigest(),
+		'X-Hub-Signature-256': 'sha256=' + hmac.new(secret, body, hashlib.sha256).hexdigest()
+	}
+	request = urllib.request.Request(url, data=body, headers=headers, method='POST')
+	try:
+		with urllib.request.urlopen(request, timeout=10) as response:
+			return response.status
+	except urllib.error.HTTPError as error:
+		return error.code
+
+def main():
+	parser = argparse.ArgumentParser(description='replay github webhook deliveries to the github module')
+	parser.add_argument('-u', '--url', default='http://127.0.0.1:8090/github', help='the url of the webhook receiver')
+	parser.add_argument('-s', '--secret', required=True, help='the webhook secret to sign the deliveries with')
+	parser.add_argument('-e', '--event', default='push', choices=('ping', 'pull_request', 'push'), help='the event type of the deliveries')
+	parser.add_argument('-r', '--repository', default='zeroSteiner/cassie-bot', help='the repository for generated payloads')
+	parser.add_argument('-b', '--branch', default='master', help='the branch for generated push payloads')
+	parser.add_argument('-c', '--count', default=1, type=int, help='the number of times to send each payload')
+	parser.add_argument('payloads', nargs='*', help='recorded json payload files to send instead of a generated one')
+	arguments = parser.parse_args()
+
+	secret = arguments.secret.encode('utf-8')
+	if arguments.payloads:
+		bodies = []
+		for payload_file in arguments.payloads:
+			with open(payload_file, 'rb') as file_h:
+				bodies.append(file_h.read())
+	else:
+		bodies = None
+	failures = 0
+	for _ in range(arguments.count):
+		for body in (bodies or [json.dumps(sample_payload(arguments.event, arguments.repository, arguments.branch)).encode('utf-8')]):
+			status = post_payload(arguments.url, secret, arguments.event, body)
+			print("{0} delivery: HTTP {1}".format(arguments.event, status))
+			if status >= 300:
+				failures += 1
+	return 1 if failures else 0
+
+if __name__ == '__main__':
+	sys.exit(main())